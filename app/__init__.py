@@ -5,10 +5,9 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import os
+import time
 import flask_s3
-import boto3
 import sqlalchemy
-from botocore.client import Config
 from flasgger import Swagger
 from flask import Flask, session, request, g
 from flask_cors import CORS
@@ -18,9 +17,11 @@ from flask_oauthlib.client import OAuth
 from werkzeug.utils import import_string
 from werkzeug.exceptions import NotFound, Unauthorized, MethodNotAllowed, BadRequest
 from .database import db
+from .cache import LRUCache, PageCache, RefreshAheadCache
 from .logic import ma, User
 from app.auth.controllers import auth_blueprint, bitstore_blueprint
-from app.auth.jwt import JWT
+from app.bitstore import ObjectCache
+from app.auth.annotations import decode_token
 from app.package.controllers import package_blueprint
 from app.site.controllers import site_blueprint
 from app.profile.controllers import profile_blueprint
@@ -86,13 +87,33 @@ def create_app():
     app.register_blueprint(profile_blueprint)
     app.register_blueprint(search_blueprint)
     app.register_blueprint(bitstore_blueprint)
-    s3 = boto3.client('s3',
-                      region_name=app.config['AWS_REGION'],
-                      aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
-                      config=Config(signature_version='s3v4'),
-                      aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY']
-                      )
-    app.config['S3'] = s3
+    app.config['S3'] = import_string(app.config['BITSTORE_BACKEND'])(app.config)
+    app.config['OBJECT_CACHE'] = None
+    if app.config['BITSTORE_OBJECT_CACHE_ENABLED']:
+        app.config['OBJECT_CACHE'] = ObjectCache.from_config(app.config)
+
+    app.config['FRONT_PAGE_CACHE'] = RefreshAheadCache(
+        ttl=app.config['FRONT_PAGE_CACHE_TTL'])
+
+    app.config['JWT_CACHE'] = LRUCache(maxsize=app.config['JWT_CACHE_SIZE'])
+    app.config['ROLE_CACHE'] = LRUCache(maxsize=app.config['ROLE_CACHE_SIZE'],
+                                        ttl=app.config['ROLE_CACHE_TTL'])
+    app.config['USER_CACHE'] = LRUCache(maxsize=app.config['USER_CACHE_SIZE'],
+                                        ttl=app.config['USER_CACHE_TTL'])
+
+    app.config['PAGE_CACHE'] = None
+    if app.config['PAGE_CACHE_ENABLED']:
+        # pages changed by other processes are only invalidated through a
+        # shared store
+        if app.config['PAGE_CACHE_STORE'] or \
+                (app.config['PAGE_CACHE_SINGLE_PROCESS'] and
+                 app.config['PUBLISH_JOBS_INLINE'] and
+                 app.config['OUTBOX_INLINE']):
+            app.config['PAGE_CACHE'] = PageCache.from_config(app.config)
+        else:
+            app.logger.warning('Page cache disabled: PAGE_CACHE_STORE is '
+                               'required when several processes serve '
+                               'requests or run jobs')
 
     oauth = OAuth(app=app)
     CORS(app)
@@ -145,8 +166,16 @@ def create_app():
     def get_user_from_cookie():
         token = request.cookies.get('jwt')
         g.current_user = None
-        if token:
-            payload = JWT(app.config['JWT_SEED']).decode(token)
-            g.current_user = User.get(payload['user'])
+        if not token or (request.endpoint or '').endswith('static'):
+            return
+        user_cache = app.config['USER_CACHE']
+        g.current_user = user_cache.get(token)
+        if g.current_user is None:
+            payload = decode_token(token)
+            g.current_user = User.get_session_user(payload['user'])
+            if g.current_user is not None:
+                ttl = min(app.config['USER_CACHE_TTL'],
+                          payload['exp'] - time.time())
+                user_cache.set(token, g.current_user, ttl=ttl)
 
     return app
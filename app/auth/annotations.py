@@ -4,14 +4,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import hashlib
+import time
 from functools import wraps
 
 from flask import current_app as app
-from flask import request, _request_ctx_stack
+from flask import request, g, _request_ctx_stack
 
 from app.utils import InvalidUsage
 from app.auth.jwt import JWT
-from app.auth.authorization import is_authorize
+from app.auth.authorization import is_authorize, get_permissions
 from app.package.models import Package
 from app.profile.models import Publisher
 
@@ -19,12 +21,8 @@ from app.profile.models import Publisher
 def requires_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        status, data = get_user_from_jwt(request, app.config['JWT_SEED'])
-        if status:
-            _request_ctx_stack.top.current_user = data
-            return f(*args, **kwargs)
-        else:
-            return data
+        _request_ctx_stack.top.current_user = get_auth_context().payload
+        return f(*args, **kwargs)
     return decorated
 
 
@@ -32,10 +30,7 @@ def is_allowed(action):
     def wrapper(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
-            user_id, instance = None, None
-            jwt_status, user_info = get_user_from_jwt(request, app.config['JWT_SEED'])
-            if jwt_status:
-                user_id = user_info['user']
+            user_id = get_auth_context().user_id
             status = check_is_authorized(action, kwargs['publisher'], kwargs['package'], user_id)
             if not status:
                 raise InvalidUsage("The operation is not allowed", 403)
@@ -44,9 +39,23 @@ def is_allowed(action):
     return wrapper
 
 
-def get_user_from_jwt(req, api_key):
-    jwt_helper = JWT(api_key)
+class AuthContext(object):
+    """
+    Result of authenticating the current request, shared by the auth
+    decorators and views so the token is verified only once per request
+    """
+
+    def __init__(self, token, payload):
+        self.token = token
+        self.payload = payload
+
+    @property
+    def user_id(self):
+        return self.payload.get('user')
+
 
+def get_auth_context(req=None, api_key=None):
+    req = req or request
     token = req.headers.get('Authorization', None)
     if token is None:
         token = req.headers.get('Auth-Token', None)
@@ -55,10 +64,34 @@ def get_user_from_jwt(req, api_key):
 
     if not token:
         raise InvalidUsage('Authorization header is expected', 401)
-    try:
-        return True, jwt_helper.decode(token)
-    except Exception as e:
-        raise InvalidUsage(e.message, 400)
+
+    context = getattr(g, 'auth_context', None)
+    if context is None or context.token != token:
+        context = AuthContext(token, decode_token(token, api_key))
+        g.auth_context = context
+    return context
+
+
+def decode_token(token, api_key=None):
+    """
+    Verifies the token, remembering verified tokens by their hash until
+    they expire
+    """
+    api_key = api_key or app.config['JWT_SEED']
+    jwt_cache = app.config['JWT_CACHE']
+    key = hashlib.sha256((api_key + '.' + token).encode('utf-8')).hexdigest()
+    payload = jwt_cache.get(key)
+    if payload is None:
+        try:
+            payload = JWT(api_key).decode(token)
+        except Exception as e:
+            raise InvalidUsage(e.message, 400)
+        jwt_cache.set(key, payload, ttl=payload['exp'] - time.time())
+    return payload
+
+
+def get_user_from_jwt(req, api_key):
+    return True, get_auth_context(req, api_key).payload
 
 
 def check_is_authorized(action, publisher, package=None, user_id=None):
@@ -75,3 +108,28 @@ def check_is_authorized(action, publisher, package=None, user_id=None):
         raise InvalidUsage("{e} is not a valid one".format(e=entity_str), 401)
 
     return is_authorize(user_id, instance, action)
+
+
+def check_are_authorized(action, names, user_id=None):
+    """
+    Batch version of check_is_authorized.
+    :param names: (publisher, package) name pairs for Package actions or
+                  publisher names for Publisher actions
+    :return: dict of each name to True if the action is allowed
+    """
+    entity_str, action_str = action.split("::")
+    names = list(names)
+    if not names:
+        return {}
+
+    if entity_str == 'Package':
+        names = [tuple(name) for name in names]
+        instances = Package.get_many_by_publisher(names)
+    elif entity_str == 'Publisher':
+        instances = dict((instance.name, instance) for instance in
+                         Publisher.query.filter(Publisher.name.in_(names)))
+    else:
+        raise InvalidUsage("{e} is not a valid one".format(e=entity_str), 401)
+
+    permissions = get_permissions(user_id, list(instances.values()) + [None], action)
+    return dict((name, permissions[instances.get(name)]) for name in names)
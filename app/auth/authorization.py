@@ -4,6 +4,11 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from flask import current_app as app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.database import db
 from app.package.models import Package
 from app.profile.models import User, Publisher, PublisherUser, UserRoleEnum
 
@@ -37,62 +42,190 @@ roles_action_mappings = {
 }
 
 
+role_actions = dict(
+    (parent, dict((role, frozenset(actions)) for role, actions in roles.items()))
+    for parent, roles in roles_action_mappings.items())
+
+member_roles = {
+    UserRoleEnum.owner: 'Owner',
+    UserRoleEnum.member: 'Editor'
+}
+
+
+def _build_entity_actions():
+    """
+    Precomputes the actions of a logged in user on a publisher or package
+    for every (entity, role, private) combination
+    """
+    entity_actions = {}
+    for parent in ('Publisher', 'Package'):
+        for private in (True, False):
+            non_member = role_actions['System']['LoggedIn']
+            if not private:
+                non_member = non_member | role_actions[parent]['Viewer']
+            entity_actions[(parent, None, private)] = non_member
+            for role, role_name in member_roles.items():
+                entity_actions[(parent, role, private)] = \
+                    role_actions[parent][role_name]
+    return entity_actions
+
+entity_actions = _build_entity_actions()
+
+_missing = object()
+
+
 def is_authorize(user_id, entity, action):
     actions = get_user_actions(user_id, entity)
     return action in actions
 
 
-def get_user_actions(user_id, entity):
-    local_roles = []
-    user = None
+def get_permissions(user_id, entities, action):
+    """
+    Checks the action for many publishers or packages at once. Roles in
+    all their publishers are resolved with a single query.
+    :return: dict of entity to True if the action is allowed
+    """
+    roles = None
+    if user_id is not None and is_sysadmin(user_id) is False:
+        publisher_ids = set()
+        for entity in entities:
+            if isinstance(entity, Publisher):
+                publisher_ids.add(entity.id)
+            elif isinstance(entity, Package):
+                publisher_ids.add(entity.publisher_id)
+        roles = get_user_roles(user_id, publisher_ids)
+    return dict((entity, action in get_user_actions(user_id, entity, roles))
+                for entity in entities)
+
+
+def get_user_actions(user_id, entity, roles=None):
+    sysadmin, role = None, None
     if user_id is not None:
-        user = User.query.get(user_id)
-    if user is None:
+        sysadmin = is_sysadmin(user_id)
+    if sysadmin is False and isinstance(entity, (Publisher, Package)):
+        publisher_id = entity.id if isinstance(entity, Publisher) \
+            else entity.publisher_id
+        role = roles[publisher_id] if roles is not None \
+            else get_user_role(user_id, publisher_id)
+    return resolve_actions(entity, sysadmin, role)
+
+
+def resolve_actions(entity, sysadmin, role):
+    """
+    Actions allowed on the entity for an already resolved user.
+    :param sysadmin: None for anonymous users, else the sysadmin flag
+    :param role: UserRoleEnum of the user in the entity publisher or None
+    """
+    if sysadmin is None:
         if entity is not None and entity.private is False:
-            local_roles.extend(roles_action_mappings['System']['Anonymous'])
-    else:
-        if user.sysadmin is True:
-            local_roles.extend(roles_action_mappings['System']['Sysadmin'])
+            return role_actions['System']['Anonymous']
+        return frozenset()
+    if sysadmin is True:
+        return role_actions['System']['Sysadmin']
+    if isinstance(entity, Publisher):
+        return entity_actions[('Publisher', role, entity.private is True)]
+    if isinstance(entity, Package):
+        return entity_actions[('Package', role, entity.private is True)]
+    if entity is None:
+        return role_actions['System']['LoggedIn']
+    return frozenset()
+
+
+def is_sysadmin(user_id):
+    """
+    :return: sysadmin flag of the user or None if the user does not exist
+    """
+    return _memoize(('sysadmin', user_id), lambda: _load_sysadmin(user_id))
+
+
+def get_user_role(user_id, publisher_id):
+    """
+    :return: UserRoleEnum of the user in the publisher or None if the user
+             is not a member
+    """
+    return _memoize(('role', user_id, publisher_id),
+                    lambda: _load_role(user_id, publisher_id))
+
+
+def get_user_roles(user_id, publisher_ids):
+    """
+    :return: dict of publisher id to the UserRoleEnum of the user or None
+    """
+    role_cache = app.config.get('ROLE_CACHE') if has_app_context() else None
+    roles, missing = {}, set()
+    for publisher_id in publisher_ids:
+        role = _missing
+        if role_cache is not None:
+            role = role_cache.get(('role', user_id, publisher_id), _missing)
+        if role is _missing:
+            missing.add(publisher_id)
         else:
-            if isinstance(entity, Publisher):
-                local_roles.extend(get_publisher_roles(user_id=user_id, entity=entity))
-            if isinstance(entity, Package):
-                local_roles.extend(get_package_roles(user_id=user_id, entity=entity))
-            elif entity is None:
-                local_roles.extend(roles_action_mappings['System']['LoggedIn'])
-    return local_roles
-
-
-def get_publisher_roles(user_id, entity):
-    role_parent = 'Publisher'
-    publisher_roles = []
-    try:
-        user_role = PublisherUser.query.join(User).join(Publisher)\
-            .filter(User.id == user_id, Publisher.name == entity.name).one()
-        if user_role.role == UserRoleEnum.owner:
-            publisher_roles.extend(roles_action_mappings[role_parent]['Owner'])
-        elif user_role.role == UserRoleEnum.member:
-            publisher_roles.extend(roles_action_mappings[role_parent]['Editor'])
-    except:
-        publisher_roles.extend(roles_action_mappings['System']['LoggedIn'])
-        if entity.private is not True:
-            publisher_roles.extend(roles_action_mappings[role_parent]['Viewer'])
-    return publisher_roles
-
-
-def get_package_roles(user_id, entity):
-    role_parent = 'Package'
-    package_roles = []
-    try:
-        user_role = PublisherUser.query.join(User).join(Publisher)\
-            .filter(User.id == user_id, Publisher.name == entity.publisher.name)\
-            .one()
-        if user_role.role == UserRoleEnum.owner:
-            package_roles.extend(roles_action_mappings[role_parent]['Owner'])
-        elif user_role.role == UserRoleEnum.member:
-            package_roles.extend(roles_action_mappings[role_parent]['Editor'])
-    except:
-        package_roles.extend(roles_action_mappings['System']['LoggedIn'])
-        if entity.private is not True:
-            package_roles.extend(roles_action_mappings[role_parent]['Viewer'])
-    return package_roles
+            roles[publisher_id] = role
+    if missing:
+        loaded = dict(db.session.query(PublisherUser.publisher_id,
+                                       PublisherUser.role)
+                      .filter(PublisherUser.user_id == user_id,
+                              PublisherUser.publisher_id.in_(missing)).all())
+        for publisher_id in missing:
+            roles[publisher_id] = loaded.get(publisher_id)
+            if role_cache is not None:
+                role_cache.set(('role', user_id, publisher_id),
+                               roles[publisher_id])
+    return roles
+
+
+def _load_sysadmin(user_id):
+    user = db.session.query(User.sysadmin).filter(User.id == user_id).first()
+    if user is None:
+        return None
+    return user.sysadmin is True
+
+
+def _load_role(user_id, publisher_id):
+    user_role = db.session.query(PublisherUser.role)\
+        .filter(PublisherUser.user_id == user_id,
+                PublisherUser.publisher_id == publisher_id).first()
+    if user_role is None:
+        return None
+    return user_role.role
+
+
+def _memoize(key, loader):
+    role_cache = app.config.get('ROLE_CACHE') if has_app_context() else None
+    if role_cache is None:
+        return loader()
+    value = role_cache.get(key, _missing)
+    if value is _missing:
+        value = loader()
+        role_cache.set(key, value)
+    return value
+
+
+def invalidate_user_roles(user_id, publisher_id=None):
+    if not has_app_context() or app.config.get('ROLE_CACHE') is None:
+        return
+    role_cache = app.config['ROLE_CACHE']
+    role_cache.delete(('sysadmin', user_id))
+    if publisher_id is not None:
+        role_cache.delete(('role', user_id, publisher_id))
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_memberships(session, flush_context):
+    changed = session.info.setdefault('role_cache_keys', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, PublisherUser):
+            changed.add((instance.user_id, instance.publisher_id))
+        elif isinstance(instance, User):
+            changed.add((instance.id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_memberships(session):
+    for user_id, publisher_id in session.info.pop('role_cache_keys', ()):
+        invalidate_user_roles(user_id, publisher_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_memberships(session):
+    session.info.pop('role_cache_keys', None)
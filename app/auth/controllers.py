@@ -4,11 +4,15 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from botocore.exceptions import ClientError
 from flask import Blueprint, jsonify, session, request, g, make_response, render_template
+from flask import send_file
 from flask import current_app as app
 import app.logic as logic
 import app.auth.jwt as jwt
-from app.auth.annotations import get_user_from_jwt
+from app.auth.annotations import get_auth_context
+from app.bitstore import LocalStore
+from app.utils import InvalidUsage
 
 auth_blueprint = Blueprint('auth', __name__, url_prefix='/api/auth')
 bitstore_blueprint = Blueprint('bitstore', __name__, url_prefix='/api/datastore')
@@ -139,17 +143,160 @@ def authorize_upload():
                 properties:
                     filedata:
                         type: map
-                        description: Signed url and upload_query
+                        description: Signed url and upload_query, or the
+                                     part urls of files uploaded in multiple
+                                     parts
         400:
             description: Unauthorized
+        409:
+            description: The package has pending changes
         500:
             description: Internal Server Error
     """
-    user_id = None
-    jwt_status, user_info = get_user_from_jwt(request, app.config['JWT_SEED'])
-    if jwt_status:
-        user_id = user_info['user']
+    user_id = get_auth_context().user_id
 
     data = request.get_json()
     payload = logic.generate_signed_url(user_id, data)
     return jsonify(payload), 200
+
+
+@bitstore_blueprint.route('/multipart/complete', methods=['POST'])
+def complete_multipart_upload():
+    """
+    Completes the multipart upload of a file authorized with a size over
+    BITSTORE_MULTIPART_UPLOAD_THRESHOLD, once all its parts are uploaded
+    ---
+    tags:
+        - package
+    parameters:
+        - in: body
+          name: data
+          type: map
+          required: true
+          description: publisher name, package name, key and upload_id of
+                       the upload and the part_number and etag of every part
+    responses:
+        200:
+            description: Success
+            schema:
+                id: complete_multipart_upload
+                properties:
+                    key:
+                        type: string
+                    etag:
+                        type: string
+        400:
+            description: Unauthorized or invalid upload
+        500:
+            description: Internal Server Error
+    """
+    user_id = get_auth_context().user_id
+
+    data = request.get_json()
+    payload = logic.complete_multipart_upload(user_id, data)
+    return jsonify(payload), 200
+
+
+@bitstore_blueprint.route('/upload', methods=['POST'])
+def local_upload():
+    """
+    Receives the files posted with the urls generated by the local
+    filesystem backend, standing in for S3 presigned posts
+    ---
+    tags:
+        - package
+    parameters:
+        - in: formData
+          name: file
+          type: file
+          required: true
+          description: file content, after the fields of the presigned post
+    responses:
+        204:
+            description: Stored
+        400:
+            description: Content does not match its Content-MD5
+        403:
+            description: Invalid or expired signature
+        404:
+            description: Not using the local backend
+    """
+    store = app.config['S3']
+    if not isinstance(store, LocalStore):
+        raise InvalidUsage('Not found', 404)
+    fields = request.form.to_dict()
+    if not store.verify_post(fields):
+        raise InvalidUsage('Invalid or expired signature', 403)
+    if 'file' not in request.files:
+        raise InvalidUsage('file not found', 400)
+    if not store.save_post(fields, request.files['file'].stream):
+        raise InvalidUsage('Content-MD5 does not match the content', 400)
+    return '', 204
+
+
+@bitstore_blueprint.route('/upload/part', methods=['PUT'])
+def local_upload_part():
+    """
+    Receives the parts put with the upload_part urls generated by the local
+    filesystem backend, standing in for S3 multipart uploads
+    ---
+    tags:
+        - package
+    parameters:
+        - in: body
+          name: part
+          required: true
+          description: content of the part
+    responses:
+        200:
+            description: Stored, the ETag header holds the md5 of the part
+        403:
+            description: Invalid or expired signature
+        404:
+            description: Not using the local backend or unknown upload
+    """
+    store = app.config['S3']
+    if not isinstance(store, LocalStore):
+        raise InvalidUsage('Not found', 404)
+    args = request.args.to_dict()
+    if not store.verify_part(args):
+        raise InvalidUsage('Invalid or expired signature', 403)
+    try:
+        response = store.upload_part(Bucket=app.config['S3_BUCKET_NAME'],
+                                     Key=args['key'],
+                                     UploadId=args['uploadId'],
+                                     PartNumber=int(args['partNumber']),
+                                     Body=request.stream)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchUpload':
+            raise
+        raise InvalidUsage('Upload not found', 404)
+    resp = make_response('', 200)
+    resp.headers['ETag'] = response['ETag']
+    return resp
+
+
+@bitstore_blueprint.route('/objects/<path:key>', methods=['GET'])
+def local_object(key):
+    """
+    Serves the public objects of the local filesystem backend
+    ---
+    tags:
+        - package
+    responses:
+        200:
+            description: Object content
+        404:
+            description: Not found, not public or not using the local backend
+    """
+    store = app.config['S3']
+    if not isinstance(store, LocalStore):
+        raise InvalidUsage('Not found', 404)
+    try:
+        public = store.get_meta(key)['acl'] == 'public-read'
+    except ClientError:
+        public = False
+    if not public:
+        raise InvalidUsage('Not found', 404)
+    return send_file(store.path(key), conditional=True,
+                     mimetype='text/plain')
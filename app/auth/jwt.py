@@ -53,25 +53,41 @@ class JWT(object):
 class FileData(object):
 
     def __init__(self, package_name, publisher,
-                 relative_path, props):
+                 relative_path, props, key=None):
         self.package_name = package_name
         self.publisher = publisher
         self.relative_path = relative_path
         self.props = props
+        self.key = key
         self.bitstore = BitStore(publisher=publisher,
                                  package=package_name)
 
-    def _generate_bitstore_url(self):
-        kwargs = {}
+    def upload_params(self):
+        """
+        :return: the arguments of
+                 :func:`~app.bitstore.BitStore.generate_pre_signed_post_object`
+                 for the file
+        """
+        params = dict(md5=self.props['md5'], path=self.relative_path)
         if 'acl' in self.props:
-            kwargs['acl'] = self.props['acl']
-        post = self.bitstore.\
-            generate_pre_signed_post_object(md5=self.props['md5'],
-                                            path=self.relative_path,
-                                            **kwargs)
-        return post
+            params['acl'] = self.props['acl']
+        if self.key is not None:
+            params['key'] = self.key
+        return params
+
+    def _generate_bitstore_url(self):
+        return self.bitstore.\
+            generate_pre_signed_post_object(**self.upload_params())
 
-    def build_file_information(self):
+    def build_file_information(self, exists=False, post=None,
+                               multipart=None):
+        """
+        :param exists: True if the file is already stored with the same md5,
+                       no upload url is generated for it then
+        :param post: The presigned post of the file, generated if None
+        :param multipart: The key, upload_id, part_size and part urls of the
+                          file when it is uploaded in multiple parts
+        """
         response = {
             'name': self.props['name'],
             'md5': self.props['md5'],
@@ -80,8 +96,16 @@ class FileData(object):
             response['type'] = self.props['type']
         if 'acl' in self.props:
             response['acl'] = self.props['acl']
+        if exists:
+            response['exists'] = True
+            return response
+
+        if multipart is not None:
+            response['multipart'] = multipart
+            return response
 
-        post = self._generate_bitstore_url()
+        if post is None:
+            post = self._generate_bitstore_url()
         response['upload_url'] = post['url']
         response['upload_query'] = post['fields']
         return response
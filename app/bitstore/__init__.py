@@ -0,0 +1,792 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import base64
+import binascii
+import hashlib
+import json
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from flask import current_app as app
+from botocore.exceptions import ClientError
+
+from app.bitstore.cache import ObjectCache
+from app.bitstore.local import ALL_USERS_URI, LocalStore, is_valid_key
+from app.bitstore.s3 import S3Client
+
+RETRYABLE_ERROR_CODES = ('RequestTimeout', 'SlowDown', 'Throttling',
+                         'ThrottlingException', 'RequestLimitExceeded',
+                         'InternalError', 'ServiceUnavailable')
+
+# maximum number of parts of a multipart upload allowed by S3 and the
+# errors of completing an upload caused by the parts sent by the client
+MAX_UPLOAD_PARTS = 10000
+MULTIPART_ERROR_CODES = ('NoSuchUpload', 'InvalidPart', 'InvalidPartOrder',
+                         'EntityTooSmall')
+
+# botocore raises a ClientError for the 304 of a conditional get
+NOT_MODIFIED_ERROR_CODES = ('304', 'NotModified')
+
+
+class BitStoreError(Exception):
+    """
+    Raised when some of the objects of a bulk S3 operation failed.
+    ``errors`` holds the (key, exception) pair of every failure.
+    """
+
+    def __init__(self, message, errors=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.errors = errors or []
+
+
+class ObjectTooLargeError(BitStoreError):
+    """
+    Raised when an object read into memory is bigger than allowed
+    """
+
+    def __init__(self, key, max_size):
+        BitStoreError.__init__(
+            self, '{key} is larger than {max_size} bytes'
+            .format(key=key, max_size=max_size))
+        self.key = key
+        self.max_size = max_size
+
+
+class BitStore(object):
+    """
+    This model responsible for interaction with S3
+    """
+    prefix = 'metadata'
+    # delete_objects accepts at most 1000 keys per request
+    delete_batch_size = 1000
+    manifest_name = '_manifest.json'
+    upload_name = '_upload.json'
+
+    def __init__(self, publisher, package, version='latest', body=None):
+        self.publisher = publisher
+        self.package = package
+        self.version = version
+        self.body = body
+
+    def validate(self):
+        data = json.loads(self.body)
+        if 'name' not in data:
+            return False
+        if data['name'] == '':
+            return False
+        return True
+
+    def save_metadata(self, acl='public-read'):
+        """
+        This method put metadata object to S3
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        key = self.build_s3_key('datapackage.json')
+        s3_client.put_object(Bucket=bucket_name, Key=key,
+                             Body=self.body, ACL=acl)
+        forget_cached(key)
+
+    def get_metadata_body(self):
+        """
+        This method retrieve datapackage.json from s3 for specific
+        publisher and package
+        :return: The String value of the datapackage.json or None if not found
+        """
+        key = self.build_s3_key('datapackage.json')
+        return self.get_s3_object(
+            key, max_size=app.config['BITSTORE_MAX_DESCRIPTOR_SIZE'])
+
+    def get_s3_object(self, key, max_size=None):
+        """
+        This method retrieve any object from s3 for a given key.
+        The body is read in chunks and never more than max_size bytes are
+        kept in memory. Small objects are kept in the OBJECT_CACHE and
+        revalidated with their ETag, so unchanged objects aren't downloaded
+        again.
+        :param key: Object key to be retrieved
+        :param max_size: Maximum size in bytes, BITSTORE_MAX_OBJECT_SIZE
+                         if None
+        :return: The String value of the object or None of not found
+        :raises ObjectTooLargeError: if the object is bigger than max_size
+        """
+        if max_size is None:
+            max_size = app.config['BITSTORE_MAX_OBJECT_SIZE']
+        cache = app.config.get('OBJECT_CACHE')
+        entry = cache.get(key) if cache is not None else None
+        if entry is not None and cache.is_fresh(entry):
+            return cached_body(entry, key, max_size)
+        params = dict(Bucket=app.config['S3_BUCKET_NAME'], Key=key)
+        if entry is not None:
+            params['IfNoneMatch'] = entry['etag']
+        try:
+            response = app.config['S3'].get_object(**params)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if entry is not None and code in NOT_MODIFIED_ERROR_CODES:
+                return cached_body(cache.touch(key, entry), key, max_size)
+            if code != 'NoSuchKey':
+                raise e
+            if cache is not None:
+                cache.delete(key)
+            return None
+        body = read_limited(response, key, max_size)
+        if cache is not None:
+            cache.set(key, response.get('ETag'), body)
+        return body
+
+    def get_readme_object_key(self):
+        """
+        This method search for any readme object is present for the
+        generated prefix by:
+        >>> BitStore.build_s3_key()
+        :return: Value of the readme key if found else None
+        :rtype: None or Str
+        """
+        manifest = self.get_manifest()
+        if manifest is not None:
+            return manifest['readme'] or 'None'
+        return find_readme_key(self.iter_keys(self.build_s3_key(''))) or 'None'
+
+    def build_manifest(self):
+        """
+        This method lists the objects of the version once to describe
+        its content, see :func:`~app.bitstore.BitStore.save_manifest`
+        :return: dict with the key, size and md5 of every file and the
+                 readme key
+        """
+        internal_keys = (self.build_s3_key(self.manifest_name),
+                         self.build_s3_key(self.upload_name))
+        files = [dict(key=ob['Key'], size=ob['Size'],
+                      md5=ob.get('ETag', '').strip('"'))
+                 for ob in self.iter_objects(self.build_s3_key(''))
+                 if ob['Key'] not in internal_keys]
+        # the ETag of multipart objects isn't their md5, the one declared
+        # in the upload record is used instead
+        multipart = any('-' in f['md5'] for f in files)
+        if app.config['BITSTORE_CONTENT_ADDRESSED'] or multipart:
+            upload = self.get_s3_object(self.build_s3_key(self.upload_name))
+            recorded = json.loads(upload)['files'] if upload else []
+            md5s = dict((f['key'], f['md5']) for f in recorded
+                        if 'path' not in f)
+            for f in files:
+                if '-' in f['md5'] and f['key'] in md5s:
+                    f['md5'] = md5s[f['key']]
+            files.extend(f for f in recorded if 'path' in f)
+        # content addressed files are matched on their relative path, the
+        # readme is read from their blob key
+        keys = dict((f.get('path', f['key']), f['key']) for f in files)
+        readme = find_readme_key(f.get('path', f['key']) for f in files)
+        return dict(version=self.version, files=files,
+                    readme=readme and keys[readme])
+
+    def build_s3_blob_key(self, md5):
+        """
+        Key of a file in the content addressed layout, shared by every
+        version of the package
+        :param md5: hex md5 of the file
+        """
+        return "{prefix}/_blobs/{md5}".format(
+            prefix=self.build_s3_base_prefix(), md5=md5)
+
+    def get_blob_keys(self):
+        return set(self.iter_keys(self.build_s3_blob_key('')))
+
+    def get_blob_urls(self, manifest):
+        """
+        This method maps the relative path of every content addressed file
+        of the manifest to its url
+        """
+        return dict((f['path'], '{base_url}/{key}'.format(
+            base_url=app.config['BITSTORE_URL'], key=f['key']))
+            for f in manifest['files'] if 'path' in f)
+
+    def save_upload(self, files):
+        """
+        This method records the content addressed files of an upload in
+        progress, which are not under the version prefix, so they are
+        added to the manifest on finalize, and the md5 of the files uploaded
+        in multiple parts.
+        :param files: list of dicts with the key and md5, and the relative
+                      path of content addressed files
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        key = self.build_s3_key(self.upload_name)
+        s3_client.put_object(Bucket=bucket_name, Key=key,
+                             Body=json.dumps(dict(files=files)), ACL='private')
+        forget_cached(key)
+
+    def save_manifest(self, manifest=None, acl='public-read'):
+        """
+        This method stores the manifest of the version next to its files,
+        so later operations know the content without listing S3.
+        :param manifest: The manifest to store, built from a listing if None
+        :return: The stored manifest
+        """
+        if manifest is None:
+            manifest = self.build_manifest()
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        key = self.build_s3_key(self.manifest_name)
+        s3_client.put_object(Bucket=bucket_name, Key=key,
+                             Body=json.dumps(manifest), ACL=acl)
+        forget_cached(key)
+        return manifest
+
+    def get_manifest(self):
+        """
+        This method retrieve the manifest of the version
+        :return: The manifest dict or None for versions published before
+                 manifests were introduced
+        """
+        body = self.get_s3_object(self.build_s3_key(self.manifest_name))
+        if body is None:
+            return None
+        return json.loads(body)
+
+    def get_file_md5s(self, manifest):
+        """
+        This method maps the path of every file of the manifest, relative to
+        the version prefix, to its hex md5
+        """
+        if manifest is None:
+            return {}
+        prefix = self.build_s3_key('') + '/'
+        md5s = {}
+        for f in manifest['files']:
+            if 'path' in f:
+                md5s[f['path']] = f['md5']
+            elif f['key'].startswith(prefix):
+                md5s[f['key'][len(prefix):]] = f['md5']
+        return md5s
+
+    def get_content_hash(self, manifest):
+        """
+        This method hashes the relative path and md5 of every file of the
+        manifest. The hash only changes when some file was added, removed
+        or modified.
+        """
+        files = sorted(self.get_file_md5s(manifest).items())
+        return hashlib.sha256(json.dumps(files).encode('utf-8')).hexdigest()
+
+    def get_version_objects(self):
+        """
+        This method returns the key and size of every object of the version,
+        read from the manifest or listed from S3 if there is none or it
+        can't be read, e.g. versions published before manifests.
+        """
+        try:
+            manifest = self.get_manifest()
+        except ValueError as e:
+            app.logger.error('Invalid manifest of %s: %s',
+                             self.build_s3_versioned_prefix(), e)
+            manifest = None
+        if manifest is None:
+            return [dict(key=ob['Key'], size=ob['Size']) for ob in
+                    self.iter_objects(self.build_s3_versioned_prefix() + '/')]
+        return manifest['files'] + [dict(
+            key=self.build_s3_key(self.manifest_name), size=None)]
+
+    def get_all_metadata_name_for_publisher(self):
+        return list(self.iter_keys(self.build_s3_base_prefix()))
+
+    @staticmethod
+    def iter_objects(prefix, page_size=1000, start_after=None):
+        """
+        This method yields every object stored under the prefix, following
+        the list_objects_v2 continuation tokens so listings are not cut
+        at the first 1000 keys.
+        :param prefix: Key prefix to list
+        :param page_size: Maximum number of keys requested per page
+        :param start_after: Only list the keys sorted after this one
+        :return: Generator of the object summaries returned by S3, sorted
+                 by key
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        kwargs = dict(Bucket=bucket_name, Prefix=prefix, MaxKeys=page_size)
+        if start_after is not None:
+            kwargs['StartAfter'] = start_after
+        while True:
+            response = s3_client.list_objects_v2(**kwargs)
+            for ob in response.get('Contents', []):
+                yield ob
+            if not response.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    @classmethod
+    def iter_keys(cls, prefix, page_size=1000):
+        """
+        This method yields every key stored under the prefix.
+        See :func:`~app.bitstore.BitStore.iter_objects`
+        """
+        for ob in cls.iter_objects(prefix, page_size=page_size):
+            yield ob['Key']
+
+    def build_s3_key(self, path=None):
+        if not path:
+            return self.build_s3_versioned_prefix()
+        return "{prefix}/{path}"\
+            .format(prefix=self.build_s3_versioned_prefix(),
+                    path=path)
+
+    def build_s3_base_prefix(self):
+        return "{prefix}/{publisher}/{package}".\
+            format(prefix=self.prefix,
+                   publisher=self.publisher,
+                   package=self.package)
+
+    def build_s3_versioned_prefix(self):
+        return "{prefix}/_v/{version}". \
+            format(prefix=self.build_s3_base_prefix(),
+                   version=self.version)
+
+    def build_s3_object_url(self, path=None):
+        return '{base_url}/{key}'.\
+            format(base_url=app.config['BITSTORE_URL'],
+                   key=self.build_s3_key(path))
+
+    def generate_pre_signed_post_object(self, md5, path=None,
+                                        acl='public-read', key=None):
+        """
+        This method produce required data to upload file from client side
+        for uploading data at client side. The Content-Type is set to
+        text/plain for any type of file. This will avoid security risks (e.g.
+        someone uploading html with malicious JS in it and then users
+        opening that file as html).
+
+        :param path: The relative path of the object
+        :param md5: The md5 hash of the file to be uploaded
+
+        :param acl: The object ACL default is public_read
+        :param key: The object key, built from the path if None
+        :return: dict containing S3 url and post params
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        return s3_client.generate_presigned_post(
+            Bucket=bucket_name, **self.build_post(md5, path, acl, key))
+
+    def generate_pre_signed_posts(self, uploads):
+        """
+        Batch version of
+        :func:`~app.bitstore.BitStore.generate_pre_signed_post_object`,
+        the storage backend signs all the posts at once.
+        :param uploads: list of dicts with the md5 and the path, acl or key
+                        of every object
+        :return: list of dicts containing S3 url and post params, in the
+                 order of uploads
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        return s3_client.generate_presigned_posts(
+            Bucket=bucket_name,
+            Posts=[self.build_post(**upload) for upload in uploads])
+
+    def build_post(self, md5, path=None, acl='public-read', key=None):
+        """
+        :return: dict with the Key, Fields and Conditions of the presigned
+                 post of an object
+        """
+        return dict(Key=key or self.build_s3_key(path),
+                    Fields={
+                        'acl': acl,
+                        'Content-MD5': str(md5),
+                        'Content-Type': 'text/plain'},
+                    Conditions=[
+                        {"acl": "public-read"},
+                        ["starts-with", "$Content-Type", ""],
+                        ["starts-with", "$Content-MD5", ""]
+                    ])
+
+    def create_multipart_upload(self, key, acl='public-read'):
+        """
+        This method starts a multipart upload, for files too big for a
+        presigned post or uploaded in parallel parts. The Content-Type is
+        text/plain as for presigned posts.
+        :return: The id of the upload
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        response = s3_client.create_multipart_upload(
+            Bucket=bucket_name, Key=key, ACL=acl, ContentType='text/plain')
+        return response['UploadId']
+
+    def generate_upload_part_urls(self, key, upload_id, part_numbers,
+                                  expires_in=3600):
+        """
+        This method presigns the PUT url of parts of a multipart upload
+        :param part_numbers: numbers of the parts, starting at 1
+        :return: list of dicts with the part_number and url of every part
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        return [dict(part_number=number, url=s3_client.generate_presigned_url(
+            'upload_part', ExpiresIn=expires_in,
+            Params=dict(Bucket=bucket_name, Key=key, UploadId=upload_id,
+                        PartNumber=number)))
+            for number in part_numbers]
+
+    def get_uploaded_parts(self, key, upload_id):
+        """
+        This method lists the parts already stored for a multipart upload,
+        so an interrupted upload can be resumed
+        :return: list of dicts with the part_number, etag and size of every
+                 part
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        params = dict(Bucket=bucket_name, Key=key, UploadId=upload_id)
+        parts = []
+        while True:
+            response = s3_client.list_parts(**params)
+            parts.extend(dict(part_number=part['PartNumber'],
+                              etag=part['ETag'], size=part['Size'])
+                         for part in response.get('Parts', []))
+            if not response.get('IsTruncated'):
+                return parts
+            params['PartNumberMarker'] = response['NextPartNumberMarker']
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        """
+        This method assembles the uploaded parts into the object
+        :param parts: list of dicts with the part_number and etag of every
+                      part
+        :return: The ETag of the object
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        parts = sorted(parts, key=lambda part: part['part_number'])
+        response = s3_client.complete_multipart_upload(
+            Bucket=bucket_name, Key=key, UploadId=upload_id,
+            MultipartUpload=dict(Parts=[
+                dict(PartNumber=part['part_number'], ETag=part['etag'])
+                for part in parts]))
+        return response['ETag']
+
+    def delete_data_package(self):
+        """
+        This method will delete all objects with the prefix
+        generated by :func:`~app.mod_api.models.build_s3_prefix`.
+        This method is used for Hard delete data packages.
+        Keys are deleted in concurrent batches of ``delete_batch_size``.
+        :return: Status True if able to delete
+        :raises BitStoreError: with the keys that could not be deleted
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        lock = threading.Lock()
+        failed = []
+
+        def delete_batch(batch):
+            response = s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete=dict(Objects=[dict(Key=key) for key in batch],
+                            Quiet=True))
+            with lock:
+                failed.extend((error['Key'], error.get('Message', error['Code']))
+                              for error in response.get('Errors', []))
+
+        # the trailing slash keeps packages sharing a name prefix apart
+        keys = self.iter_keys(self.build_s3_base_prefix() + '/')
+        batches = iter_chunks(keys, self.delete_batch_size)
+        try:
+            self.map_keys(delete_batch, batches, 'delete')
+        except BitStoreError as e:
+            failed.extend((key, error) for batch, error in e.errors
+                          for key in batch)
+        if failed:
+            raise BitStoreError('Failed to delete {n} objects: {e}'
+                                .format(n=len(failed), e=failed[0][1]),
+                                failed)
+        return True
+
+
+    def get_acl(self, key):
+        """
+        This method reads the canned ACL of an object back from its grants
+        :return: public-read if everyone can read the object, else private
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        response = s3_client.get_object_acl(Bucket=bucket_name, Key=key)
+        for grant in response.get('Grants', []):
+            if grant['Grantee'].get('URI') == ALL_USERS_URI \
+                    and grant['Permission'] in ('READ', 'FULL_CONTROL'):
+                return 'public-read'
+        return 'private'
+
+    def change_acl(self, acl, versions=None):
+        """
+        This method will change access for all objects with the prefix
+        generated by :func:`~app.mod_api.models.build_s3_prefix`.
+        This method is used for Soft delete data packages.
+        :param versions: Only change the objects of these versions, found
+                         from their manifests, or listed for versions
+                         without one. All objects under the package prefix
+                         are listed if None
+        :return: Status True if able to delete or False if exception
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+
+        def put_acl(key):
+            s3_client.put_object_acl(Bucket=bucket_name, Key=key, ACL=acl)
+
+        if versions is None:
+            keys = self.iter_keys(self.build_s3_base_prefix() + '/')
+        else:
+            keys = [ob['key'] for version in versions for ob in
+                    BitStore(self.publisher, self.package, version)
+                    .get_version_objects()]
+        self.map_keys(put_acl, keys, 'change acl of')
+        return True
+
+    def copy_to_new_version(self, version, progress=None, acl='public-read'):
+        """
+        This method copies all objects of the current version to the
+        given version concurrently, see :func:`~app.bitstore.BitStore.map_keys`.
+        :param version: The version to copy the objects to
+        :param progress: Optional callable receiving the copied key and the
+                         number of copied and total objects after each copy
+        :param acl: ACL of the copies, S3 doesn't copy the one of the source
+        :return: True once all objects are copied
+        """
+        bucket_name = app.config['S3_BUCKET_NAME']
+        s3_client = app.config['S3']
+        threshold = app.config['BITSTORE_MULTIPART_COPY_THRESHOLD']
+        part_size = app.config['BITSTORE_COPY_PART_SIZE']
+        prefix = self.build_s3_versioned_prefix()
+        target = BitStore(self.publisher, self.package, version)
+        manifest = self.get_manifest()
+        if manifest is None:
+            sizes = dict((ob['Key'], ob['Size']) for ob in
+                         self.iter_objects(prefix))
+        else:
+            # content addressed blobs are shared by the versions, only the
+            # files under the version prefix need a copy
+            sizes = dict((f['key'], f['size']) for f in manifest['files']
+                         if f['key'].startswith(prefix + '/'))
+        lock = threading.Lock()
+        copied = []
+
+        def versioned(key):
+            if not key.startswith(prefix + '/'):
+                return key
+            return target.build_s3_versioned_prefix() + key[len(prefix):]
+
+        def copy(key):
+            versioned_key = versioned(key)
+            copy_source = {'Bucket': bucket_name, 'Key': key}
+            if sizes[key] > threshold:
+                multipart_copy(s3_client, bucket_name, versioned_key,
+                               copy_source, sizes[key], part_size, acl=acl)
+            else:
+                s3_client.copy_object(Bucket=bucket_name,
+                                      Key=versioned_key,
+                                      CopySource=copy_source, ACL=acl)
+            if progress is not None:
+                with lock:
+                    copied.append(key)
+                    progress(key, len(copied), len(sizes))
+
+        self.map_keys(copy, sizes, 'copy')
+        if manifest is not None:
+            manifest = dict(manifest, version=version,
+                            readme=manifest['readme'] and
+                            versioned(manifest['readme']),
+                            files=[dict(f, key=versioned(f['key']))
+                                   for f in manifest['files']])
+            target.save_manifest(manifest)
+        return True
+
+    @staticmethod
+    def map_keys(func, keys, operation='process'):
+        """
+        This method calls func for every key from a bounded thread pool,
+        retrying throttled or failed calls with exponential backoff. Keys
+        are read lazily, at most two per worker at a time, so listings of
+        any size are processed without being loaded into memory. The
+        connection pool stats of the client are logged after each run.
+        :param func: Callable taking a key. It must not rely on the flask
+                     app context, as it runs outside of it
+        :param keys: Iterable of keys
+        :param operation: Description of func used in the error message
+        :raises BitStoreError: if func still fails for some keys
+        """
+        max_workers = app.config['BITSTORE_MAX_WORKERS']
+        max_retries = app.config['BITSTORE_MAX_RETRIES']
+        backoff = app.config['BITSTORE_RETRY_BACKOFF']
+
+        def call(key):
+            attempt = 0
+            while True:
+                try:
+                    func(key)
+                    return key, None
+                except Exception as e:
+                    if attempt >= max_retries or not is_retryable(e):
+                        return key, e
+                    time.sleep(backoff * 2 ** attempt)
+                    attempt += 1
+
+        pool = None
+        total, errors = 0, []
+        try:
+            for window in iter_chunks(keys, max_workers * 2):
+                if pool is None:
+                    pool = ThreadPool(min(max_workers, len(window)))
+                total += len(window)
+                errors.extend((key, e) for key, e in pool.map(call, window)
+                              if e is not None)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        app.logger.info('%s %d objects, %d failed, client stats %s',
+                        operation, total, len(errors),
+                        app.config['S3'].stats())
+
+        if errors:
+            raise BitStoreError('Failed to {op} {n} of {total} objects: {e}'
+                                .format(op=operation, n=len(errors),
+                                        total=total, e=errors[0][1]),
+                                errors)
+
+    @staticmethod
+    def extract_information_from_s3_url(url):
+        information = url.split('metadata/')[1].split('/')
+        publisher, package, version = information[0], information[1], information[3]
+        return publisher, package, version
+
+
+def read_limited(response, key, max_size, chunk_size=64 * 1024):
+    """
+    Reads the body of a get_object response. Objects announcing a bigger
+    ContentLength are rejected before any byte of the body is read.
+    """
+    body = response['Body']
+    try:
+        if response.get('ContentLength', 0) > max_size:
+            raise ObjectTooLargeError(key, max_size)
+        chunks, size = [], 0
+        while True:
+            chunk = body.read(chunk_size)
+            if not chunk:
+                return b''.join(chunks)
+            size += len(chunk)
+            if size > max_size:
+                raise ObjectTooLargeError(key, max_size)
+            chunks.append(chunk)
+    finally:
+        body.close()
+
+
+def cached_body(entry, key, max_size):
+    if len(entry['body']) > max_size:
+        raise ObjectTooLargeError(key, max_size)
+    return entry['body']
+
+
+def forget_cached(key):
+    cache = app.config.get('OBJECT_CACHE')
+    if cache is not None:
+        cache.delete(key)
+
+
+def get_part_size(size, part_size):
+    """
+    Part size of a multipart upload of size bytes, raised when needed to
+    stay within the MAX_UPLOAD_PARTS allowed by S3
+    """
+    return max(part_size, -(-size // MAX_UPLOAD_PARTS))
+
+
+def find_readme_key(keys):
+    readme_key = None
+    for key in keys:
+        if 'readme' in key.lower():
+            readme_key = key
+    return readme_key
+
+
+def md5_to_hex(md5):
+    """
+    Clients send the base64 md5 used for Content-MD5 while S3 ETags hold
+    the hex digest. Returns the hex digest or None if md5 is neither.
+    """
+    md5 = (md5 or '').strip('"')
+    try:
+        if len(md5) == 32:
+            binascii.unhexlify(md5)
+            return md5.lower()
+        digest = base64.b64decode(md5)
+    except (TypeError, ValueError, binascii.Error):
+        return None
+    if len(digest) != 16:
+        return None
+    return binascii.hexlify(digest).decode('ascii')
+
+
+def iter_chunks(iterable, size):
+    """
+    Splits an iterable into tuples of at most size items
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield tuple(chunk)
+            chunk = []
+    if chunk:
+        yield tuple(chunk)
+
+
+def is_retryable(error):
+    """
+    Client errors such as AccessDenied won't succeed on retry, throttling,
+    server side and connection errors might.
+    """
+    if not isinstance(error, ClientError):
+        return True
+    code = error.response.get('Error', {}).get('Code')
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    return code in RETRYABLE_ERROR_CODES or status >= 500
+
+
+def multipart_copy(s3_client, bucket_name, key, copy_source, size, part_size,
+                   acl='public-read'):
+    """
+    Server side copy of objects too big for copy_object, one
+    upload_part_copy per part_size bytes. The upload is aborted on failure
+    so no orphan parts are left in the bucket. Unlike copy_object, the
+    Content-Type of the source is not kept, it is text/plain as for uploads.
+    """
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=bucket_name, Key=key, ACL=acl,
+        ContentType='text/plain')['UploadId']
+    try:
+        parts = []
+        for number, start in enumerate(range(0, size, part_size), 1):
+            end = min(start + part_size, size) - 1
+            response = s3_client.upload_part_copy(
+                Bucket=bucket_name, Key=key, UploadId=upload_id,
+                PartNumber=number, CopySource=copy_source,
+                CopySourceRange='bytes={0}-{1}'.format(start, end))
+            parts.append(dict(PartNumber=number,
+                              ETag=response['CopyPartResult']['ETag']))
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name, Key=key, UploadId=upload_id,
+            MultipartUpload=dict(Parts=parts))
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=bucket_name, Key=key,
+                                         UploadId=upload_id)
+        raise
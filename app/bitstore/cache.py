@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import errno
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from app.cache import LRUCache
+
+
+class ObjectCache(object):
+    """
+    Read-through cache of small S3 objects, such as descriptors, readmes
+    and manifests. Entries hold the ETag of the body they were read with,
+    so :meth:`~app.bitstore.BitStore.get_s3_object` can revalidate them
+    with If-None-Match and only download the body again when it changed.
+
+    Entries are kept in a bounded in-process LRU and, when ``directory``
+    is set, in files shared by the processes of the host. Entries younger
+    than ``ttl`` seconds are served without asking S3 at all.
+    """
+
+    def __init__(self, maxsize=256, max_object_size=1024 ** 2, ttl=0,
+                 directory=None):
+        self.max_object_size = max_object_size
+        self.ttl = ttl
+        self.directory = directory
+        self.local = LRUCache(maxsize=maxsize)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(maxsize=config['BITSTORE_OBJECT_CACHE_SIZE'],
+                   max_object_size=config['BITSTORE_OBJECT_CACHE_MAX_SIZE'],
+                   ttl=config['BITSTORE_OBJECT_CACHE_TTL'],
+                   directory=config['BITSTORE_OBJECT_CACHE_DIR'])
+
+    def get(self, key):
+        """
+        :return: dict with the etag, body and validated_at time of the
+                 entry or None
+        """
+        entry = self.local.get(key)
+        if entry is None and self.directory is not None:
+            entry = self._read(key)
+            if entry is not None:
+                self.local.set(key, entry)
+        return entry
+
+    def is_fresh(self, entry):
+        return entry['validated_at'] + self.ttl > time.time()
+
+    def set(self, key, etag, body):
+        if etag is None or len(body) > self.max_object_size:
+            self.delete(key)
+            return
+        entry = dict(etag=etag, body=body, validated_at=time.time())
+        self.local.set(key, entry)
+        if self.directory is not None:
+            self._write(key, entry)
+
+    def touch(self, key, entry):
+        """
+        Records that the entry was revalidated against S3
+        """
+        entry = dict(entry, validated_at=time.time())
+        self.local.set(key, entry)
+        return entry
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.directory is not None:
+            try:
+                os.remove(self._path(key))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def clear(self):
+        self.local.clear()
+
+    def _path(self, key):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def _read(self, key):
+        """
+        Disk entries are the json header with the key and etag on the
+        first line followed by the body
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                body = f.read()
+        except (IOError, ValueError):
+            return None
+        if header.get('key') != key:
+            return None
+        # validated by another process at an unknown time, always revalidate
+        return dict(etag=header['etag'], body=body, validated_at=0)
+
+    def _write(self, key, entry):
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        header = json.dumps(dict(key=key, etag=entry['etag']))
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header.encode('utf-8') + b'\n')
+                f.write(entry['body'])
+            os.rename(tmp_path, self._path(key))
+        except Exception:
+            os.remove(tmp_path)
+            raise
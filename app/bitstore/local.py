@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import base64
+import binascii
+import datetime
+import errno
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from io import BytesIO
+
+from botocore.exceptions import ClientError
+from flask import has_request_context, url_for
+from werkzeug.urls import url_encode
+
+
+ALL_USERS_URI = 'http://acs.amazonaws.com/groups/global/AllUsers'
+
+
+class MappedBody(object):
+    """
+    Read only body of a stored file, memory mapped so reads don't copy the
+    file through python buffers.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._size = size = os.fstat(self._file.fileno()).st_size
+        if size:
+            self._data = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        else:
+            self._data = BytesIO()
+
+    def read(self, amt=None):
+        if amt is None:
+            # mmap.read needs a size on python 2
+            amt = self._size - self._data.tell()
+        return self._data.read(amt)
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+
+class LocalStore(object):
+    """
+    Storage backend keeping objects on the local filesystem, under
+    BITSTORE_LOCAL_ROOT. It implements the subset of the boto3 S3 client
+    used by :class:`~app.bitstore.BitStore`, so it can be configured as
+    BITSTORE_BACKEND in place of :class:`~app.bitstore.s3.S3Client`.
+
+    Files are written to a temporary file and renamed into place, so readers
+    never see partial objects. The acl and md5 of each object are kept in a
+    json sidecar under the ``.meta`` directory. Presigned posts point at the
+    upload handler of the bitstore blueprint.
+    """
+    meta_dir = '.meta'
+    uploads_dir = '.uploads'
+
+    def __init__(self, config):
+        self.root = os.path.abspath(config['BITSTORE_LOCAL_ROOT'])
+        self.secret = config['JWT_SEED']
+        self.upload_url = config.get('BITSTORE_LOCAL_UPLOAD_URL')
+
+    # paths
+
+    def path(self, key):
+        """
+        Path of the object, only keys already normalized are accepted so
+        a key can't reach objects outside of its prefix or the sidecars
+        """
+        if not is_valid_key(key):
+            raise invalid_key(key)
+        return self._path(key)
+
+    def _path(self, name):
+        path = os.path.abspath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep):
+            raise invalid_key(name)
+        return path
+
+    def meta_path(self, key):
+        if not is_valid_key(key):
+            raise invalid_key(key)
+        return self._path(os.path.join(self.meta_dir, key + '.json'))
+
+    def get_meta(self, key):
+        try:
+            with open(self.meta_path(key)) as f:
+                return json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            raise no_such_key(key)
+
+    def _write_meta(self, key, meta):
+        self._write(self.meta_path(key), BytesIO(json.dumps(meta).encode('utf-8')))
+
+    def _write(self, path, stream, md5=None):
+        """
+        Copies the stream into a temporary file next to path and renames it
+        into place. Returns the hex md5 of the content when md5 is given.
+        """
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(64 * 1024)
+                    if not chunk:
+                        break
+                    if md5 is not None:
+                        md5.update(chunk)
+                    f.write(chunk)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return md5.hexdigest() if md5 is not None else None
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    # S3 client api
+
+    def put_object(self, Bucket, Key, Body=b'', ACL='private', **kwargs):
+        if not hasattr(Body, 'read'):
+            if not isinstance(Body, bytes):
+                Body = Body.encode('utf-8')
+            Body = BytesIO(Body)
+        etag = self._write(self.path(Key), Body, md5=hashlib.md5())
+        self._write_meta(Key, dict(acl=ACL, etag=etag))
+        return {'ETag': '"%s"' % etag}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        meta = self.get_meta(Key)
+        if IfNoneMatch is not None and IfNoneMatch.strip('"') == meta['etag']:
+            raise ClientError({'Error': {'Code': '304',
+                                         'Message': 'Not Modified'}},
+                              'GetObject')
+        path = self.path(Key)
+        return {'Body': MappedBody(path),
+                'ContentLength': os.path.getsize(path),
+                'ETag': '"%s"' % meta['etag']}
+
+    def put_object_acl(self, Bucket, Key, ACL):
+        meta = self.get_meta(Key)
+        meta['acl'] = ACL
+        self._write_meta(Key, meta)
+        return {}
+
+    def get_object_acl(self, Bucket, Key):
+        grants = [dict(Grantee=dict(Type='CanonicalUser', ID='local'),
+                       Permission='FULL_CONTROL')]
+        if self.get_meta(Key)['acl'] == 'public-read':
+            grants.append(dict(Grantee=dict(Type='Group', URI=ALL_USERS_URI),
+                               Permission='READ'))
+        return {'Grants': grants}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000,
+                        ContinuationToken=None, StartAfter=None, **kwargs):
+        after = ContinuationToken or StartAfter
+        keys = sorted(key for key in self._walk(Prefix)
+                      if after is None or key > after)
+        page = keys[:MaxKeys]
+        response = {'IsTruncated': len(keys) > MaxKeys,
+                    'KeyCount': len(page)}
+        if page:
+            response['Contents'] = [
+                dict(Key=key, Size=os.path.getsize(self.path(key)),
+                     ETag='"%s"' % self.get_meta(key)['etag'],
+                     LastModified=datetime.datetime.utcfromtimestamp(
+                         os.path.getmtime(self.path(key))))
+                for key in page]
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def _walk(self, prefix):
+        directory = os.path.join(self.root, os.path.dirname(prefix))
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [d for d in dirnames
+                           if d not in (self.meta_dir, self.uploads_dir)]
+            for filename in filenames:
+                if filename.startswith('.tmp-'):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, filename),
+                                      self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    yield key
+
+    def delete_objects(self, Bucket, Delete):
+        deleted = []
+        for ob in Delete['Objects']:
+            self._remove(self.path(ob['Key']))
+            self._remove(self.meta_path(ob['Key']))
+            deleted.append(dict(Key=ob['Key']))
+        return {'Deleted': deleted, 'Errors': []}
+
+    def copy_object(self, Bucket, Key, CopySource, ACL='private', **kwargs):
+        source = CopySource['Key']
+        meta = self.get_meta(source)
+        with open(self.path(source), 'rb') as f:
+            self._write(self.path(Key), f)
+        self._write_meta(Key, dict(acl=ACL, etag=meta['etag']))
+        return {'CopyObjectResult': {'ETag': '"%s"' % meta['etag']}}
+
+    def create_multipart_upload(self, Bucket, Key, ACL='private', **kwargs):
+        upload_id = uuid.uuid4().hex
+        self._write(self.upload_path(upload_id, 'upload.json'),
+                    BytesIO(json.dumps(dict(key=Key, acl=ACL)).encode('utf-8')))
+        return {'UploadId': upload_id}
+
+    def upload_path(self, upload_id, name=''):
+        return self._path(os.path.join(self.uploads_dir, upload_id, name))
+
+    def get_upload(self, upload_id, key):
+        """
+        Returns the upload started for key, like S3 uploads are not found
+        under the key of another object
+        """
+        try:
+            with open(self.upload_path(upload_id, 'upload.json')) as f:
+                upload = json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            upload = None
+        if upload is None or upload['key'] != key:
+            raise ClientError({'Error': {
+                'Code': 'NoSuchUpload',
+                'Message': 'The specified upload does not exist.'}},
+                'MultipartUpload')
+        return upload
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.get_upload(UploadId, Key)
+        etag = self._write(self.upload_path(UploadId, '%05d' % PartNumber),
+                           Body, md5=hashlib.md5())
+        return {'ETag': '"%s"' % etag}
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0, **kwargs):
+        self.get_upload(UploadId, Key)
+        parts = []
+        for name in sorted(os.listdir(self.upload_path(UploadId))):
+            if not name.isdigit() or int(name) <= PartNumberMarker:
+                continue
+            path = self.upload_path(UploadId, name)
+            with open(path, 'rb') as f:
+                etag = hashlib.md5(f.read()).hexdigest()
+            parts.append(dict(PartNumber=int(name), ETag='"%s"' % etag,
+                              Size=os.path.getsize(path)))
+        return {'Parts': parts, 'IsTruncated': False}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource,
+                         CopySourceRange):
+        start, end = [int(n) for n in
+                      CopySourceRange.split('=')[1].split('-')]
+        with open(self.path(CopySource['Key']), 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        part_path = self.upload_path(UploadId, '%05d' % PartNumber)
+        self._write(part_path, BytesIO(data))
+        etag = hashlib.md5(data).hexdigest()
+        return {'CopyPartResult': {'ETag': '"%s"' % etag}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        upload = self.get_upload(UploadId, Key)
+        upload_dir = self.upload_path(UploadId)
+        parts = sorted(part['PartNumber'] for part in MultipartUpload['Parts'])
+        for number in parts:
+            if not os.path.exists(os.path.join(upload_dir, '%05d' % number)):
+                raise ClientError({'Error': {
+                    'Code': 'InvalidPart',
+                    'Message': 'Part %d was not uploaded' % number}},
+                    'CompleteMultipartUpload')
+        md5 = hashlib.md5()
+        tmp_path = self._path(os.path.join(self.uploads_dir, UploadId + '.tmp'))
+        with open(tmp_path, 'wb') as out:
+            for number in parts:
+                with open(os.path.join(upload_dir, '%05d' % number), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+        with open(tmp_path, 'rb') as f:
+            etag = self._write(self.path(Key), f, md5=md5)
+        self._remove(tmp_path)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        self._write_meta(Key, dict(acl=upload['acl'], etag=etag))
+        return {'ETag': '"%s"' % etag}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        shutil.rmtree(self.upload_path(UploadId),
+                      ignore_errors=True)
+        return {}
+
+    def generate_presigned_post(self, Bucket, Key, Fields=None,
+                                Conditions=None, ExpiresIn=3600):
+        """
+        Returns the url and fields to post to the local upload handler,
+        see :func:`~app.bitstore.local.LocalStore.verify_post`
+        """
+        fields = dict(Fields or {})
+        fields['key'] = Key
+        fields['expires'] = str(int(time.time()) + ExpiresIn)
+        fields['signature'] = self.sign(Key, fields.get('acl', 'private'),
+                                        fields['expires'])
+        url = self.upload_url
+        if url is None and has_request_context():
+            url = url_for('bitstore.local_upload', _external=True)
+        return {'url': url, 'fields': fields}
+
+    def generate_presigned_posts(self, Bucket, Posts, ExpiresIn=3600):
+        return [self.generate_presigned_post(Bucket=Bucket,
+                                             ExpiresIn=ExpiresIn, **post)
+                for post in Posts]
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        """
+        Only upload_part urls are supported, they point at the part upload
+        handler, see :func:`~app.bitstore.local.LocalStore.verify_part`
+        """
+        if ClientMethod != 'upload_part':
+            raise ValueError('Unsupported method %s' % ClientMethod)
+        part = dict(key=Params['Key'], uploadId=Params['UploadId'],
+                    partNumber=str(Params['PartNumber']),
+                    expires=str(int(time.time()) + ExpiresIn))
+        part['signature'] = self.sign(part['key'], part['uploadId'],
+                                      part['partNumber'], part['expires'])
+        if self.upload_url is None and has_request_context():
+            return url_for('bitstore.local_upload_part', _external=True, **part)
+        return '%s/part?%s' % (self.upload_url, url_encode(part))
+
+    def stats(self):
+        """
+        The local store has no connection pool, see
+        :func:`~app.bitstore.s3.S3Client.stats`
+        :return: empty dict
+        """
+        return {}
+
+    # upload handler
+
+    def sign(self, *values):
+        message = '\n'.join(values).encode('utf-8')
+        return hmac.new(self.secret.encode('utf-8'), message,
+                        hashlib.sha256).hexdigest()
+
+    def verify_post(self, fields):
+        """
+        Checks the signature and expiry of the fields of a presigned post
+        :return: True if the post is allowed
+        """
+        try:
+            key, acl = fields['key'], fields.get('acl', 'private')
+            expires, signature = fields['expires'], fields['signature']
+            if int(expires) < time.time() or not is_valid_key(key):
+                return False
+        except (KeyError, ValueError):
+            return False
+        try:
+            return hmac.compare_digest(self.sign(key, acl, expires).encode('ascii'),
+                                       signature.encode('ascii'))
+        except UnicodeError:
+            return False
+
+    def verify_part(self, args):
+        """
+        Checks the signature and expiry of an upload_part url
+        :return: True if the upload is allowed
+        """
+        try:
+            values = [args['key'], args['uploadId'], args['partNumber'],
+                      args['expires']]
+            signature = args['signature']
+            if int(args['expires']) < time.time() \
+                    or not is_valid_key(args['key']) \
+                    or not args['uploadId'].isalnum():
+                return False
+            int(args['partNumber'])
+        except (KeyError, ValueError):
+            return False
+        try:
+            return hmac.compare_digest(self.sign(*values).encode('ascii'),
+                                       signature.encode('ascii'))
+        except UnicodeError:
+            return False
+
+    def save_post(self, fields, stream):
+        """
+        Stores an upload received by the upload handler. The md5 of the
+        content is checked against the Content-MD5 field when present and
+        the object is only renamed into place if it matches.
+        :return: False if the content doesn't match its Content-MD5
+        """
+        key = fields['key']
+        expected = fields.get('Content-MD5')
+        path = self.path(key)
+        tmp_key = os.path.join(self.uploads_dir, uuid.uuid4().hex)
+        tmp_path = self._path(tmp_key)
+        etag = self._write(tmp_path, stream, md5=hashlib.md5())
+        if expected and base64.b64encode(
+                binascii.unhexlify(etag)).decode('ascii') != expected:
+            self._remove(tmp_path)
+            return False
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        os.rename(tmp_path, path)
+        self._write_meta(key, dict(acl=fields.get('acl', 'private'),
+                                   etag=etag))
+        return True
+
+
+def is_valid_key(key):
+    """
+    Keys are relative, use '/' as separator and have no empty, '.', '..'
+    or sidecar directory segments, so they map to a single object path
+    """
+    if not key or '\\' in key:
+        return False
+    return all(segment not in ('', '.', '..', LocalStore.meta_dir,
+                               LocalStore.uploads_dir)
+               for segment in key.split('/'))
+
+
+def invalid_key(key):
+    return ClientError({'Error': {'Code': 'InvalidKey',
+                                  'Message': 'Invalid key %s' % key}},
+                       'LocalStore')
+
+
+def no_such_key(key):
+    return ClientError({'Error': {'Code': 'NoSuchKey',
+                                  'Message': 'The specified key does not exist.',
+                                  'Key': key}}, 'GetObject')
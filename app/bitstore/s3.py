@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import threading
+from functools import wraps
+
+import boto3
+from botocore.client import Config
+from botocore.credentials import Credentials
+
+
+class S3Client(object):
+    """
+    Default storage backend, see BITSTORE_BACKEND.
+    Shared S3 client stored as app.config['S3']. It builds its boto3 client
+    from the S3_* settings lazily in every process, so forked gunicorn
+    workers never share the connection pool of their parent, and counts
+    the API calls in flight to tell when the pool is saturated.
+    """
+
+    def __init__(self, config):
+        self.region_name = config['AWS_REGION']
+        self.aws_access_key_id = config['AWS_ACCESS_KEY_ID']
+        self.aws_secret_access_key = config['AWS_SECRET_ACCESS_KEY']
+        self.max_pool_connections = config['S3_MAX_POOL_CONNECTIONS']
+        options = dict(signature_version='s3v4',
+                       max_pool_connections=self.max_pool_connections,
+                       connect_timeout=config['S3_CONNECT_TIMEOUT'],
+                       read_timeout=config['S3_READ_TIMEOUT'])
+        # only understood by newer botocore releases, passed when set
+        retries = dict((name, value) for name, value in (
+            ('mode', config['S3_RETRY_MODE']),
+            ('max_attempts', config['S3_MAX_ATTEMPTS'])) if value is not None)
+        if retries:
+            options['retries'] = retries
+        if config['S3_TCP_KEEPALIVE'] is not None:
+            options['tcp_keepalive'] = config['S3_TCP_KEEPALIVE']
+        self.options = options
+        self._pid = None
+        self._session = None
+        self._client = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = dict(calls=0, in_flight=0, peak_in_flight=0,
+                           saturated_calls=0)
+
+    @property
+    def client(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._session = boto3.session.Session()
+                    self._client = self._session.client(
+                        's3', region_name=self.region_name,
+                        aws_access_key_id=self.aws_access_key_id,
+                        aws_secret_access_key=self.aws_secret_access_key,
+                        config=Config(**self.options))
+                    self._pid = pid
+        return self._client
+
+    def get_credentials(self):
+        """
+        :return: the current credentials of the client or None
+        """
+        # same resolution as the client, explicit keys first
+        if self.aws_access_key_id is not None \
+                and self.aws_secret_access_key is not None:
+            return Credentials(self.aws_access_key_id,
+                               self.aws_secret_access_key)
+        self.client  # builds the session of this process
+        credentials = self._session.get_credentials()
+        if credentials is None:
+            return None
+        return credentials.get_frozen_credentials()
+
+    def generate_presigned_posts(self, Bucket, Posts, ExpiresIn=3600):
+        """
+        Batch version of generate_presigned_post. The SigV4 signing key is
+        derived once and only the policy of each post is signed, see
+        :class:`~app.bitstore.s3.PostSigner`.
+        :param Posts: list of dicts with the Key, Fields and Conditions of
+                      every post
+        :return: list of dicts with the url and fields of every post
+        """
+        if not Posts:
+            return []
+        credentials = self.get_credentials()
+        if credentials is None:
+            return [self.generate_presigned_post(Bucket=Bucket,
+                                                 ExpiresIn=ExpiresIn, **post)
+                    for post in Posts]
+        # the url only depends on the bucket
+        url = self.client.generate_presigned_post(
+            Bucket=Bucket, Key=Posts[0]['Key'], ExpiresIn=ExpiresIn)['url']
+        signer = PostSigner(credentials, self.client.meta.region_name)
+        return [signer.sign(url, Bucket, expires_in=ExpiresIn, **post)
+                for post in Posts]
+
+    def stats(self):
+        """
+        :return: dict with the number of calls, the calls currently in
+                 flight, the highest number in flight and the calls started
+                 while every pooled connection was busy
+        """
+        with self._stats_lock:
+            return dict(self._stats,
+                        max_pool_connections=self.max_pool_connections)
+
+    def __getattr__(self, name):
+        client = self.client
+        attr = getattr(client, name)
+        if name not in client.meta.method_to_api_mapping:
+            return attr
+
+        @wraps(attr)
+        def call(*args, **kwargs):
+            with self._stats_lock:
+                stats = self._stats
+                stats['calls'] += 1
+                if stats['in_flight'] >= self.max_pool_connections:
+                    stats['saturated_calls'] += 1
+                stats['in_flight'] += 1
+                stats['peak_in_flight'] = max(stats['peak_in_flight'],
+                                              stats['in_flight'])
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self._stats['in_flight'] -= 1
+        return call
+
+
+class PostSigner(object):
+    """
+    Signs the policy of S3 presigned posts with SigV4 like botocore's
+    S3SigV4PostAuth, but derives the signing key and the credential scope
+    once for every post signed at the same time.
+    """
+    algorithm = 'AWS4-HMAC-SHA256'
+
+    def __init__(self, credentials, region_name, now=None):
+        self.now = now or datetime.datetime.utcnow()
+        self.token = credentials.token
+        self.timestamp = self.now.strftime('%Y%m%dT%H%M%SZ')
+        datestamp = self.timestamp[:8]
+        self.credential = '/'.join([credentials.access_key, datestamp,
+                                    region_name, 's3', 'aws4_request'])
+        key = ('AWS4' + credentials.secret_key).encode('utf-8')
+        for part in (datestamp, region_name, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        self.signing_key = key
+
+    def sign(self, url, bucket, Key, Fields=None, Conditions=None,
+             expires_in=3600):
+        """
+        :return: dict with the url and fields of the post, as returned by
+                 generate_presigned_post
+        """
+        fields = dict(Fields or {})
+        conditions = list(Conditions or [])
+        fields['key'] = Key
+        conditions.append({'bucket': bucket})
+        conditions.append({'key': Key})
+
+        fields['x-amz-algorithm'] = self.algorithm
+        fields['x-amz-credential'] = self.credential
+        fields['x-amz-date'] = self.timestamp
+        conditions.append({'x-amz-algorithm': self.algorithm})
+        conditions.append({'x-amz-credential': self.credential})
+        conditions.append({'x-amz-date': self.timestamp})
+        if self.token is not None:
+            fields['x-amz-security-token'] = self.token
+            conditions.append({'x-amz-security-token': self.token})
+
+        expiration = self.now + datetime.timedelta(seconds=expires_in)
+        policy = dict(expiration=expiration.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                      conditions=conditions)
+        fields['policy'] = base64.b64encode(
+            json.dumps(policy).encode('utf-8')).decode('utf-8')
+        fields['x-amz-signature'] = hmac.new(
+            self.signing_key, fields['policy'].encode('utf-8'),
+            hashlib.sha256).hexdigest()
+        return {'url': url, 'fields': fields}
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app as app
+from flask import request, g, make_response, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.utils import import_string
+
+from app.package.models import Package, PackageTag
+from app.profile.models import Publisher, User
+
+GLOBAL_SCOPE = 'packages'
+
+
+class LRUCache(object):
+    """
+    Bounded, thread safe in-process cache. Least recently used entries are
+    evicted once ``maxsize`` is reached and entries older than their ttl are
+    treated as missing.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                return default
+            self._data[key] = item
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires_at)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = self.get(key, 0) + 1
+            self._data.pop(key, None)
+            self._data[key] = (value, None)
+            return value
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key, (value, _) in list(self._data.items()):
+                if predicate(value):
+                    del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RefreshAheadCache(object):
+    """
+    Keeps values computed by a loader in memory for ``ttl`` seconds. Once a
+    value expires the stale copy keeps being served while a background
+    thread reloads it, so only the very first caller waits for the loader.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._values = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        item = self._values.get(key)
+        if item is None:
+            return self._load(key, loader)
+        value, loaded_at = item
+        if loaded_at + self.ttl <= time.time():
+            self._refresh_in_background(key, loader)
+        return value
+
+    def invalidate(self, key):
+        self._values.pop(key, None)
+
+    def _load(self, key, loader):
+        value = loader()
+        self._values[key] = (value, time.time())
+        return value
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        flask_app = app._get_current_object()
+
+        def refresh():
+            try:
+                with flask_app.app_context():
+                    self._load(key, loader)
+            except Exception as e:
+                flask_app.logger.error(e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+
+class RedisStore(object):
+    """
+    Shared page cache store backed by redis. Any object exposing the same
+    get/set/delete/incr methods can be configured instead.
+    """
+
+    def __init__(self, config):
+        import redis
+        self.client = redis.StrictRedis.from_url(config['PAGE_CACHE_STORE_URL'])
+
+    def get(self, key, default=None):
+        value = self.client.get(key)
+        return default if value is None else value
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+
+class PageCache(object):
+    """
+    Rendered HTML cache for anonymous site pages.
+
+    Pages are looked up in the in-process LRU first and then in the optional
+    shared store. Every key embeds the revision counters of the scopes the
+    page depends on, so bumping a counter invalidates all pages of that
+    package or publisher without having to know their urls.
+
+    Without a shared store the counters only live in this process, which
+    then never sees the changes made by other processes. Cached pages are
+    only refreshed after ttl seconds in that case.
+    """
+
+    def __init__(self, maxsize=512, ttl=300, store=None):
+        self.ttl = ttl
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.store = store
+        # never evicted, a counter going back to 0 would match old keys
+        self._revisions = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        store = None
+        if config.get('PAGE_CACHE_STORE'):
+            store = import_string(config['PAGE_CACHE_STORE'])(config)
+        return cls(maxsize=config['PAGE_CACHE_SIZE'],
+                   ttl=config['PAGE_CACHE_TTL'],
+                   store=store)
+
+    def revision(self, scope):
+        key = 'rev:' + scope
+        if self.store is not None:
+            return int(self.store.get(key, 0))
+        with self._lock:
+            return self._revisions.get(key, 0)
+
+    def bump(self, *scopes):
+        for scope in scopes:
+            key = 'rev:' + scope
+            if self.store is not None:
+                self.store.incr(key)
+            else:
+                with self._lock:
+                    self._revisions[key] = self._revisions.get(key, 0) + 1
+
+    def build_key(self, path, scopes):
+        revisions = ','.join('%s=%d' % (scope, self.revision(scope))
+                             for scope in scopes)
+        return 'page:%s|%s' % (path, revisions)
+
+    def get(self, key):
+        page = self.local.get(key)
+        if page is None and self.store is not None:
+            page = self.store.get(key)
+            if page is not None:
+                self.local.set(key, page)
+        return page
+
+    def set(self, key, page):
+        self.local.set(key, page)
+        if self.store is not None:
+            self.store.set(key, page, ttl=self.ttl)
+
+
+def publisher_scope(publisher):
+    return 'publisher:%s' % publisher
+
+
+def package_scope(publisher, package):
+    return 'package:%s/%s' % (publisher, package)
+
+
+def page_scopes(view_args):
+    publisher, package = view_args.get('publisher'), view_args.get('package')
+    if publisher and package:
+        return [publisher_scope(publisher), package_scope(publisher, package)]
+    if publisher:
+        return [publisher_scope(publisher)]
+    return [GLOBAL_SCOPE]
+
+
+def cached_page(f):
+    """
+    Serves the rendered page from the page cache for anonymous users.
+    Only successful GET responses are stored.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        page_cache = app.config.get('PAGE_CACHE')
+        if page_cache is None or request.method != 'GET' \
+                or g.current_user is not None:
+            return f(*args, **kwargs)
+
+        key = page_cache.build_key(request.full_path, page_scopes(kwargs))
+        body = page_cache.get(key)
+        if body is not None:
+            return make_response(body, 200)
+
+        response = make_response(f(*args, **kwargs))
+        if response.status_code == 200:
+            page_cache.set(key, response.get_data())
+        return response
+    return decorated
+
+
+def invalidate(*scopes):
+    """
+    Bumps the revision counters of the given scopes, along with the global
+    scope used by listing pages.
+    """
+    if not has_app_context():
+        return
+    page_cache = app.config.get('PAGE_CACHE')
+    if page_cache is not None:
+        page_cache.bump(GLOBAL_SCOPE, *scopes)
+
+
+def _scopes_for(instance):
+    if isinstance(instance, PackageTag):
+        instance = instance.package
+    if isinstance(instance, Package):
+        if instance.publisher is None:
+            return []
+        return [publisher_scope(instance.publisher.name),
+                package_scope(instance.publisher.name, instance.name)]
+    if isinstance(instance, Publisher):
+        return [publisher_scope(instance.name)]
+    return []
+
+
+def invalidate_user(user_id):
+    """
+    Drops the cached records of the given user for every token
+    """
+    if not has_app_context():
+        return
+    user_cache = app.config.get('USER_CACHE')
+    if user_cache is not None:
+        user_cache.delete_where(lambda user: user['id'] == user_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_scopes(session, flush_context):
+    scopes = session.info.setdefault('page_cache_scopes', set())
+    user_ids = session.info.setdefault('user_cache_ids', set())
+    for instance in list(session.dirty) + list(session.deleted):
+        if isinstance(instance, User):
+            user_ids.add(instance.id)
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        scopes.update(_scopes_for(instance))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_scopes(session):
+    scopes = session.info.pop('page_cache_scopes', None)
+    if scopes:
+        invalidate(*scopes)
+    for user_id in session.info.pop('user_cache_ids', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_scopes(session):
+    session.info.pop('page_cache_scopes', None)
+    session.info.pop('user_cache_ids', None)
@@ -43,6 +43,88 @@ class BaseConfig(object):
     S3_BUCKET_NAME = "test"
     BITSTORE_URL = 'https://bits.' + DOMAIN
 
+    # Storage backend, app.config['S3'] at runtime. Either the S3 client or
+    # app.bitstore.LocalStore, keeping objects under BITSTORE_LOCAL_ROOT.
+    # Clients of the local store upload to BITSTORE_LOCAL_UPLOAD_URL,
+    # /api/datastore/upload of the current host by default, and
+    # BITSTORE_URL should then point at /api/datastore/objects
+    BITSTORE_BACKEND = 'app.bitstore.S3Client'
+    BITSTORE_LOCAL_ROOT = 'bitstore'
+    BITSTORE_LOCAL_UPLOAD_URL = None
+
+    # Shared S3 client. The pool should allow BITSTORE_MAX_WORKERS calls
+    # on top of the ones made by request threads. Retry mode, attempts
+    # and keepalive need a recent botocore and are left to its defaults
+    # when None
+    S3_MAX_POOL_CONNECTIONS = 32
+    S3_CONNECT_TIMEOUT = 10
+    S3_READ_TIMEOUT = 60
+    S3_RETRY_MODE = None
+    S3_MAX_ATTEMPTS = None
+    S3_TCP_KEEPALIVE = None
+
+    # Concurrency of per object S3 calls (e.g. acl changes) and the retries
+    # of each call, waiting RETRY_BACKOFF * 2^attempt seconds in between
+    BITSTORE_MAX_WORKERS = 16
+    BITSTORE_MAX_RETRIES = 3
+    BITSTORE_RETRY_BACKOFF = 0.1
+
+    # Objects bigger than the threshold are copied with multipart
+    # upload_part_copy, as copy_object is limited to 5GB
+    BITSTORE_MULTIPART_COPY_THRESHOLD = 5 * 1024 ** 3
+    BITSTORE_COPY_PART_SIZE = 512 * 1024 ** 2
+
+    # Files bigger than the threshold are uploaded with multipart uploads,
+    # in parts of BITSTORE_UPLOAD_PART_SIZE bytes, instead of presigned posts
+    # which are limited to 5GB and can't be resumed
+    BITSTORE_MULTIPART_UPLOAD_THRESHOLD = 100 * 1024 ** 2
+    BITSTORE_UPLOAD_PART_SIZE = 64 * 1024 ** 2
+
+    # Maximum size in bytes of the objects read into memory from S3
+    BITSTORE_MAX_OBJECT_SIZE = 10 * 1024 ** 2
+    BITSTORE_MAX_DESCRIPTOR_SIZE = 10 * 1024 ** 2
+    BITSTORE_MAX_README_SIZE = 1024 ** 2
+
+    # Read-through cache of descriptors, readmes and manifests up to
+    # BITSTORE_OBJECT_CACHE_MAX_SIZE bytes. Cached objects older than
+    # BITSTORE_OBJECT_CACHE_TTL seconds are revalidated with If-None-Match.
+    # BITSTORE_OBJECT_CACHE_DIR adds an on-disk tier shared by the local
+    # processes
+    BITSTORE_OBJECT_CACHE_ENABLED = True
+    BITSTORE_OBJECT_CACHE_SIZE = 256
+    BITSTORE_OBJECT_CACHE_MAX_SIZE = 1024 ** 2
+    BITSTORE_OBJECT_CACHE_TTL = 0
+    BITSTORE_OBJECT_CACHE_DIR = None
+
+    # Store resources once per package under _blobs/<md5> instead of once
+    # per version, versions then only hold their manifest and descriptor
+    BITSTORE_CONTENT_ADDRESSED = False
+
+    # Run publish jobs within the request instead of queueing them for
+    # `manager.py worker`. Running jobs are touched every third of
+    # PUBLISH_JOB_TIMEOUT, jobs not touched for PUBLISH_JOB_TIMEOUT seconds
+    # are considered abandoned and picked up by another worker, up to
+    # PUBLISH_JOB_MAX_ATTEMPTS times
+    PUBLISH_JOBS_INLINE = True
+    PUBLISH_JOB_TIMEOUT = 600
+    PUBLISH_JOB_MAX_ATTEMPTS = 3
+
+    # Bitstore operations following package changes are written to the
+    # outbox table with the change and applied within the request, or by
+    # `manager.py outbox` if not OUTBOX_INLINE. Failed operations are retried
+    # after OUTBOX_RETRY_BACKOFF * 2^attempt seconds, up to
+    # OUTBOX_MAX_ATTEMPTS times. Entries being applied are touched every
+    # third of OUTBOX_TIMEOUT, others running for longer are picked up again
+    OUTBOX_INLINE = True
+    OUTBOX_TIMEOUT = 600
+    OUTBOX_MAX_ATTEMPTS = 10
+    OUTBOX_RETRY_BACKOFF = 1
+
+    # `manager.py reconcile` only reports objects without a package once
+    # they are older than this many seconds, newer ones may be uploads of
+    # packages not finalized yet
+    RECONCILE_ORPHAN_GRACE = 24 * 3600
+
     FRONT_PAGE_SHOWCASE_PACKAGES = [
         {"publisher": "core", "package": "s-and-p-500-companies"},
         {"publisher": "core", "package": "house-prices-us"},
@@ -55,6 +137,39 @@ class BaseConfig(object):
         {"publisher": "examples", "package": "geojson-tutorial"}
     ]
 
+    # Maximum number of packages fetched by one /api/package/_bulk request
+    BULK_PACKAGE_MAX_BATCH_SIZE = 100
+
+    # Number of verified tokens remembered until they expire
+    JWT_CACHE_SIZE = 4096
+
+    # Publisher roles and sysadmin flags used for authorization are cached
+    # for ROLE_CACHE_TTL seconds and dropped when memberships change
+    ROLE_CACHE_SIZE = 4096
+    ROLE_CACHE_TTL = 60
+
+    # Users decoded from the jwt cookie are kept in memory for USER_CACHE_TTL
+    # seconds at most, and dropped as soon as the user record changes
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 60
+
+    # Seconds the front page showcase is served from memory before it is
+    # refreshed in the background
+    FRONT_PAGE_CACHE_TTL = 300
+
+    # Rendered HTML cache for anonymous site pages. PAGE_CACHE_STORE is the
+    # import path of a store shared by all processes e.g.
+    # app.cache.RedisStore, which holds the revisions invalidating pages.
+    # Without it, the cache is only enabled when PAGE_CACHE_SINGLE_PROCESS
+    # says a single process serves requests and changes packages, that is
+    # PUBLISH_JOBS_INLINE and OUTBOX_INLINE are set as well
+    PAGE_CACHE_ENABLED = True
+    PAGE_CACHE_SINGLE_PROCESS = True
+    PAGE_CACHE_SIZE = 512
+    PAGE_CACHE_TTL = 300
+    PAGE_CACHE_STORE = None
+    PAGE_CACHE_STORE_URL = None
+
     def check_required_config(self):
         for conf in self.required_config:
             conf_value = self.__getattribute__(conf)
@@ -89,6 +204,18 @@ class DevelopmentConfig(BaseConfig):
     GITHUB_CLIENT_ID = os.environ.get('GITHUB_CLIENT_ID')
     GITHUB_CLIENT_SECRET = os.environ.get('GITHUB_CLIENT_SECRET')
 
+    PAGE_CACHE_STORE = os.environ.get('PAGE_CACHE_STORE')
+    PAGE_CACHE_STORE_URL = os.environ.get('PAGE_CACHE_STORE_URL')
+    PAGE_CACHE_SINGLE_PROCESS = \
+        os.environ.get('PAGE_CACHE_SINGLE_PROCESS', '').lower() == 'true'
+
+    BITSTORE_BACKEND = os.environ.get('BITSTORE_BACKEND', 'app.bitstore.S3Client')
+    BITSTORE_LOCAL_ROOT = os.environ.get('BITSTORE_LOCAL_ROOT', 'bitstore')
+    BITSTORE_OBJECT_CACHE_DIR = os.environ.get('BITSTORE_OBJECT_CACHE_DIR')
+
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32))
+    S3_RETRY_MODE = os.environ.get('S3_RETRY_MODE')
+
     SQLALCHEMY_DATABASE_URI = os.environ.get("SQLALCHEMY_DATABASE_URI")
 
 
@@ -102,6 +229,8 @@ class StageConfig(DevelopmentConfig):
     BITSTORE_URL = os.environ.get('BITSTORE_URL')
     DEBUG = False
     TESTING = False
+    PUBLISH_JOBS_INLINE = False
+    OUTBOX_INLINE = False
 
 
 class ProductionConfig(StageConfig):
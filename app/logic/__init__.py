@@ -4,20 +4,29 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import datetime
 import json
 import os
+import posixpath
+import threading
+import time
 
 from BeautifulSoup import BeautifulSoup
+from botocore.exceptions import ClientError
 from flask import request, session
 from flask import current_app as app
+from sqlalchemy import and_
 from sqlalchemy.orm.exc import NoResultFound
 
 from app.auth.annotations import check_is_authorized, get_user_from_jwt
+from app.auth.authorization import resolve_actions
 from app.auth.jwt import JWT, FileData
 from app.database import db
-from app.bitstore import BitStore
+from app.bitstore import BitStore, MULTIPART_ERROR_CODES
+from app.bitstore import get_part_size, is_valid_key, md5_to_hex
+from app.cache import invalidate, publisher_scope, package_scope
 from app.logic.search import DataPackageQuery
-from app.utils import InvalidUsage
+from app.utils import InvalidUsage, string_types
 from app.utils.helpers import text_to_markdown, dp_in_readme
 import app.models as models
 
@@ -110,6 +119,17 @@ class Package(LogicBase):
         data = models.Package.get_by_publisher(publisher, package)
         return cls.serialize(data)
 
+    @classmethod
+    def get_many(cls, names):
+        '''
+        Serializes many packages fetched with one query.
+        :param names: list of (publisher, package) name pairs
+        :return: list of serialized packages in the same order,
+                 None for packages which are not found
+        '''
+        instances = models.Package.get_many_by_publisher(names)
+        return [cls.serialize(instances.get(tuple(name))) for name in names]
+
     @classmethod
     def exists(cls, publisher, package):
         instance = models.Package.get_by_publisher(publisher, package)
@@ -121,8 +141,22 @@ class Package(LogicBase):
         # TODO: should be able to db.session.delete(pkg) but deletes publishers!
         models.Package.query.filter(models.Package.id == pkg.id).delete()
         db.session.commit()
+        invalidate(publisher_scope(publisher),
+                   package_scope(publisher, package))
         return True
 
+    @classmethod
+    def get_versions(cls, publisher, package):
+        '''
+        Returns the versions stored in the bitstore for the package:
+        latest and every tag
+        '''
+        tags = db.session.query(models.PackageTag.tag)\
+            .join(models.Package).join(models.Publisher)\
+            .filter(models.Publisher.name == publisher,
+                    models.Package.name == package)
+        return sorted(set(['latest']) | set(tag for tag, in tags))
+
     @classmethod
     def create_or_update_tag(cls, publisher, package, tag):
         package = models.Package.get_by_publisher(publisher, package)
@@ -144,9 +178,16 @@ class Package(LogicBase):
         return True
 
     @classmethod
-    def create_or_update(cls, name, publisher_name, **kwargs):
-        pub_id = models.Publisher.query.filter_by(name=publisher_name).one().id
-        instance = models.Package.get_by_publisher(publisher_name, name)
+    def create_or_update(cls, name, publisher_name, context=None, **kwargs):
+        '''
+        :param context: PublishContext with the publisher and package already
+                        loaded, to avoid looking them up again
+        '''
+        if context is not None:
+            pub_id, instance = context.publisher.id, context.package
+        else:
+            pub_id = models.Publisher.query.filter_by(name=publisher_name).one().id
+            instance = models.Package.get_by_publisher(publisher_name, name)
 
         if instance is None:
             instance = models.Package(name=name)
@@ -171,27 +212,330 @@ class Package(LogicBase):
     def finalize_publish(cls, user_id, datapackage_url):
         '''
         Gets the datapackage.json and README from S3 and imports into database.
+        Nothing is downloaded or updated if the md5 of every file matches
+        the ones of the last publish.
         Returns status "queued" if ok, else - None
         '''
         publisher, package, version = BitStore.extract_information_from_s3_url(datapackage_url)
-        if Package.exists(publisher, package):
-            status = check_is_authorized('Package::Update', publisher, package, user_id)
-        else:
-            status = check_is_authorized('Package::Create', publisher, package, user_id)
-
-        if not status:
-            raise InvalidUsage('Not authorized to upload data', 400)
+        context = PublishContext.load(user_id, publisher, package)
+        context.check_authorized()
 
         bit_store = BitStore(publisher, package)
+        manifest = bit_store.save_manifest()
+        content_hash = bit_store.get_content_hash(manifest)
+        if context.package is not None \
+                and context.package.content_hash == content_hash \
+                and context.package.status == models.PackageStateEnum.active:
+            return "queued"
+
         b = bit_store.get_metadata_body()
         body = json.loads(b)
-        bit_store.change_acl('public-read')
-        readme = bit_store.get_s3_object(bit_store.get_readme_object_key())
+        # only the descriptor of the database points at the blobs, the
+        # stored one stays as uploaded so its md5 compares on the next publish
+        blob_urls = bit_store.get_blob_urls(manifest)
+        for resource in body.get('resources', []):
+            if resource.get('path') in blob_urls:
+                resource['path'] = blob_urls[resource['path']]
+        bit_store.change_acl('public-read', versions=[bit_store.version])
+        readme = None
+        if manifest['readme']:
+            readme = bit_store.get_s3_object(
+                manifest['readme'],
+                max_size=app.config['BITSTORE_MAX_README_SIZE'])
         Package.create_or_update(name=package, publisher_name=publisher,
+                                 context=context, content_hash=content_hash,
                                  descriptor=body, readme=readme)
         return "queued"
 
 
+class PublishContext(object):
+    '''
+    Publisher, package and role of the user resolved with a single query
+    for the publish flow, and passed along instead of looking them up in
+    every step.
+    '''
+
+    def __init__(self, user_id, publisher_name, package_name,
+                 publisher=None, package=None, sysadmin=None, role=None):
+        self.user_id = user_id
+        self.publisher_name = publisher_name
+        self.package_name = package_name
+        self.publisher = publisher
+        self.package = package
+        self.sysadmin = sysadmin
+        self.role = role
+
+    @classmethod
+    def load(cls, user_id, publisher_name, package_name):
+        row = db.session.query(models.Publisher, models.Package,
+                               models.PublisherUser.role,
+                               models.User.id, models.User.sysadmin)\
+            .outerjoin(models.Package,
+                       and_(models.Package.publisher_id == models.Publisher.id,
+                            models.Package.name == package_name))\
+            .outerjoin(models.PublisherUser,
+                       and_(models.PublisherUser.publisher_id == models.Publisher.id,
+                            models.PublisherUser.user_id == user_id))\
+            .outerjoin(models.User, models.User.id == user_id)\
+            .filter(models.Publisher.name == publisher_name).first()
+        if row is None:
+            user = models.User.query.get(user_id) if user_id is not None else None
+            sysadmin = None if user is None else user.sysadmin is True
+            return cls(user_id, publisher_name, package_name, sysadmin=sysadmin)
+        publisher, package, role, found_user_id, sysadmin = row
+        sysadmin = None if found_user_id is None else sysadmin is True
+        return cls(user_id, publisher_name, package_name,
+                   publisher=publisher, package=package,
+                   sysadmin=sysadmin, role=role)
+
+    @property
+    def action(self):
+        return 'Package::Update' if self.package is not None \
+            else 'Package::Create'
+
+    def is_authorized(self):
+        actions = resolve_actions(self.package, self.sysadmin, self.role)
+        return self.action in actions
+
+    def check_authorized(self):
+        if not self.is_authorized():
+            raise InvalidUsage('Not authorized to upload data', 400)
+        if self.publisher is None:
+            raise InvalidUsage('Publisher not found', 404)
+
+
+class Heartbeat(object):
+    '''
+    Touches the updated_at of a claimed row every interval seconds from a
+    background thread while the work runs, so workers don't take a long
+    running job for an abandoned one. Used as a context manager.
+    '''
+
+    def __init__(self, model, row_id, interval):
+        self.table = model.__table__
+        self.row_id = row_id
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        engine, logger = db.engine, app.logger
+        table, row_id = self.table, self.row_id
+
+        def beat():
+            while not self._stop.wait(self.interval):
+                try:
+                    engine.execute(table.update()
+                                   .where(table.c.id == row_id)
+                                   .values(updated_at=datetime.datetime.utcnow()))
+                except Exception as e:
+                    logger.error('heartbeat of %s %s failed: %s',
+                                 table.name, row_id, e)
+
+        self._thread = threading.Thread(target=beat)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class PublishJob(object):
+    '''
+    Runs finalize_publish in the background. Jobs are rows of the
+    publish_job table, processed by `manager.py worker`.
+    '''
+
+    @classmethod
+    def enqueue(cls, user_id, datapackage_url):
+        '''
+        Checks the user is allowed to publish and queues the job. The job is
+        run right away when PUBLISH_JOBS_INLINE is set.
+        Returns the id of the job
+        '''
+        publisher, package, version = \
+            BitStore.extract_information_from_s3_url(datapackage_url)
+        PublishContext.load(user_id, publisher, package).check_authorized()
+
+        job = models.PublishJob(user_id=user_id, publisher=publisher,
+                                package=package,
+                                datapackage_url=datapackage_url)
+        db.session.add(job)
+        db.session.commit()
+        if app.config['PUBLISH_JOBS_INLINE']:
+            cls.run(job, raise_errors=True)
+        return job.id
+
+    @classmethod
+    def get(cls, job_id, user_id):
+        '''
+        Returns the job of the user as a dict or None if not found
+        '''
+        job = models.PublishJob.query\
+            .filter_by(id=job_id, user_id=user_id).first()
+        return job.to_dict() if job is not None else None
+
+    @classmethod
+    def run(cls, job, raise_errors=False):
+        try:
+            with Heartbeat(models.PublishJob, job.id,
+                           app.config['PUBLISH_JOB_TIMEOUT'] / 3):
+                Package.finalize_publish(job.user_id, job.datapackage_url)
+        except Exception as e:
+            db.session.rollback()
+            job.status = models.PublishJobStatusEnum.failed
+            job.error = getattr(e, 'message', None) or repr(e)
+            db.session.commit()
+            app.logger.error('publish job %s failed: %s', job.id, job.error)
+            if raise_errors:
+                raise
+            return False
+        job.status = models.PublishJobStatusEnum.done
+        job.error = None
+        db.session.commit()
+        return True
+
+    @classmethod
+    def work(cls, interval=1.0, once=False):
+        '''
+        Processes queued jobs until stopped, polling the queue every
+        interval seconds when it is empty. Returns the number of processed
+        jobs when once is set and the queue is drained.
+        '''
+        processed = 0
+        while True:
+            job = models.PublishJob.claim_next(
+                app.config['PUBLISH_JOB_TIMEOUT'],
+                app.config['PUBLISH_JOB_MAX_ATTEMPTS'])
+            if job is not None:
+                cls.run(job)
+                processed += 1
+            elif once:
+                return processed
+            else:
+                time.sleep(interval)
+
+
+class Outbox(object):
+    '''
+    Bitstore operations following database changes. An entry is added to
+    the session before the change is committed, so both are committed in
+    the same transaction, and is applied by `manager.py outbox`, or right
+    away when OUTBOX_INLINE is set. Operations are idempotent and retried
+    with an exponential backoff until OUTBOX_MAX_ATTEMPTS.
+    '''
+
+    @classmethod
+    def add(cls, operation, publisher, package, **payload):
+        '''
+        Adds the operation to the session, committed with the next commit.
+        Entries applied inline are marked running so workers leave them
+        alone unless the request dies before applying them.
+        '''
+        entry = models.OutboxEntry(operation=operation, publisher=publisher,
+                                   package=package, payload=payload)
+        if app.config['OUTBOX_INLINE']:
+            entry.status = models.OutboxStatusEnum.running
+            entry.attempts = 1
+        db.session.add(entry)
+        return entry
+
+    @classmethod
+    def has_pending(cls, publisher, package):
+        '''
+        Returns True while operations on the package are not applied yet
+        '''
+        statuses = (models.OutboxStatusEnum.pending,
+                    models.OutboxStatusEnum.running)
+        return db.session.query(models.OutboxEntry.query.filter(
+            models.OutboxEntry.publisher == publisher,
+            models.OutboxEntry.package == package,
+            models.OutboxEntry.status.in_(statuses)).exists()).scalar()
+
+    @classmethod
+    def dispatch(cls, entry):
+        '''
+        Makes sure the entry is committed and applies it when OUTBOX_INLINE
+        is set. Errors are raised, the entry is then retried by the worker.
+        '''
+        db.session.commit()
+        if app.config['OUTBOX_INLINE']:
+            cls.run(entry, raise_errors=True)
+
+    @classmethod
+    def apply(cls, entry):
+        payload = entry.payload or {}
+        bit_store = BitStore(entry.publisher, entry.package)
+        if entry.operation == 'change_acl':
+            bit_store.change_acl(payload['acl'],
+                                 versions=payload.get('versions'))
+        elif entry.operation == 'delete_package':
+            bit_store.delete_data_package()
+        elif entry.operation == 'copy_version':
+            logger = app.logger
+
+            def log_progress(key, copied, total):
+                logger.info('tag %s/%s@%s: copied %s (%d/%d)',
+                            entry.publisher, entry.package,
+                            payload['version'], key, copied, total)
+            package = models.Package.get_by_publisher(entry.publisher,
+                                                      entry.package)
+            acl = 'private' if package is not None and \
+                package.status == models.PackageStateEnum.deleted \
+                else 'public-read'
+            bit_store.copy_to_new_version(payload['version'],
+                                          progress=log_progress, acl=acl)
+        else:
+            raise ValueError('Unknown outbox operation %s' % entry.operation)
+
+    @classmethod
+    def run(cls, entry, raise_errors=False):
+        try:
+            with Heartbeat(models.OutboxEntry, entry.id,
+                           app.config['OUTBOX_TIMEOUT'] / 3):
+                cls.apply(entry)
+        except Exception as e:
+            db.session.rollback()
+            entry.error = getattr(e, 'message', None) or repr(e)
+            attempts = entry.attempts or 1
+            if attempts >= app.config['OUTBOX_MAX_ATTEMPTS']:
+                entry.status = models.OutboxStatusEnum.failed
+            else:
+                entry.status = models.OutboxStatusEnum.pending
+                delay = app.config['OUTBOX_RETRY_BACKOFF'] * 2 ** (attempts - 1)
+                entry.available_at = datetime.datetime.utcnow() + \
+                    datetime.timedelta(seconds=delay)
+            db.session.commit()
+            app.logger.error('outbox entry %s failed: %s', entry.id, entry.error)
+            if raise_errors:
+                raise
+            return False
+        entry.status = models.OutboxStatusEnum.done
+        entry.error = None
+        db.session.commit()
+        return True
+
+    @classmethod
+    def work(cls, interval=1.0, once=False):
+        '''
+        Applies due entries until stopped, polling the outbox every
+        interval seconds when nothing is due. Returns the number of
+        processed entries when once is set and nothing is due.
+        '''
+        processed = 0
+        while True:
+            entry = models.OutboxEntry.claim_next(app.config['OUTBOX_TIMEOUT'])
+            if entry is not None:
+                cls.run(entry)
+                processed += 1
+            elif once:
+                return processed
+            else:
+                time.sleep(interval)
+
+
 class PackageTag(LogicBase):
     schema = PackageTagSchema
 
@@ -277,6 +621,20 @@ class User(LogicBase):
         usr = models.User.query.get(usr_id)
         return cls.serialize(usr)
 
+    @classmethod
+    def get_session_user(cls, usr_id):
+        '''
+        Returns the slim user record used for the logged in user of
+        the site, without loading publishers.
+        '''
+        columns = ('id', 'name', 'email', 'full_name', 'secret', 'sysadmin')
+        usr = db.session.query(*[getattr(models.User, column)
+                                 for column in columns])\
+            .filter(models.User.id == usr_id).first()
+        if usr is None:
+            return None
+        return dict(zip(columns, usr))
+
     @classmethod
     def create(cls, metadata):
         usr = cls.deserialize(metadata)
@@ -356,25 +714,144 @@ def generate_signed_url(user_id, data):
     publisher, package_name = metadata['owner'], metadata['name']
     res_payload = {'filedata': {}}
 
-    if Package.exists(publisher, package_name):
-        status = check_is_authorized('Package::Update', publisher, package_name, user_id)
-    else:
-        status = check_is_authorized('Package::Create', publisher, package_name, user_id)
-
-    if not status:
-        raise InvalidUsage('Not authorized to upload data', 400)
+    context = PublishContext.load(user_id, publisher, package_name)
+    context.check_authorized()
+    # uploads go straight to the bitstore, a queued tag or purge would
+    # copy or delete them
+    if Outbox.has_pending(publisher, package_name):
+        raise InvalidUsage('Package has pending changes, try again later', 409)
+
+    # files already stored with the same md5 are not uploaded again
+    bit_store = BitStore(publisher, package_name)
+    stored_md5s = {}
+    if context.package is not None and context.package.content_hash:
+        stored_md5s = bit_store.get_file_md5s(bit_store.get_manifest())
+    content_addressed = app.config['BITSTORE_CONTENT_ADDRESSED']
+    blob_keys = bit_store.get_blob_keys() if content_addressed else set()
+    blobs, multipart_md5s = [], []
+    files, uploads = [], []
+    threshold = app.config['BITSTORE_MULTIPART_UPLOAD_THRESHOLD']
 
     for relative_path in filedata.keys():
-        response = FileData(package_name=package_name,
-                            publisher=publisher,
-                            relative_path=relative_path,
-                            props=filedata[relative_path])
-        res_payload['filedata'][relative_path] = response.build_file_information()
+        check_package_key(bit_store, bit_store.build_s3_key(relative_path))
+        props = filedata[relative_path]
+        md5 = md5_to_hex(props['md5'])
+        key = None
+        exists = md5 is not None and stored_md5s.get(relative_path) == md5
+        # the descriptor stays under the version, it is read on finalize
+        if content_addressed and md5 is not None \
+                and relative_path != 'datapackage.json':
+            key = bit_store.build_s3_blob_key(md5)
+            exists = key in blob_keys
+            blobs.append(dict(path=relative_path, key=key, md5=md5,
+                              size=props.get('size')))
+        file_data = FileData(package_name=package_name,
+                             publisher=publisher,
+                             relative_path=relative_path,
+                             props=props, key=key)
+        multipart = None
+        if not exists and ('upload_id' in props
+                           or int(props.get('size') or 0) > threshold):
+            multipart = authorize_multipart_upload(bit_store, file_data)
+            if not content_addressed and md5 is not None:
+                multipart_md5s.append(dict(key=multipart['key'], md5=md5))
+        elif not exists:
+            uploads.append(file_data.upload_params())
+        files.append((file_data, exists, multipart))
+
+    # posts are signed in one batch, in the order of the files to upload
+    posts = iter(bit_store.generate_pre_signed_posts(uploads))
+    for file_data, exists, multipart in files:
+        post = None if exists or multipart else next(posts)
+        res_payload['filedata'][file_data.relative_path] = \
+            file_data.build_file_information(exists=exists, post=post,
+                                             multipart=multipart)
+    if content_addressed or multipart_md5s:
+        bit_store.save_upload(blobs + multipart_md5s)
     return res_payload
 
 
+def authorize_multipart_upload(bit_store, file_data):
+    '''
+    Starts the multipart upload of a file, or resumes the one given as
+    upload_id, and presigns the urls of the parts not uploaded yet
+    @param bit_store: BitStore of the package
+    @param file_data: FileData of the file, its props hold the size
+    '''
+    params = file_data.upload_params()
+    key = params.get('key') or bit_store.build_s3_key(params['path'])
+    size = int(file_data.props.get('size') or 0)
+    part_size = get_part_size(size, app.config['BITSTORE_UPLOAD_PART_SIZE'])
+    upload_id = file_data.props.get('upload_id')
+    uploaded = []
+    if upload_id is None:
+        upload_id = bit_store.create_multipart_upload(
+            key, acl=params.get('acl', 'public-read'))
+    else:
+        try:
+            uploaded = bit_store.get_uploaded_parts(key, upload_id)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+            raise InvalidUsage('Upload %s not found' % upload_id, 400)
+    done = set(part['part_number'] for part in uploaded)
+    part_numbers = [number for number in range(1, -(-size // part_size) + 1)
+                    if number not in done]
+    return dict(key=key, upload_id=upload_id, part_size=part_size,
+                parts=bit_store.generate_upload_part_urls(
+                    key, upload_id, part_numbers),
+                uploaded_parts=uploaded)
+
+
+def complete_multipart_upload(user_id, data):
+    '''
+    Assembles the parts of a multipart upload started by generate_signed_url
+    @param data: dictionary of metadata (package owner and name), the key
+    and upload_id of the upload and the part_number and etag of every part
+    @param user_id: uniq id for user
+    '''
+    metadata = data.get('metadata') if isinstance(data, dict) else None
+    if not isinstance(metadata, dict) \
+            or 'owner' not in metadata or 'name' not in metadata:
+        raise InvalidUsage('metadata with owner and name is required', 400)
+    key, upload_id, parts = data.get('key'), data.get('upload_id'), \
+        data.get('parts')
+    if not isinstance(key, string_types) \
+            or not isinstance(upload_id, string_types):
+        raise InvalidUsage('key and upload_id are required', 400)
+    if not isinstance(parts, list) or not parts or not all(
+            isinstance(part, dict) and isinstance(part.get('part_number'), int)
+            and isinstance(part.get('etag'), string_types) for part in parts):
+        raise InvalidUsage('parts with part_number and etag are required', 400)
+
+    publisher, package_name = metadata['owner'], metadata['name']
+    context = PublishContext.load(user_id, publisher, package_name)
+    context.check_authorized()
+
+    bit_store = BitStore(publisher, package_name)
+    check_package_key(bit_store, key)
+    try:
+        etag = bit_store.complete_multipart_upload(key, upload_id, parts)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in MULTIPART_ERROR_CODES:
+            raise
+        raise InvalidUsage(e.response['Error']['Message'], 400)
+    return dict(key=key, etag=etag)
+
+
 #### helpers
 
+def check_package_key(bit_store, key):
+    '''
+    Raises a 400 unless key is normalized and stays under the prefix of the
+    package, so paths sent by clients can't reach other packages
+    '''
+    prefix = bit_store.build_s3_base_prefix() + '/'
+    if not is_valid_key(key) or \
+            not posixpath.normpath(key).startswith(prefix):
+        raise InvalidUsage('Invalid key %s' % key, 400)
+
+
 def validate_for_template(descriptor):
     '''
     Validates field types in the descriptor for template, e.g. licenses property should be a list.
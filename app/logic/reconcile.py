@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import calendar
+import errno
+import json
+import os
+import time
+from itertools import groupby
+
+from botocore.exceptions import ClientError
+from flask import current_app as app
+
+from app.bitstore import BitStore, BitStoreError
+from app.database import db
+from app.package.models import Package, PackageTag, PackageStateEnum
+from app.profile.models import Publisher
+
+
+class Reconciler(object):
+    """
+    Compares the packages of the database with their prefixes in the
+    bitstore and reports, or fixes, the ones that drifted apart.
+
+    Both sides are streamed sorted by ``<publisher>/<package>/``, in the
+    byte order of S3 listings, and merge-joined, so memory doesn't grow with
+    the number of packages or objects. The last package checked is saved to
+    ``checkpoint`` every ``checkpoint_every`` packages and an interrupted
+    run resumes after it.
+
+    Issues found:
+        - acl_mismatch: the descriptor of a version doesn't have the ACL
+          of the package status. Fixed by changing the ACL of the version
+        - orphaned_prefix: objects without a package, older than
+          RECONCILE_ORPHAN_GRACE seconds so uploads of new packages are not
+          reported. Fixed by deleting the objects
+        - missing_objects, missing_version: no objects for a package or one
+          of its tags
+        - orphaned_version: a version prefix without a tag
+    """
+
+    def __init__(self, checkpoint=None, fix=False, page_size=1000,
+                 checkpoint_every=100):
+        self.checkpoint = checkpoint
+        self.fix = fix
+        self.page_size = page_size
+        self.checkpoint_every = checkpoint_every
+
+    def run(self):
+        """
+        :return: Generator of the issues found, dicts with the type,
+                 publisher, package, whether it was fixed and details
+        """
+        after = self.load_checkpoint()
+        packages = iter_db_packages(after, self.page_size)
+        prefixes = iter_s3_packages(after, self.page_size)
+        checked = 0
+        for prefix, package, objects in merge_join(packages, prefixes):
+            for issue in self.check(prefix, package, objects):
+                if self.fix:
+                    issue['fixed'] = self.apply(issue)
+                yield issue
+            checked += 1
+            if checked % self.checkpoint_every == 0:
+                self.save_checkpoint(prefix)
+        self.clear_checkpoint()
+
+    def check(self, prefix, package, objects):
+        publisher, name = prefix.split('/')[:2]
+
+        def issue(kind, **details):
+            return dict(details, type=kind, publisher=publisher,
+                        package=name, fixed=False)
+
+        if objects is None:
+            yield issue('missing_objects')
+            return
+        if package is None:
+            grace = app.config['RECONCILE_ORPHAN_GRACE']
+            if objects['last_modified'] + grace < time.time():
+                yield issue('orphaned_prefix', objects=objects['count'])
+            return
+
+        versions, stored = set(package['versions']), objects['versions']
+        for version in sorted(versions - stored):
+            yield issue('missing_version', version=version)
+        for version in sorted(stored - versions):
+            yield issue('orphaned_version', version=version)
+
+        expected = 'public-read' \
+            if package['status'] == PackageStateEnum.active else 'private'
+        for version in sorted(versions & stored):
+            bit_store = BitStore(publisher, name, version)
+            try:
+                acl = bit_store.get_acl(
+                    bit_store.build_s3_key('datapackage.json'))
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                    raise
+                continue
+            if acl != expected:
+                yield issue('acl_mismatch', version=version, acl=acl,
+                            expected=expected)
+
+    def apply(self, issue):
+        """
+        Fixes the issue when it can be fixed automatically
+        :return: True if the issue was fixed
+        """
+        bit_store = BitStore(issue['publisher'], issue['package'])
+        try:
+            if issue['type'] == 'acl_mismatch':
+                return bit_store.change_acl(issue['expected'],
+                                            versions=[issue['version']])
+            if issue['type'] == 'orphaned_prefix':
+                return bit_store.delete_data_package()
+        except (BitStoreError, ClientError) as e:
+            app.logger.error(e)
+        return False
+
+    def load_checkpoint(self):
+        if self.checkpoint is None:
+            return None
+        try:
+            with open(self.checkpoint) as f:
+                return json.load(f)['after']
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+    def save_checkpoint(self, prefix):
+        if self.checkpoint is None:
+            return
+        tmp_path = self.checkpoint + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(after=prefix), f)
+        os.rename(tmp_path, self.checkpoint)
+
+    def clear_checkpoint(self):
+        if self.checkpoint is not None and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+
+def iter_db_packages(after=None, page_size=1000):
+    """
+    Yields the prefix and the status and versions of every package,
+    sorted by prefix in byte order. Packages are read in
+    pages following the last prefix, not with an offset.
+    """
+    prefix = (Publisher.name + '/' + Package.name + '/').collate('"C"')
+    query = db.session.query(prefix.label('prefix'), Package.id,
+                             Package.status).join(Package.publisher)
+    while True:
+        page = query
+        if after is not None:
+            page = page.filter(prefix > after)
+        rows = page.order_by(prefix).limit(page_size).all()
+        if not rows:
+            return
+        versions = dict((row.id, ['latest']) for row in rows)
+        tags = db.session.query(PackageTag.package_id, PackageTag.tag)\
+            .filter(PackageTag.package_id.in_(list(versions)))
+        for package_id, tag in tags:
+            if tag != 'latest':
+                versions[package_id].append(tag)
+        for row in rows:
+            yield row.prefix, dict(status=row.status,
+                                   versions=versions[row.id])
+        after = rows[-1].prefix
+
+
+def iter_s3_packages(after=None, page_size=1000):
+    """
+    Yields the prefix and the number of objects, last modification time
+    and versions stored under every package prefix of the bitstore, in the
+    order of the listing
+    """
+    base = BitStore.prefix + '/'
+    start_after = None
+    if after is not None:
+        # '0' follows '/', so every key of the package is skipped
+        start_after = base + after[:-1] + '0'
+    objects = BitStore.iter_objects(base, page_size, start_after)
+
+    def package_prefix(ob):
+        return '/'.join(ob['Key'][len(base):].split('/')[:2]) + '/'
+
+    package_objects = (ob for ob in objects
+                       if ob['Key'][len(base):].count('/') >= 2)
+    for prefix, obs in groupby(package_objects, package_prefix):
+        summary = dict(count=0, last_modified=0, versions=set())
+        for ob in obs:
+            summary['count'] += 1
+            modified = ob.get('LastModified')
+            if modified is not None:
+                summary['last_modified'] = max(
+                    summary['last_modified'],
+                    calendar.timegm(modified.utctimetuple()))
+            path = ob['Key'][len(base) + len(prefix):].split('/')
+            if len(path) > 2 and path[0] == '_v':
+                summary['versions'].add(path[1])
+        yield prefix, summary
+
+
+def merge_join(left, right):
+    """
+    Joins two iterators of (key, value) pairs sorted by key
+    :return: Generator of (key, left value, right value), values are None
+             when the key is missing on one side
+    """
+    left_item, right_item = next(left, None), next(right, None)
+    while left_item is not None or right_item is not None:
+        if right_item is None or \
+                (left_item is not None and left_item[0] < right_item[0]):
+            yield left_item[0], left_item[1], None
+            left_item = next(left, None)
+        elif left_item is None or right_item[0] < left_item[0]:
+            yield right_item[0], None, right_item[1]
+            right_item = next(right, None)
+        else:
+            yield left_item[0], left_item[1], right_item[1]
+            left_item, right_item = next(left, None), next(right, None)
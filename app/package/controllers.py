@@ -4,13 +4,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+
 from flask import Blueprint, request, jsonify, _request_ctx_stack
 from flask import current_app as app
 
 from app.auth.annotations import requires_auth, is_allowed
-from app.auth.annotations import get_user_from_jwt
-from app.bitstore import BitStore
-from app.utils import InvalidUsage
+from app.auth.annotations import get_auth_context
+from app.utils import InvalidUsage, string_types
 import app.logic as logic
 import app.models as models
 
@@ -73,12 +74,13 @@ def tag_data_package(publisher, package):
     if 'version' not in data:
         raise InvalidUsage('version not found', 400)
 
-    bitstore = BitStore(publisher, package)
+    # committed along with the tag
+    entry = logic.Outbox.add('copy_version', publisher, package,
+                             version=data['version'])
     status_db = logic.Package.create_or_update_tag(publisher, package, data['version'])
     try:
-        status_bitstore = bitstore.copy_to_new_version(data['version'])
+        logic.Outbox.dispatch(entry)
     except Exception as e:
-        ## TODO roll back changes in db
         raise InvalidUsage(e.message, 500)
 
     return jsonify({"status": "OK"}), 200
@@ -121,14 +123,16 @@ def delete_data_package(publisher, package):
                         type: string
                         default: OK
     """
-    bitstore = BitStore(publisher=publisher, package=package)
+    # committed along with the status
+    entry = logic.Outbox.add(
+        'change_acl', publisher, package, acl='private',
+        versions=logic.Package.get_versions(publisher, package))
     status_db = logic.Package.change_status(publisher, package, models.PackageStateEnum.deleted)
     try:
-        status_acl = bitstore.change_acl('private')
+        logic.Outbox.dispatch(entry)
     except Exception as e:
-        ## TODO roll back changes in db
         raise InvalidUsage(e.message, 500)
-    if status_acl and status_db:
+    if status_db:
         return jsonify({"status": "OK"}), 200
 
 
@@ -171,14 +175,16 @@ def undelete_data_package(publisher, package):
                         default: OK
 
     """
-    bitstore = BitStore(publisher=publisher, package=package)
+    # committed along with the status
+    entry = logic.Outbox.add(
+        'change_acl', publisher, package, acl='public-read',
+        versions=logic.Package.get_versions(publisher, package))
     status_db = logic.Package.change_status(publisher, package, models.PackageStateEnum.active)
     try:
-        status_acl = bitstore.change_acl('public-read')
+        logic.Outbox.dispatch(entry)
     except Exception as e:
-        ## TODO roll back changes in db
         raise InvalidUsage(e.message, 500)
-    if status_acl and status_db:
+    if status_db:
         return jsonify({"status": "OK"}), 200
 
 
@@ -220,14 +226,14 @@ def purge_data_package(publisher, package):
                         type: string
                         default: OK
     """
-    bitstore = BitStore(publisher=publisher, package=package)
+    # committed along with the deletion
+    entry = logic.Outbox.add('delete_package', publisher, package)
     status_db = logic.Package.delete(publisher, package)
     try:
-        status_acl = bitstore.delete_data_package()
+        logic.Outbox.dispatch(entry)
     except Exception as e:
-        ## TODO roll back changes in db
         raise InvalidUsage(e.message, 500)
-    if status_acl and status_db:
+    if status_db:
         return jsonify({"status": "OK"}), 200
 
 @package_blueprint.route("/upload", methods=["POST"])
@@ -253,7 +259,16 @@ def finalize_publish():
           description: JWT Token
     responses:
         200:
-            description: Data Uploaded
+            description: Data Package queued for import
+            schema:
+                id: publish_job_queued
+                properties:
+                    status:
+                        type: string
+                        default: queued
+                    job_id:
+                        type: integer
+                        description: id to poll the job status with
         400:
             description: Un-Authorized
         401:
@@ -263,15 +278,146 @@ def finalize_publish():
     """
     data = request.get_json()
     datapackage_url = data['datapackage']
-    jwt_status, user_info = get_user_from_jwt(request, app.config['JWT_SEED'])
-    user_id = None
-    if jwt_status:
-        user_id = user_info['user']
+    user_id = get_auth_context().user_id
+
+    job_id = logic.PublishJob.enqueue(user_id, datapackage_url)
+    return jsonify({"status": "queued", "job_id": job_id}), 200
+
+
+@package_blueprint.route("/upload/<int:job_id>", methods=["GET"])
+@requires_auth
+def get_publish_status(job_id):
+    """
+    Data Package finalize status.
 
-    status = logic.Package.finalize_publish(user_id, datapackage_url)
-    if status:
-        return jsonify({"status": status}), 200
-    raise InvalidUsage("Failed to get data from s3")
+    Returns the status of a job queued by the finalize operation.
+    ---
+    tags:
+        - package
+    parameters:
+        - in: path
+          name: job_id
+          type: integer
+          required: true
+          description: id of the publish job
+        - in: header
+          name: Authorization
+          type: string
+          required: true
+          description: JWT Token
+    responses:
+        200:
+            description: Job status
+            schema:
+                id: publish_job
+                properties:
+                    id:
+                        type: integer
+                    status:
+                        type: string
+                        description: QUEUED, RUNNING, DONE or FAILED
+                    datapackage:
+                        type: string
+                    error:
+                        type: string
+                    created_at:
+                        type: string
+                    updated_at:
+                        type: string
+        401:
+            description: Invalid Header For JWT
+        404:
+            description: Job not found
+    """
+    job = logic.PublishJob.get(job_id, get_auth_context().user_id)
+    if job is None:
+        raise InvalidUsage('Job not found', 404)
+    return jsonify(job), 200
+
+
+@package_blueprint.route("/_bulk", methods=["GET", "POST"])
+def get_metadata_bulk():
+    """
+    DPR meta-data bulk get operation.
+    This API is responsible for getting metadata of many data packages
+    in one request.
+    ---
+    tags:
+        - package
+    parameters:
+        - in: query
+          name: ids
+          type: string
+          required: false
+          description: comma separated publisher/package pairs
+                       e.g. ids=core/gold-prices,core/house-prices-us
+        - in: body
+          name: data
+          type: map
+          required: false
+          description: packages, a list of objects with publisher and
+                       package names e.g. {"packages": [{"publisher": "core",
+                       "package": "gold-prices"}]}
+    responses:
+        200:
+            description: Data packages keyed by publisher/package
+            schema:
+                id: get_data_package_bulk
+                properties:
+                    data:
+                        type: map
+                        description: status and package metadata for each
+                                     requested publisher/package
+        400:
+            description: Invalid package list or batch is too large
+        500:
+            description: Internal Server Error
+    """
+    names = get_bulk_package_names()
+    max_size = app.config['BULK_PACKAGE_MAX_BATCH_SIZE']
+    if len(names) > max_size:
+        raise InvalidUsage('Can not fetch more than %d packages at once'
+                           % max_size, 400)
+
+    result = {}
+    for (publisher, package), metadata in zip(names, logic.Package.get_many(names)):
+        key = '{pub}/{pkg}'.format(pub=publisher, pkg=package)
+        if metadata is None:
+            result[key] = dict(status=404,
+                               message='No metadata found for the package')
+        else:
+            result[key] = dict(status=200, package=metadata)
+    return jsonify({'data': result}), 200
+
+
+def get_bulk_package_names():
+    """
+    Reads publisher/package pairs from the request, either from the ids
+    query parameter or from the packages list of the JSON body
+    """
+    names = []
+    if request.method == 'GET':
+        ids = request.args.get('ids', '')
+        for item in filter(None, ids.split(',')):
+            if item.count('/') != 1:
+                raise InvalidUsage('Invalid package id %s' % item, 400)
+            names.append(tuple(item.split('/')))
+    else:
+        data = request.get_json(silent=True)
+        packages = data.get('packages') if isinstance(data, dict) else None
+        if not isinstance(packages, list):
+            raise InvalidUsage('packages must be a list', 400)
+        for item in packages:
+            if not isinstance(item, dict) or not all(
+                    isinstance(item.get(field), string_types) and item[field]
+                    for field in ('publisher', 'package')):
+                raise InvalidUsage('publisher and package names are required',
+                                   400)
+            names.append((item['publisher'], item['package']))
+    if not names:
+        raise InvalidUsage('No packages requested', 400)
+    # duplicated names resolve to the same package
+    return list(OrderedDict.fromkeys(names))
 
 
 @package_blueprint.route("/<publisher>/<package>", methods=["GET"])
@@ -318,7 +464,8 @@ def get_metadata(publisher, package):
 def get_all_metadata_names_for_publisher(publisher):
     """
     Get Packages For Publisher
-    Returns all packages published under given publisher
+    Returns packages published under given publisher ordered by name,
+    one page at a time
     ---
     tags:
         - package
@@ -328,6 +475,21 @@ def get_all_metadata_names_for_publisher(publisher):
           type: string
           required: true
           description: publisher name
+        - in: query
+          name: after
+          type: string
+          required: false
+          description: name of the last package of the previous page
+        - in: query
+          name: limit
+          type: integer
+          required: false
+          description: page size, 500 by default, from 1 to 1000
+        - in: query
+          name: status
+          type: string
+          required: false
+          description: only list packages with this status e.g. active
     responses:
         200:
             description: Get Data package for one key
@@ -337,14 +499,53 @@ def get_all_metadata_names_for_publisher(publisher):
                     data:
                         type: array
                         items:
-                            type: array
-                            items:
-                                type: string
+                            type: string
+                    packages:
+                        type: array
+                        items:
+                            type: object
+                            properties:
+                                name:
+                                    type: string
+                                status:
+                                    type: string
+                                updated_at:
+                                    type: string
+                    next:
+                        type: string
+                        description: value of after for the next page,
+                                     null on the last page
+        400:
+            description: Invalid status or limit
         500:
             description: Internal Server Error
         404:
             description: No Data Package Found For The Publisher
     """
-    publisher = models.Publisher.query.filter_by(name=publisher).first_or_404()
-    pkgnames = [ pkg.name for pkg in publisher.packages ]
-    return jsonify({'data': pkgnames}), 200
+    publisher_id, = models.Publisher.query.with_entities(models.Publisher.id)\
+        .filter_by(name=publisher).first_or_404()
+
+    try:
+        limit = min(int(request.args.get('limit')), 1000)
+    except (ValueError, TypeError):
+        limit = 500
+    if limit < 1:
+        raise InvalidUsage('Invalid limit %s' % limit, 400)
+
+    status = request.args.get('status')
+    if status is not None:
+        try:
+            status = models.PackageStateEnum[status.lower()]
+        except KeyError:
+            raise InvalidUsage('Invalid status %s' % status, 400)
+
+    rows = models.Package.list_by_publisher(publisher_id,
+                                            after=request.args.get('after'),
+                                            limit=limit, status=status)
+    packages = [dict(name=name, status=state.value,
+                     updated_at=updated_at.isoformat() if updated_at else None)
+                for name, state, updated_at in rows]
+    next_page = packages[-1]['name'] if len(packages) == limit else None
+    return jsonify({'data': [pkg['name'] for pkg in packages],
+                    'packages': packages,
+                    'next': next_page}), 200
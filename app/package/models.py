@@ -10,8 +10,11 @@ import datetime
 import enum
 from sqlalchemy import ForeignKey
 from sqlalchemy import UniqueConstraint
+from sqlalchemy import tuple_
+from sqlalchemy import Index
+from sqlalchemy import or_
 from flask import current_app as app
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import aliased, relationship, contains_eager
 from app.profile.models import Publisher
 from app.database import db
 from botocore.exceptions import ClientError
@@ -22,6 +25,20 @@ class PackageStateEnum(enum.Enum):
     deleted = "DELETED"
 
 
+class PublishJobStatusEnum(enum.Enum):
+    queued = "QUEUED"
+    running = "RUNNING"
+    done = "DONE"
+    failed = "FAILED"
+
+
+class OutboxStatusEnum(enum.Enum):
+    pending = "PENDING"
+    running = "RUNNING"
+    done = "DONE"
+    failed = "FAILED"
+
+
 class Package(db.Model):
     """
     This class is DB model for storing package data
@@ -30,6 +47,8 @@ class Package(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
     name = db.Column(db.TEXT, index=True)
     status = db.Column(db.Enum(PackageStateEnum, native_enum=False),
                        index=True, default=PackageStateEnum.active)
@@ -42,11 +61,14 @@ class Package(db.Model):
 
     descriptor = db.Column(db.JSON)
     readme = db.Column(db.TEXT)
+    # hash of the md5 of every file of the latest version when published
+    content_hash = db.Column(db.TEXT)
 
     tags = relationship("PackageTag", back_populates="package")
 
     __table_args__ = (
         UniqueConstraint("name", "publisher_id"),
+        Index("ix_package_publisher_id_name", "publisher_id", "name"),
     )
 
     @classmethod
@@ -56,6 +78,37 @@ class Package(db.Model):
                     Publisher.name == publisher_name).one_or_none()
         return instance
 
+    @classmethod
+    def get_many_by_publisher(cls, names):
+        """
+        Fetches packages for many (publisher name, package name) pairs in
+        a single query with their publishers eagerly loaded.
+        :return: dict of (publisher name, package name) to the instance
+        """
+        if not names:
+            return {}
+        instances = cls.query.join(Package.publisher) \
+            .options(contains_eager(Package.publisher)) \
+            .filter(tuple_(Publisher.name, Package.name).in_(names)).all()
+        return dict(((instance.publisher.name, instance.name), instance)
+                    for instance in instances)
+
+    @classmethod
+    def list_by_publisher(cls, publisher_id, after=None, limit=500, status=None):
+        """
+        Lists name, status and updated_at of the publisher packages ordered
+        by name, without loading descriptors and readmes.
+        :param after: name of the last package of the previous page
+        :param status: optional PackageStateEnum to filter by
+        """
+        query = db.session.query(cls.name, cls.status, cls.updated_at) \
+            .filter(cls.publisher_id == publisher_id)
+        if after is not None:
+            query = query.filter(cls.name > after)
+        if status is not None:
+            query = query.filter(cls.status == status)
+        return query.order_by(cls.name).limit(limit).all()
+
 
 class PackageTag(db.Model):
 
@@ -85,3 +138,136 @@ class PackageTag(db.Model):
         instance = cls.query.join(Package).filter(
                 Package.id==package_id, PackageTag.tag==tag).first()
         return instance
+
+
+class PublishJob(db.Model):
+    """
+    Queue of finalize publish requests, processed by `manager.py worker`
+    """
+    __tablename__ = 'publish_job'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
+
+    user_id = db.Column(db.Integer, ForeignKey('user.id', ondelete='CASCADE'),
+                        index=True)
+    datapackage_url = db.Column(db.TEXT, nullable=False)
+    publisher = db.Column(db.TEXT)
+    package = db.Column(db.TEXT)
+    status = db.Column(db.Enum(PublishJobStatusEnum, native_enum=False),
+                       index=True, default=PublishJobStatusEnum.queued)
+    attempts = db.Column(db.Integer, default=0)
+    error = db.Column(db.TEXT)
+
+    @classmethod
+    def claim_next(cls, timeout, max_attempts=None):
+        """
+        Marks the oldest queued job as running and returns it. Jobs wait for
+        the older unfinished outbox entries of their package, so a publish
+        is not undone by an earlier purge or unpublish. Rows locked by
+        other workers are skipped, so any number of workers can poll the
+        table. Jobs left running for more than timeout seconds by a dead
+        worker are picked up again, unless they were already tried
+        max_attempts times: those are marked failed, so a job crashing its
+        worker is not retried forever.
+        :return: The claimed job or None if the queue is empty
+        """
+        stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=timeout)
+        abandoned = (cls.status == PublishJobStatusEnum.running) & \
+            (cls.updated_at < stale)
+        if max_attempts is not None:
+            failed = cls.query.filter(abandoned, cls.attempts >= max_attempts)\
+                .update({cls.status: PublishJobStatusEnum.failed,
+                         cls.error: 'Abandoned after %d attempts' % max_attempts},
+                        synchronize_session=False)
+            if failed:
+                db.session.commit()
+            abandoned = abandoned & (cls.attempts < max_attempts)
+        blocked = db.session.query(OutboxEntry.id).filter(
+            OutboxEntry.publisher == cls.publisher,
+            OutboxEntry.package == cls.package,
+            OutboxEntry.created_at < cls.created_at,
+            or_(OutboxEntry.status == OutboxStatusEnum.pending,
+                OutboxEntry.status == OutboxStatusEnum.running))
+        job = cls.query.filter(or_(
+            cls.status == PublishJobStatusEnum.queued, abandoned),
+            ~blocked.exists())\
+            .order_by(cls.id)\
+            .with_for_update(skip_locked=True).first()
+        if job is None:
+            db.session.rollback()
+            return None
+        job.status = PublishJobStatusEnum.running
+        job.attempts = (job.attempts or 0) + 1
+        db.session.commit()
+        return job
+
+    def to_dict(self):
+        return dict(id=self.id, status=self.status.value,
+                    datapackage=self.datapackage_url, error=self.error,
+                    created_at=self.created_at.isoformat(),
+                    updated_at=self.updated_at.isoformat())
+
+
+class OutboxEntry(db.Model):
+    """
+    Bitstore operation following a database change, written in the same
+    transaction and processed by `manager.py outbox`
+    """
+    __tablename__ = 'outbox'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
+
+    operation = db.Column(db.TEXT, nullable=False)
+    publisher = db.Column(db.TEXT, nullable=False)
+    package = db.Column(db.TEXT, nullable=False)
+    payload = db.Column(db.JSON)
+    status = db.Column(db.Enum(OutboxStatusEnum, native_enum=False),
+                       index=True, default=OutboxStatusEnum.pending)
+    attempts = db.Column(db.Integer, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    error = db.Column(db.TEXT)
+
+    @classmethod
+    def claim_next(cls, timeout):
+        """
+        Marks the oldest pending entry due for a try as running and returns
+        it. Entries wait for the older unfinished entries and publish jobs
+        of their package, so operations on a package are applied in order
+        and a tag copies the content published before it. Rows locked by
+        other workers are skipped and entries left running for more than
+        timeout seconds are picked up again.
+        :return: The claimed entry or None if nothing is due
+        """
+        now = datetime.datetime.utcnow()
+        stale = now - datetime.timedelta(seconds=timeout)
+        older = aliased(cls)
+        blocked = db.session.query(older.id).filter(
+            older.publisher == cls.publisher, older.package == cls.package,
+            older.id < cls.id,
+            or_(older.status == OutboxStatusEnum.pending,
+                older.status == OutboxStatusEnum.running))
+        publishing = db.session.query(PublishJob.id).filter(
+            PublishJob.publisher == cls.publisher,
+            PublishJob.package == cls.package,
+            PublishJob.created_at < cls.created_at,
+            or_(PublishJob.status == PublishJobStatusEnum.queued,
+                PublishJob.status == PublishJobStatusEnum.running))
+        entry = cls.query.filter(or_(
+            (cls.status == OutboxStatusEnum.pending) & (cls.available_at <= now),
+            (cls.status == OutboxStatusEnum.running) & (cls.updated_at < stale)),
+            ~blocked.exists(), ~publishing.exists())\
+            .order_by(cls.id)\
+            .with_for_update(skip_locked=True).first()
+        if entry is None:
+            db.session.rollback()
+            return None
+        entry.status = OutboxStatusEnum.running
+        entry.attempts = (entry.attempts or 0) + 1
+        db.session.commit()
+        return entry
@@ -7,8 +7,10 @@ from __future__ import unicode_literals
 from flask import Blueprint, render_template, \
     json, request, redirect, g, make_response
 from flask import current_app as app
+from app.auth.annotations import check_are_authorized
 from app.auth.jwt import JWT
 from app.bitstore import BitStore
+from app.cache import cached_page
 from app.utils import InvalidUsage
 import app.logic as logic
 
@@ -16,25 +18,37 @@ site_blueprint = Blueprint('site', __name__)
 
 
 @site_blueprint.route("/", methods=["GET", "POST"])
+@cached_page
 def index():
     """
     Renders index.html if no token found in cookie.
     If token found in cookie then it renders dashboard.html
     """
-    showcase_packages = [logic.Package.get(item['publisher'], item['package']) for item in app.config['FRONT_PAGE_SHOWCASE_PACKAGES']]
-    tutorial_packages = [ logic.Package.get(item['publisher'], item['package']) for item in app.config['TUTORIAL_PACKAGES']]
-    showcase_packages = filter(None, showcase_packages)
-    tutorial_packages = filter(None, tutorial_packages)
-
     if g.current_user:
         return render_template("dashboard.html",
                                title='Dashboard'), 200
+    showcase_packages, tutorial_packages = app.config['FRONT_PAGE_CACHE']\
+        .get('front_page', load_front_page_packages)
     return render_template("index.html",
                             title='Home',
                             showcase_packages=showcase_packages,
                             tutorial_packages=tutorial_packages), 200
 
 
+def load_front_page_packages():
+    """
+    Loads showcase and tutorial packages for the front page in one query
+    """
+    showcase = [(item['publisher'], item['package'])
+                for item in app.config['FRONT_PAGE_SHOWCASE_PACKAGES']]
+    tutorial = [(item['publisher'], item['package'])
+                for item in app.config['TUTORIAL_PACKAGES']]
+    packages = logic.Package.get_many(showcase + tutorial)
+    showcase_packages = filter(None, packages[:len(showcase)])
+    tutorial_packages = filter(None, packages[len(showcase):])
+    return showcase_packages, tutorial_packages
+
+
 @site_blueprint.route("/logout", methods=["GET"])
 def logout():
     """
@@ -48,6 +62,7 @@ def logout():
 
 
 @site_blueprint.route("/<publisher>/<package>", methods=["GET"])
+@cached_page
 def datapackage_show(publisher, package):
     """
     Loads datapackage page for given owner
@@ -67,6 +82,7 @@ def datapackage_show(publisher, package):
 
 
 @site_blueprint.route("/<publisher>", methods=["GET"])
+@cached_page
 def publisher_dashboard(publisher):
     datapackage_list = logic.search.DataPackageQuery(query_string="* publisher:{publisher}"
                                         .format(publisher=publisher)).get_data()
@@ -76,10 +92,12 @@ def publisher_dashboard(publisher):
         raise InvalidUsage('Not Found', 404)
     return render_template("publisher.html",
                            publisher=publisher,
-                           datapackage_list=datapackage_list), 200
+                           datapackage_list=datapackage_list,
+                           editable=get_editable_packages(datapackage_list)), 200
 
 
 @site_blueprint.route("/search", methods=["GET"])
+@cached_page
 def search_package():
     q = request.args.get('q')
     if q is None:
@@ -89,4 +107,20 @@ def search_package():
     return render_template("search.html",
                            datapackage_list=datapackage_list,
                            total_count=len(datapackage_list),
-                           query_term=q), 200
+                           query_term=q,
+                           editable=get_editable_packages(datapackage_list)), 200
+
+
+def get_editable_packages(datapackage_list):
+    """
+    Checks in one go which of the listed packages the logged in user
+    can update
+    :return: dict of "publisher/package" to True if editable
+    """
+    if not g.current_user or not datapackage_list:
+        return {}
+    names = [(item['publisher_name'], item['name']) for item in datapackage_list]
+    permissions = check_are_authorized('Package::Update', names,
+                                       g.current_user['id'])
+    return dict(('/'.join(name), allowed)
+                for name, allowed in permissions.items())
@@ -4,6 +4,12 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
 class InvalidUsage(Exception):
     status_code = 400
 
@@ -5,6 +5,8 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import time
+
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from flask import current_app, json
@@ -13,7 +15,9 @@ from dotenv import load_dotenv
 from app import create_app
 from app.bitstore import BitStore
 from app.database import db
+from app.logic.reconcile import Reconciler
 import app.models as models
+import app.logic as logic
 
 dot_env_path = join(dirname(__file__), '.env')
 load_dotenv(dot_env_path)
@@ -58,6 +62,73 @@ def populate():
     populate_data(user_name)
 
 
+@manager.option('-i', '--interval', dest='interval', type=float, default=1.0,
+                help='seconds to wait between polls of an empty queue')
+@manager.option('--once', dest='once', action='store_true', default=False,
+                help='exit once the queue is drained')
+def worker(interval, once):
+    """
+    Processes queued publish jobs. Start as many workers as needed.
+    """
+    logic.PublishJob.work(interval=interval, once=once)
+
+
+@manager.option('-i', '--interval', dest='interval', type=float, default=1.0,
+                help='seconds to wait between polls when nothing is due')
+@manager.option('--once', dest='once', action='store_true', default=False,
+                help='exit once no entry is due')
+def outbox(interval, once):
+    """
+    Applies the bitstore operations of the outbox. Start as many workers as
+    needed.
+    """
+    logic.Outbox.work(interval=interval, once=once)
+
+
+@manager.option('-n', '--files', dest='files', type=int, default=10000,
+                help='number of files to sign posts for')
+def bench_signing(files):
+    """
+    Compares signing the upload posts of a package one by one and in batch.
+    No request is made to S3.
+    """
+    bit_store = BitStore('bench', 'bench')
+    uploads = [dict(md5='jXd/OF09/siBXSD3SWAm3A==', path='data/%d.csv' % i)
+               for i in range(files)]
+    with app.test_request_context():
+        start = time.time()
+        for upload in uploads:
+            bit_store.generate_pre_signed_post_object(**upload)
+        single = time.time() - start
+        start = time.time()
+        bit_store.generate_pre_signed_posts(uploads)
+        batch = time.time() - start
+    print('%d posts: %.2fs one by one, %.2fs in batch (%.1fx)'
+          % (files, single, batch, single / max(batch, 1e-9)))
+
+
+@manager.option('--fix', dest='fix', action='store_true', default=False,
+                help='fix the acl mismatches and delete orphaned prefixes')
+@manager.option('--checkpoint', dest='checkpoint',
+                default='reconcile.checkpoint.json',
+                help='file keeping the progress of an interrupted run')
+@manager.option('--restart', dest='restart', action='store_true',
+                default=False, help='ignore the checkpoint of a previous run')
+def reconcile(fix, checkpoint, restart):
+    """
+    Reports the packages whose database row and bitstore objects drifted
+    apart, one json document per line.
+    """
+    reconciler = Reconciler(checkpoint=checkpoint, fix=fix)
+    if restart:
+        reconciler.clear_checkpoint()
+    counts = {}
+    for issue in reconciler.run():
+        counts[issue['type']] = counts.get(issue['type'], 0) + 1
+        print(json.dumps(issue, sort_keys=True))
+    print(json.dumps(dict(issues=counts), sort_keys=True))
+
+
 def populate_db(email, user_name, full_name, secret):
     user = models.User.query.filter_by(name=user_name).first()
 
@@ -0,0 +1,26 @@
+"""add package updated_at and (publisher_id, name) index
+
+Revision ID: 3f1c2a7d9b10
+Revises: 8bf484e84d87
+Create Date: 2026-10-19 10:12:41.113402
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9b10'
+down_revision = '8bf484e84d87'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('package', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE package SET updated_at = created_at')
+    op.create_index('ix_package_publisher_id_name', 'package',
+                    ['publisher_id', 'name'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_package_publisher_id_name', table_name='package')
+    op.drop_column('package', 'updated_at')
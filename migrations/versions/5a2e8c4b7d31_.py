@@ -0,0 +1,39 @@
+"""add publish_job queue table
+
+Revision ID: 5a2e8c4b7d31
+Revises: 3f1c2a7d9b10
+Create Date: 2026-10-19 14:03:27.540211
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a2e8c4b7d31'
+down_revision = '3f1c2a7d9b10'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('publish_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('datapackage_url', sa.TEXT(), nullable=False),
+    sa.Column('publisher', sa.TEXT(), nullable=True),
+    sa.Column('package', sa.TEXT(), nullable=True),
+    sa.Column('status', sa.Enum('queued', 'running', 'done', 'failed', name='publishjobstatusenum', native_enum=False), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('error', sa.TEXT(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_publish_job_status'), 'publish_job', ['status'], unique=False)
+    op.create_index(op.f('ix_publish_job_user_id'), 'publish_job', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_publish_job_user_id'), table_name='publish_job')
+    op.drop_index(op.f('ix_publish_job_status'), table_name='publish_job')
+    op.drop_table('publish_job')
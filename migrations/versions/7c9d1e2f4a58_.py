@@ -0,0 +1,22 @@
+"""add package content_hash
+
+Revision ID: 7c9d1e2f4a58
+Revises: 5a2e8c4b7d31
+Create Date: 2026-10-19 15:21:09.872614
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c9d1e2f4a58'
+down_revision = '5a2e8c4b7d31'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('package', sa.Column('content_hash', sa.TEXT(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('package', 'content_hash')
@@ -0,0 +1,37 @@
+"""add outbox table
+
+Revision ID: 9e4b7a1c3d62
+Revises: 7c9d1e2f4a58
+Create Date: 2026-10-19 17:42:51.318406
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9e4b7a1c3d62'
+down_revision = '7c9d1e2f4a58'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('operation', sa.TEXT(), nullable=False),
+    sa.Column('publisher', sa.TEXT(), nullable=False),
+    sa.Column('package', sa.TEXT(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=True),
+    sa.Column('status', sa.Enum('pending', 'running', 'done', 'failed', name='outboxstatusenum', native_enum=False), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('available_at', sa.DateTime(), nullable=True),
+    sa.Column('error', sa.TEXT(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_outbox_status'), 'outbox', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_outbox_status'), table_name='outbox')
+    op.drop_table('outbox')
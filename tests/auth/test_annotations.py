@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+from mock import patch
+from app import create_app
+from app.auth.annotations import get_auth_context, check_are_authorized
+from app.auth.jwt import JWT
+from app.database import db
+from app.package.models import Package
+from app.profile.models import User, Publisher, PublisherUser, UserRoleEnum
+from app.utils import InvalidUsage
+
+
+class AuthContextTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.token = JWT(self.app.config['JWT_SEED'], 11).encode()
+
+    def test_token_is_decoded_once_per_request(self):
+        with patch('app.auth.jwt.JWT.decode', wraps=JWT(self.app.config['JWT_SEED']).decode) as decode:
+            with self.app.test_request_context(headers={'Authorization': self.token}):
+                self.assertEqual(get_auth_context().user_id, 11)
+                self.assertEqual(get_auth_context().user_id, 11)
+            self.assertEqual(decode.call_count, 1)
+
+    def test_verified_token_is_reused_by_next_requests(self):
+        with patch('app.auth.jwt.JWT.decode', wraps=JWT(self.app.config['JWT_SEED']).decode) as decode:
+            with self.app.test_request_context(headers={'Authorization': self.token}):
+                get_auth_context()
+            with self.app.test_request_context(headers={'Auth-Token': self.token}):
+                self.assertEqual(get_auth_context().user_id, 11)
+            self.assertEqual(decode.call_count, 1)
+
+    def test_throw_401_if_no_token(self):
+        with self.app.test_request_context():
+            with self.assertRaises(InvalidUsage) as context:
+                get_auth_context()
+            self.assertEqual(context.exception.status_code, 401)
+
+    def test_throw_400_if_token_is_invalid(self):
+        with self.app.test_request_context(headers={'Authorization': 'invalid'}):
+            with self.assertRaises(InvalidUsage) as context:
+                get_auth_context()
+            self.assertEqual(context.exception.status_code, 400)
+
+    def test_context_is_not_shared_between_tokens(self):
+        other_token = JWT(self.app.config['JWT_SEED'], 12).encode()
+        with self.app.app_context():
+            with self.app.test_request_context(headers={'Authorization': self.token}):
+                self.assertEqual(get_auth_context().user_id, 11)
+            with self.app.test_request_context(headers={'Authorization': other_token}):
+                self.assertEqual(get_auth_context().user_id, 12)
+
+
+class CheckAreAuthorizedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.app_context().push()
+        db.drop_all()
+        db.create_all()
+        user = User(id=11, name='owner', secret='supersecret')
+        publisher = Publisher(name='owner')
+        publisher.packages.append(Package(name='package1'))
+        publisher.packages.append(Package(name='package2'))
+        association = PublisherUser(role=UserRoleEnum.owner)
+        association.publisher = publisher
+        user.publishers.append(association)
+        other = Publisher(name='other')
+        other.packages.append(Package(name='package1'))
+        db.session.add(user)
+        db.session.add(other)
+        db.session.commit()
+
+    def test_returns_permission_for_each_package(self):
+        names = [('owner', 'package1'), ('owner', 'package2'),
+                 ('other', 'package1')]
+        permissions = check_are_authorized('Package::Update', names, 11)
+        self.assertEqual(permissions, {('owner', 'package1'): True,
+                                       ('owner', 'package2'): True,
+                                       ('other', 'package1'): False})
+
+    def test_missing_package_is_checked_like_a_new_one(self):
+        permissions = check_are_authorized('Package::Create',
+                                           [('owner', 'unknown')], 11)
+        self.assertTrue(permissions[('owner', 'unknown')])
+
+    def test_returns_permission_for_each_publisher(self):
+        permissions = check_are_authorized('Publisher::Delete',
+                                           ['owner', 'other'], 11)
+        self.assertEqual(permissions, {'owner': True, 'other': False})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
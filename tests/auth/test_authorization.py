@@ -6,8 +6,10 @@ from __future__ import unicode_literals
 
 import unittest
 
+from mock import patch
 from app import create_app
-from app.auth.authorization import is_authorize
+import app.auth.authorization as authorization
+from app.auth.authorization import is_authorize, get_permissions
 from app.database import db
 from app.package.models import Package
 from app.profile.models import User, Publisher, UserRoleEnum, PublisherUser
@@ -222,6 +224,55 @@ class AuthorizationTestCase(unittest.TestCase):
         allowed = is_authorize(13, package, 'Publisher::Create')
         self.assertTrue(allowed)
 
+    def test_role_lookup_is_memoized(self):
+        with patch('app.auth.authorization._load_role',
+                   wraps=authorization._load_role) as load_role:
+            self.assertTrue(is_authorize(11, self.publisher, 'Publisher::Delete'))
+            self.assertTrue(is_authorize(11, self.publisher, 'Publisher::Update'))
+            self.assertEqual(load_role.call_count, 1)
+
+    def test_membership_change_invalidates_cached_role(self):
+        self.assertFalse(is_authorize(13, self.publisher3, 'Publisher::Delete'))
+        association = PublisherUser(role=UserRoleEnum.owner)
+        association.publisher = Publisher.query.get(self.publisher3.id)
+        association.user = User.query.get(13)
+        db.session.add(association)
+        db.session.commit()
+        self.assertTrue(is_authorize(13, self.publisher3, 'Publisher::Delete'))
+
+    def test_sysadmin_change_invalidates_cached_flag(self):
+        self.assertFalse(is_authorize(13, self.publisher3, 'Publisher::Delete'))
+        user = User.query.get(13)
+        user.sysadmin = True
+        db.session.add(user)
+        db.session.commit()
+        self.assertTrue(is_authorize(13, self.publisher3, 'Publisher::Delete'))
+
+    def test_get_permissions_for_many_publishers(self):
+        publishers = [self.publisher, self.publisher1, self.publisher3]
+        with patch('app.auth.authorization._load_role') as load_role:
+            permissions = get_permissions(11, publishers, 'Publisher::Delete')
+            self.assertEqual(load_role.call_count, 0)
+        self.assertTrue(permissions[self.publisher])
+        self.assertFalse(permissions[self.publisher1])
+        self.assertFalse(permissions[self.publisher3])
+
+    def test_get_permissions_for_many_packages(self):
+        packages = Package.query.filter_by(name='test_package').all()
+        permissions = get_permissions(11, packages, 'Package::Update')
+        allowed = sorted(package.publisher.name for package in packages
+                         if permissions[package])
+        self.assertEqual(allowed, sorted([self.publisher.name, self.publisher1.name]))
+        permissions = get_permissions(12, packages, 'Package::Purge')
+        self.assertTrue(all(permissions.values()))
+        permissions = get_permissions(None, packages, 'Package::Read')
+        self.assertEqual(3, len(filter(None, permissions.values())))
+
+    def test_actions_are_precompiled_frozensets(self):
+        actions = authorization.get_user_actions(11, self.publisher)
+        self.assertIsInstance(actions, frozenset)
+        self.assertIs(actions, authorization.get_user_actions(11, self.publisher))
+
     def tearDown(self):
         with self.app.app_context():
             db.session.remove()
@@ -4,13 +4,23 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import base64
 import boto3
+import datetime
+import json
 import unittest
 
+from io import BytesIO
+from mock import MagicMock, patch
 from urlparse import urlparse
 from moto import mock_s3
 from app import create_app
-from app.bitstore import BitStore
+from botocore.auth import S3SigV4PostAuth
+from botocore.credentials import Credentials
+from botocore.exceptions import ClientError
+from app.bitstore import BitStore, BitStoreError, ObjectTooLargeError
+from app.bitstore import LocalStore, S3Client, md5_to_hex, read_limited
+from app.bitstore.s3 import PostSigner
 
 
 class BitStoreTestCase(unittest.TestCase):
@@ -108,6 +118,30 @@ class BitStoreTestCase(unittest.TestCase):
                           Body=metadata.body)
             self.assertEqual(0, len(metadata.get_all_metadata_name_for_publisher()))
 
+    @mock_s3
+    def test_iter_keys_follows_continuation_tokens(self):
+        with self.app.app_context():
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            bit_store = BitStore('test_pub', 'test_package')
+            keys = [bit_store.build_s3_key('data/%d.csv' % i) for i in range(5)]
+            for key in keys:
+                s3.put_object(Bucket=bucket_name, Key=key, Body='data')
+            s3.put_object(Bucket=bucket_name, Key='test/key.json', Body='')
+
+            listed = list(BitStore.iter_keys(bit_store.build_s3_key(''),
+                                             page_size=2))
+            self.assertEqual(sorted(keys), sorted(listed))
+
+    @mock_s3
+    def test_iter_keys_returns_nothing_for_empty_prefix(self):
+        with self.app.app_context():
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            self.assertEqual([], list(BitStore.iter_keys('metadata/unknown')))
+
     @mock_s3
     def test_generate_pre_signed_put_obj_url(self):
         with self.app.app_context():
@@ -126,6 +160,28 @@ class BitStoreTestCase(unittest.TestCase):
             self.assertEqual('public-read', post['fields']['acl'])
             self.assertEqual('text/plain', post['fields']['Content-Type'])
 
+    @mock_s3
+    def test_generate_pre_signed_posts_in_batch(self):
+        with self.app.app_context():
+            bit_store = BitStore(publisher="pub_test",
+                                 package="test_package")
+            posts = bit_store.generate_pre_signed_posts([
+                dict(md5='jXd/OF09/siBXSD3SWAm3A==', path='data.csv'),
+                dict(md5='123', path='README.md', acl='private')])
+            single = bit_store.generate_pre_signed_post_object(123, 'README.md')
+
+        self.assertEqual(2, len(posts))
+        self.assertEqual(single['url'], posts[0]['url'])
+        self.assertEqual(bit_store.build_s3_key('data.csv'),
+                         posts[0]['fields']['key'])
+        self.assertEqual('private', posts[1]['fields']['acl'])
+        self.assertEqual(sorted(single['fields']), sorted(posts[1]['fields']))
+        policy = json.loads(base64.b64decode(posts[1]['fields']['policy']))
+        self.assertIn({'key': bit_store.build_s3_key('README.md')},
+                      policy['conditions'])
+        self.assertIn({'x-amz-date': posts[1]['fields']['x-amz-date']},
+                      policy['conditions'])
+
     @mock_s3
     def test_get_readme_object_key(self):
         with self.app.app_context():
@@ -197,6 +253,82 @@ class BitStoreTestCase(unittest.TestCase):
             read_control = filter(lambda grant: grant['Permission'] == 'READ', res['Grants'])
             self.assertEqual(len(read_control), 0)
 
+    @mock_s3
+    def test_change_acl_of_many_objects(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            keys = [bit_store.build_s3_key('data/%d.csv' % i) for i in range(20)]
+            for key in keys:
+                s3.put_object(Bucket=bucket_name, Key=key, Body='data',
+                              ACL='public-read')
+
+            self.assertTrue(bit_store.change_acl('private'))
+            for key in keys:
+                grants = s3.get_object_acl(Bucket=bucket_name, Key=key)['Grants']
+                self.assertEqual(['FULL_CONTROL'],
+                                 [grant['Permission'] for grant in grants])
+
+    def test_map_keys_retries_failed_calls(self):
+        self.app.config['BITSTORE_RETRY_BACKOFF'] = 0
+        calls = []
+
+        def flaky(key):
+            calls.append(key)
+            if calls.count(key) < 3:
+                raise ClientError({'Error': {'Code': 'SlowDown'}},
+                                  'PutObjectAcl')
+
+        with self.app.app_context():
+            BitStore.map_keys(flaky, ['a', 'b'])
+        self.assertEqual(3, calls.count('a'))
+        self.assertEqual(3, calls.count('b'))
+
+    def test_map_keys_aggregates_errors(self):
+        self.app.config['BITSTORE_RETRY_BACKOFF'] = 0
+        calls = []
+
+        def denied(key):
+            calls.append(key)
+            if key != 'ok':
+                raise ClientError({'Error': {'Code': 'AccessDenied'},
+                                   'ResponseMetadata': {'HTTPStatusCode': 403}},
+                                  'PutObjectAcl')
+
+        with self.app.app_context():
+            with self.assertRaises(BitStoreError) as cm:
+                BitStore.map_keys(denied, ['ok', 'a', 'b'], 'change acl of')
+        self.assertEqual(['a', 'b'],
+                         sorted(key for key, e in cm.exception.errors))
+        self.assertIn('2 of 3', cm.exception.message)
+        # access errors are not retried
+        self.assertEqual(3, len(calls))
+
+    def test_map_keys_reads_keys_lazily(self):
+        self.app.config['BITSTORE_MAX_WORKERS'] = 2
+        read, done = [], []
+
+        def keys():
+            for i in range(20):
+                # at most two keys per worker are read ahead
+                self.assertLessEqual(len(read) - len(done), 4)
+                read.append(i)
+                yield i
+
+        with self.app.app_context():
+            BitStore.map_keys(done.append, keys())
+        self.assertEqual(list(range(20)), sorted(done))
+
+    def test_map_keys_logs_client_stats(self):
+        self.app.config['S3'] = LocalStore(self.app.config)
+        with self.app.app_context():
+            with patch.object(self.app.logger, 'info') as info:
+                BitStore.map_keys(lambda key: None, ['a', 'b'], 'copy')
+        info.assert_called_once_with(
+            '%s %d objects, %d failed, client stats %s', 'copy', 2, 0, {})
+
     @mock_s3
     def test_delete_data_package(self):
         with self.app.app_context():
@@ -218,6 +350,38 @@ class BitStoreTestCase(unittest.TestCase):
             self.assertTrue('Contents' not in data_res)
             self.assertTrue(status)
 
+    @mock_s3
+    def test_delete_data_package_in_batches(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            bit_store.delete_batch_size = 3
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            for i in range(10):
+                s3.put_object(Bucket=bucket_name,
+                              Key=bit_store.build_s3_key('data/%d.csv' % i),
+                              Body='data')
+            s3.put_object(Bucket=bucket_name, Key='test/key.json', Body='')
+
+            self.assertTrue(bit_store.delete_data_package())
+            self.assertEqual(
+                [], list(BitStore.iter_keys(bit_store.build_s3_base_prefix())))
+            self.assertEqual(['test/key.json'], list(BitStore.iter_keys('test')))
+
+    def test_delete_data_package_reports_failed_keys(self):
+        s3_client = MagicMock()
+        s3_client.list_objects_v2.return_value = {
+            'Contents': [{'Key': 'a'}, {'Key': 'b'}]}
+        s3_client.delete_objects.return_value = {
+            'Errors': [{'Key': 'b', 'Code': 'AccessDenied',
+                        'Message': 'Access Denied'}]}
+        self.app.config['S3'] = s3_client
+        with self.app.app_context():
+            with self.assertRaises(BitStoreError) as cm:
+                BitStore('test_pub', 'test_package').delete_data_package()
+        self.assertEqual([('b', 'Access Denied')], cm.exception.errors)
+
     @mock_s3
     def test_should_return_true_delete_data_package_if_data_not_exists(self):
         with self.app.app_context():
@@ -269,3 +433,312 @@ class BitStoreTestCase(unittest.TestCase):
                                           .build_s3_versioned_prefix())
             self.assertEqual(len(objects_nu['Contents']),
                              len(objects_old['Contents']))
+
+    @mock_s3
+    def test_copy_to_new_version_reports_progress(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            keys = [bit_store.build_s3_key('data/%d.csv' % i) for i in range(5)]
+            for key in keys:
+                s3.put_object(Bucket=bucket_name, Key=key, Body='data')
+
+            reported = []
+            bit_store.copy_to_new_version(
+                '1.0', progress=lambda *args: reported.append(args))
+            self.assertEqual(sorted(keys), sorted(r[0] for r in reported))
+            self.assertEqual([1, 2, 3, 4, 5], sorted(r[1] for r in reported))
+            self.assertEqual(set([5]), set(r[2] for r in reported))
+
+    @mock_s3
+    def test_copy_to_new_version_uses_multipart_copy_for_big_objects(self):
+        self.app.config['BITSTORE_MULTIPART_COPY_THRESHOLD'] = 1024
+        self.app.config['BITSTORE_COPY_PART_SIZE'] = 5 * 1024 ** 2
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            body = b'x' * (5 * 1024 ** 2) + b'y' * 10
+            s3.put_object(Bucket=bucket_name,
+                          Key=bit_store.build_s3_key('data.csv'), Body=body,
+                          ACL='public-read', ContentType='text/plain')
+            s3.put_object(Bucket=bucket_name,
+                          Key=bit_store.build_s3_key('datapackage.json'),
+                          Body='{}', ACL='public-read',
+                          ContentType='text/plain')
+
+            store = self.app.config['S3']
+            with patch.object(store, 'create_multipart_upload',
+                              wraps=store.create_multipart_upload) as create:
+                bit_store.copy_to_new_version('1.0')
+
+            copied = BitStore('test_pub', 'test_package', '1.0')
+            response = s3.get_object(Bucket=bucket_name,
+                                     Key=copied.build_s3_key('data.csv'))
+            self.assertEqual(body, response['Body'].read())
+            # moto ignores the ACL of multipart uploads
+            create.assert_called_once_with(
+                Bucket=bucket_name, Key=copied.build_s3_key('data.csv'),
+                ACL='public-read', ContentType='text/plain')
+            for name in ('data.csv', 'datapackage.json'):
+                self.assertEqual('text/plain', s3.head_object(
+                    Bucket=bucket_name,
+                    Key=copied.build_s3_key(name))['ContentType'])
+            self.assertEqual('public-read', copied.get_acl(
+                copied.build_s3_key('datapackage.json')))
+
+    @mock_s3
+    def test_save_and_get_manifest(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            self.assertIsNone(bit_store.get_manifest())
+            read_me_key = bit_store.build_s3_key('README.md')
+            data_key = bit_store.build_s3_key('data.csv')
+            s3.put_object(Bucket=bucket_name, Key=read_me_key, Body='readme')
+            s3.put_object(Bucket=bucket_name, Key=data_key, Body='data')
+
+            bit_store.save_manifest()
+            manifest = bit_store.get_manifest()
+            self.assertEqual('latest', manifest['version'])
+            self.assertEqual(read_me_key, manifest['readme'])
+            files = dict((f['key'], f) for f in manifest['files'])
+            self.assertEqual(sorted([read_me_key, data_key]), sorted(files))
+            self.assertEqual(4, files[data_key]['size'])
+            self.assertEqual('8d777f385d3dfec8815d20f7496026dc',
+                             files[data_key]['md5'])
+
+    @mock_s3
+    def test_multipart_upload_and_manifest_md5(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            key = bit_store.build_s3_key('data.csv')
+
+            upload_id = bit_store.create_multipart_upload(key)
+            urls = bit_store.generate_upload_part_urls(key, upload_id, [1, 2])
+            self.assertEqual([1, 2], [url['part_number'] for url in urls])
+            self.assertIn('partNumber=2&uploadId=', urls[1]['url'])
+            parts = []
+            for number, body in ((1, b'x' * 5 * 1024 ** 2), (2, b'y')):
+                response = s3.upload_part(Bucket=bucket_name, Key=key,
+                                          UploadId=upload_id,
+                                          PartNumber=number, Body=body)
+                parts.append(dict(part_number=number, etag=response['ETag']))
+            bit_store.complete_multipart_upload(key, upload_id,
+                                                list(reversed(parts)))
+
+            bit_store.save_upload([dict(key=key, md5='declared')])
+            manifest = bit_store.build_manifest()
+            self.assertEqual([dict(key=key, size=5 * 1024 ** 2 + 1,
+                                   md5='declared')], manifest['files'])
+
+    @mock_s3
+    def test_get_readme_object_key_reads_manifest(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            bit_store.save_manifest(dict(version='latest', files=[],
+                                         readme='metadata/readme.md'))
+            self.assertEqual('metadata/readme.md',
+                             bit_store.get_readme_object_key())
+
+    @mock_s3
+    def test_change_acl_of_versions_only_changes_manifest_objects(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            data_key = bit_store.build_s3_key('data.csv')
+            s3.put_object(Bucket=bucket_name, Key=data_key, Body='data',
+                          ACL='public-read')
+            bit_store.save_manifest()
+            other_key = bit_store.build_s3_key('unlisted.csv')
+            s3.put_object(Bucket=bucket_name, Key=other_key, Body='data',
+                          ACL='public-read')
+
+            bit_store.change_acl('private', versions=['latest'])
+
+            def permissions(key):
+                grants = s3.get_object_acl(Bucket=bucket_name, Key=key)['Grants']
+                return sorted(grant['Permission'] for grant in grants)
+            self.assertEqual(['FULL_CONTROL'], permissions(data_key))
+            self.assertEqual(['FULL_CONTROL'], permissions(
+                bit_store.build_s3_key(bit_store.manifest_name)))
+            self.assertEqual(['FULL_CONTROL', 'READ'], permissions(other_key))
+
+    @mock_s3
+    def test_change_acl_lists_versions_without_manifest(self):
+        with self.app.app_context():
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            keys = {}
+            for version in ('1.0', '1.0.1', '2.0'):
+                bit_store = BitStore('test_pub', 'test_package', version)
+                keys[version] = bit_store.build_s3_key('data.csv')
+                s3.put_object(Bucket=bucket_name, Key=keys[version],
+                              Body='data', ACL='public-read')
+            # a manifest left unreadable by a failed write
+            s3.put_object(Bucket=bucket_name,
+                          Key=bit_store.build_s3_key(bit_store.manifest_name),
+                          Body='{"files": [', ACL='public-read')
+
+            BitStore('test_pub', 'test_package').change_acl(
+                'private', versions=['1.0', '2.0'])
+
+            def permissions(key):
+                grants = s3.get_object_acl(Bucket=bucket_name, Key=key)['Grants']
+                return sorted(grant['Permission'] for grant in grants)
+            self.assertEqual(['FULL_CONTROL'], permissions(keys['1.0']))
+            self.assertEqual(['FULL_CONTROL'], permissions(keys['2.0']))
+            self.assertEqual(['FULL_CONTROL'], permissions(
+                bit_store.build_s3_key(bit_store.manifest_name)))
+            self.assertEqual(['FULL_CONTROL', 'READ'], permissions(keys['1.0.1']))
+
+    @mock_s3
+    def test_copy_to_new_version_writes_manifest_of_new_version(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            s3.put_object(Bucket=bucket_name,
+                          Key=bit_store.build_s3_key('README.md'), Body='readme')
+            bit_store.save_manifest()
+
+            bit_store.copy_to_new_version('1.0')
+
+            tagged = BitStore('test_pub', 'test_package', '1.0')
+            manifest = tagged.get_manifest()
+            self.assertEqual('1.0', manifest['version'])
+            self.assertEqual(tagged.build_s3_key('README.md'), manifest['readme'])
+            self.assertEqual([tagged.build_s3_key('README.md')],
+                             [f['key'] for f in manifest['files']])
+            self.assertEqual('readme', tagged.get_s3_object(manifest['readme']))
+
+    def test_md5_to_hex(self):
+        self.assertEqual('8d777f385d3dfec8815d20f7496026dc',
+                         md5_to_hex('jXd/OF09/siBXSD3SWAm3A=='))
+        self.assertEqual('8d777f385d3dfec8815d20f7496026dc',
+                         md5_to_hex('"8D777F385D3DFEC8815D20F7496026DC"'))
+        self.assertIsNone(md5_to_hex('12345y65uyhgfed23243y6'))
+        self.assertIsNone(md5_to_hex(None))
+
+    def test_content_hash_only_depends_on_relative_paths_and_md5s(self):
+        def manifest(bit_store, md5):
+            return dict(files=[dict(key=bit_store.build_s3_key('data.csv'),
+                                    md5=md5, size=4)])
+        with self.app.app_context():
+            latest = BitStore('test_pub', 'test_package')
+            tagged = BitStore('test_pub', 'test_package', '1.0')
+            self.assertEqual(latest.get_content_hash(manifest(latest, 'a')),
+                             tagged.get_content_hash(manifest(tagged, 'a')))
+            self.assertNotEqual(latest.get_content_hash(manifest(latest, 'a')),
+                                latest.get_content_hash(manifest(latest, 'b')))
+
+    @mock_s3
+    def test_get_s3_object_rejects_objects_over_max_size(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            s3 = boto3.client('s3')
+            bucket_name = self.app.config['S3_BUCKET_NAME']
+            s3.create_bucket(Bucket=bucket_name)
+            key = bit_store.build_s3_key('README.md')
+            s3.put_object(Bucket=bucket_name, Key=key, Body='x' * 100)
+
+            self.assertEqual('x' * 100, bit_store.get_s3_object(key, max_size=100))
+            with self.assertRaises(ObjectTooLargeError) as cm:
+                bit_store.get_s3_object(key, max_size=99)
+            self.assertEqual(key, cm.exception.key)
+
+    def test_read_limited_stops_reading_past_max_size(self):
+        body = MagicMock(wraps=BytesIO(b'x' * 1000))
+        with self.assertRaises(ObjectTooLargeError):
+            read_limited({'Body': body}, 'key', 100, chunk_size=64)
+        self.assertEqual(2, body.read.call_count)
+        self.assertTrue(body.close.called)
+        self.assertEqual(b'x' * 1000, read_limited(
+            {'Body': BytesIO(b'x' * 1000)}, 'key', 1000, chunk_size=64))
+
+
+class S3ClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+
+    def test_optional_options_are_only_passed_when_set(self):
+        client = S3Client(self.app.config)
+        self.assertEqual(32, client.options['max_pool_connections'])
+        self.assertNotIn('retries', client.options)
+        self.assertNotIn('tcp_keepalive', client.options)
+
+        self.app.config['S3_RETRY_MODE'] = 'adaptive'
+        self.app.config['S3_TCP_KEEPALIVE'] = True
+        client = S3Client(self.app.config)
+        self.assertEqual({'mode': 'adaptive'}, client.options['retries'])
+        self.assertTrue(client.options['tcp_keepalive'])
+
+    def test_post_signer_matches_botocore(self):
+        credentials = Credentials('access', 'secret', 'token')
+        now = datetime.datetime(2017, 1, 1, 12, 0, 0)
+        signer = PostSigner(credentials, 'eu-west-1', now=now)
+        post = signer.sign('https://bucket.s3.amazonaws.com/', 'bucket',
+                           Key='key', Fields={'acl': 'public-read'},
+                           Conditions=[{'acl': 'public-read'}])
+
+        fields = post['fields']
+        self.assertEqual('access/20170101/eu-west-1/s3/aws4_request',
+                         fields['x-amz-credential'])
+        self.assertEqual('20170101T120000Z', fields['x-amz-date'])
+        self.assertEqual('token', fields['x-amz-security-token'])
+        policy = json.loads(base64.b64decode(fields['policy']))
+        self.assertEqual('2017-01-01T13:00:00Z', policy['expiration'])
+
+        request = MagicMock(context={'timestamp': fields['x-amz-date']})
+        auth = S3SigV4PostAuth(credentials, 's3', 'eu-west-1')
+        self.assertEqual(auth.signature(fields['policy'], request),
+                         fields['x-amz-signature'])
+
+    @patch('app.bitstore.s3.os.getpid')
+    def test_client_is_created_once_per_process(self, getpid):
+        client = S3Client(self.app.config)
+        getpid.return_value = 100
+        first = client.client
+        self.assertIs(first, client.client)
+        getpid.return_value = 101
+        self.assertIsNot(first, client.client)
+
+    @mock_s3
+    def test_stats_count_calls_in_flight(self):
+        self.app.config['S3_MAX_POOL_CONNECTIONS'] = 1
+        client = S3Client(self.app.config)
+        bucket_name = self.app.config['S3_BUCKET_NAME']
+        client.create_bucket(Bucket=bucket_name)
+        in_flight = []
+
+        def nested_call(**kwargs):
+            in_flight.append(client.stats()['in_flight'])
+            client.list_objects_v2(Bucket=bucket_name)
+        client.client.meta.events.register('before-call.s3.PutObject',
+                                           nested_call)
+        client.put_object(Bucket=bucket_name, Key='key', Body='')
+        client.generate_presigned_url('get_object',
+                                      Params=dict(Bucket=bucket_name, Key='key'))
+
+        stats = client.stats()
+        self.assertEqual([1], in_flight)
+        self.assertEqual(3, stats['calls'])
+        self.assertEqual(0, stats['in_flight'])
+        self.assertEqual(2, stats['peak_in_flight'])
+        self.assertEqual(1, stats['saturated_calls'])
+        self.assertEqual(1, stats['max_pool_connections'])
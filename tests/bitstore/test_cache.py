@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+
+from botocore.exceptions import ClientError
+from mock import MagicMock, patch
+
+from app import create_app
+from app.bitstore import BitStore, LocalStore, ObjectCache, ObjectTooLargeError
+
+
+class ObjectCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.root = tempfile.mkdtemp()
+        self.app.config['BITSTORE_LOCAL_ROOT'] = self.root
+        self.app.config['S3'] = LocalStore(self.app.config)
+        self.store = self.app.config['S3']
+        self.cache = ObjectCache(maxsize=2, max_object_size=10)
+        self.app.config['OBJECT_CACHE'] = self.cache
+
+    def test_revalidates_cached_object_with_etag(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package', body='{}')
+            bit_store.save_metadata()
+            key = bit_store.build_s3_key('datapackage.json')
+            self.assertEqual(b'{}', bit_store.get_metadata_body())
+            self.assertEqual('"99914b932bd37a50b983c5e7c90ae93b"',
+                             self.cache.get(key)['etag'])
+
+            with patch.object(self.store, 'get_object',
+                              wraps=self.store.get_object) as get_object:
+                self.assertEqual(b'{}', bit_store.get_metadata_body())
+                get_object.assert_called_once_with(
+                    Bucket=self.app.config['S3_BUCKET_NAME'], Key=key,
+                    IfNoneMatch='"99914b932bd37a50b983c5e7c90ae93b"')
+
+            self.store.put_object(Bucket='test', Key=key, Body='{"a": 1}')
+            self.assertEqual(b'{"a": 1}', bit_store.get_metadata_body())
+
+    def test_fresh_entries_are_served_without_request(self):
+        self.cache.ttl = 60
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package', body='{}')
+            bit_store.save_metadata()
+            bit_store.get_metadata_body()
+            with patch.object(self.store, 'get_object') as get_object:
+                self.assertEqual(b'{}', bit_store.get_metadata_body())
+                self.assertFalse(get_object.called)
+
+            bit_store.body = '{"a": 1}'
+            bit_store.save_metadata()
+            self.assertEqual(b'{"a": 1}', bit_store.get_metadata_body())
+
+    def test_large_and_missing_objects_are_not_cached(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            key = bit_store.build_s3_key('README.md')
+            self.store.put_object(Bucket='test', Key=key, Body='x' * 11)
+            self.assertEqual(b'x' * 11, bit_store.get_s3_object(key))
+            self.assertIsNone(self.cache.get(key))
+
+            self.store.put_object(Bucket='test', Key=key, Body='x' * 5)
+            bit_store.get_s3_object(key)
+            with self.assertRaises(ObjectTooLargeError):
+                bit_store.get_s3_object(key, max_size=4)
+
+            self.store.delete_objects(Bucket='test',
+                                      Delete={'Objects': [{'Key': key}]})
+            self.assertIsNone(bit_store.get_s3_object(key))
+            self.assertIsNone(self.cache.get(key))
+
+    def test_not_modified_error_of_s3(self):
+        s3 = MagicMock()
+        s3.get_object.return_value = {'Body': BytesIO(b'{}'),
+                                      'ContentLength': 2, 'ETag': '"etag"'}
+        self.app.config['S3'] = s3
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            self.assertEqual(b'{}', bit_store.get_metadata_body())
+            s3.get_object.side_effect = ClientError(
+                {'Error': {'Code': '304', 'Message': 'Not Modified'}},
+                'GetObject')
+            self.assertEqual(b'{}', bit_store.get_metadata_body())
+
+    def test_disk_tier_is_shared(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.cache.directory = directory
+            self.cache.set('key', '"etag"', b'body')
+            other = ObjectCache(directory=directory)
+            entry = other.get('key')
+            self.assertEqual('"etag"', entry['etag'])
+            self.assertEqual(b'body', entry['body'])
+            self.assertFalse(other.is_fresh(entry))
+
+            self.cache.delete('key')
+            self.assertIsNone(ObjectCache(directory=directory).get('key'))
+        finally:
+            shutil.rmtree(directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+
+from botocore.exceptions import ClientError
+
+from app import create_app
+from app.bitstore import BitStore, LocalStore
+
+
+class LocalStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.root = tempfile.mkdtemp()
+        self.app.config['BITSTORE_LOCAL_ROOT'] = self.root
+        self.app.config['S3'] = LocalStore(self.app.config)
+        self.store = self.app.config['S3']
+        self.client = self.app.test_client()
+
+    def test_save_and_get_metadata(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package',
+                                 body=json.dumps(dict(name='test')))
+            bit_store.save_metadata()
+            self.assertEqual({'name': 'test'},
+                             json.loads(bit_store.get_metadata_body()))
+            self.assertIsNone(bit_store.get_s3_object('metadata/unknown'))
+
+    def test_iter_keys_pages_through_prefix(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            keys = [bit_store.build_s3_key('data/%d.csv' % i) for i in range(5)]
+            for key in keys:
+                self.store.put_object(Bucket='test', Key=key, Body='data')
+            self.store.put_object(Bucket='test', Key='test/key.json', Body='')
+
+            self.assertEqual(keys, list(BitStore.iter_keys(
+                bit_store.build_s3_key(''), page_size=2)))
+            self.assertEqual(
+                '8d777f385d3dfec8815d20f7496026dc',
+                next(BitStore.iter_objects(keys[0]))['ETag'].strip('"'))
+
+    def test_change_acl_delete_and_copy(self):
+        self.app.config['BITSTORE_MULTIPART_COPY_THRESHOLD'] = 3
+        self.app.config['BITSTORE_COPY_PART_SIZE'] = 2
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            key = bit_store.build_s3_key('data.csv')
+            self.store.put_object(Bucket='test', Key=key, Body='data',
+                                  ACL='public-read')
+            bit_store.change_acl('private')
+            self.assertEqual('private', self.store.get_meta(key)['acl'])
+
+            bit_store.copy_to_new_version('1.0')
+            tagged = BitStore('test_pub', 'test_package', '1.0')
+            self.assertEqual('data',
+                             tagged.get_s3_object(tagged.build_s3_key('data.csv')))
+
+            self.assertTrue(bit_store.delete_data_package())
+            self.assertEqual([], list(BitStore.iter_keys('metadata')))
+
+    def test_upload_through_presigned_post(self):
+        with self.app.test_request_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            post = bit_store.generate_pre_signed_post_object(
+                md5='jXd/OF09/siBXSD3SWAm3A==', path='data.csv')
+        self.assertTrue(post['url'].endswith('/api/datastore/upload'))
+
+        fields = dict(post['fields'], file=(BytesIO(b'data'), 'data.csv'))
+        response = self.client.post('/api/datastore/upload', data=fields)
+        self.assertEqual(204, response.status_code)
+
+        key = post['fields']['key']
+        response = self.client.get('/api/datastore/objects/' + key)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'data', response.data)
+
+        self.store.put_object_acl(Bucket='test', Key=key, ACL='private')
+        response = self.client.get('/api/datastore/objects/' + key)
+        self.assertEqual(404, response.status_code)
+
+    def test_upload_rejects_bad_signature_and_md5(self):
+        with self.app.test_request_context():
+            post = BitStore('test_pub', 'test_package')\
+                .generate_pre_signed_post_object(
+                    md5='jXd/OF09/siBXSD3SWAm3A==', path='data.csv')
+
+        fields = dict(post['fields'], key='metadata/other/key.csv',
+                      file=(BytesIO(b'data'), 'data.csv'))
+        response = self.client.post('/api/datastore/upload', data=fields)
+        self.assertEqual(403, response.status_code)
+
+        fields = dict(post['fields'], file=(BytesIO(b'other'), 'data.csv'))
+        response = self.client.post('/api/datastore/upload', data=fields)
+        self.assertEqual(400, response.status_code)
+        with self.app.app_context():
+            self.assertEqual([], list(BitStore.iter_keys('metadata')))
+
+    def test_multipart_upload_through_part_urls(self):
+        with self.app.test_request_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            key = bit_store.build_s3_key('data.csv')
+            upload_id = bit_store.create_multipart_upload(key)
+            urls = bit_store.generate_upload_part_urls(key, upload_id, [1, 2])
+
+        etags = []
+        for url, body in zip(urls, (b'da', b'ta')):
+            response = self.client.put(url['url'], data=body)
+            self.assertEqual(200, response.status_code)
+            etags.append(response.headers['ETag'])
+        response = self.client.put(urls[0]['url'].replace('partNumber=1',
+                                                           'partNumber=3'),
+                                   data=b'')
+        self.assertEqual(403, response.status_code)
+
+        with self.app.app_context():
+            self.assertEqual([1, 2], [part['part_number'] for part in
+                                      bit_store.get_uploaded_parts(key, upload_id)])
+            bit_store.complete_multipart_upload(
+                key, upload_id, [dict(part_number=2, etag=etags[1]),
+                                 dict(part_number=1, etag=etags[0])])
+            self.assertEqual(b'data', bit_store.get_s3_object(key))
+            self.assertEqual('public-read', self.store.get_meta(key)['acl'])
+
+    def test_multipart_upload_is_completed_under_its_key(self):
+        with self.app.app_context():
+            bit_store = BitStore('test_pub', 'test_package')
+            key = bit_store.build_s3_key('data.csv')
+            other = bit_store.build_s3_key('other.csv')
+            upload_id = bit_store.create_multipart_upload(key)
+            etag = self.store.upload_part(Bucket='test', Key=key,
+                                          UploadId=upload_id, PartNumber=1,
+                                          Body=BytesIO(b'data'))['ETag']
+            with self.assertRaises(ClientError) as cm:
+                bit_store.complete_multipart_upload(
+                    other, upload_id, [dict(part_number=1, etag=etag)])
+            self.assertEqual('NoSuchUpload',
+                             cm.exception.response['Error']['Code'])
+            self.assertIsNone(bit_store.get_s3_object(other))
+
+    def test_keys_cannot_escape_root(self):
+        with self.assertRaises(Exception):
+            self.store.put_object(Bucket='test', Key='../outside', Body='')
+
+    def test_keys_cannot_escape_their_prefix(self):
+        victim = BitStore('victim', 'pkg').build_s3_key('datapackage.json')
+        self.store.put_object(Bucket='test', Key=victim, Body='{}',
+                              ACL='public-read')
+        key = BitStore('attacker', 'mypkg').build_s3_key(
+            '../../../../victim/pkg/_v/latest/datapackage.json')
+        with self.app.test_request_context():
+            post = self.store.generate_presigned_post(
+                Bucket='test', Key=key, Fields={'acl': 'public-read'},
+                Conditions=[{'acl': 'public-read'}])
+
+        fields = dict(post['fields'], file=(BytesIO(b'{"a": 1}'), 'x.json'))
+        response = self.client.post('/api/datastore/upload', data=fields)
+        self.assertEqual(403, response.status_code)
+        self.assertEqual(b'{}', self.store.get_object(
+            Bucket='test', Key=victim)['Body'].read())
+
+        for key in ('a/./b', 'a//b', '/a/b', 'a\\b', 'a/.meta/b.json',
+                    '.uploads/id/upload.json'):
+            with self.assertRaises(ClientError):
+                self.store.put_object(Bucket='test', Key=key, Body='')
+        response = self.client.get('/api/datastore/objects/' +
+                                   'metadata/x/../victim/pkg/_v/latest/'
+                                   'datapackage.json')
+        self.assertEqual(404, response.status_code)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import unittest
+
+from mock import patch
+
+from app import create_app
+from app.config import BaseConfig
+from app.cache import LRUCache, PageCache, RefreshAheadCache, page_scopes, \
+    publisher_scope, package_scope, GLOBAL_SCOPE
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_returns_default_if_key_not_found(self):
+        cache = LRUCache()
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.get('key', 'default'), 'default')
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expires_entries_after_ttl(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+
+    def test_incr(self):
+        cache = LRUCache()
+        self.assertEqual(cache.incr('a'), 1)
+        self.assertEqual(cache.incr('a'), 2)
+
+
+class PageCacheTestCase(unittest.TestCase):
+
+    def test_key_changes_when_revision_is_bumped(self):
+        page_cache = PageCache()
+        scopes = [publisher_scope('core')]
+        key = page_cache.build_key('/core?', scopes)
+        page_cache.set(key, 'html')
+        self.assertEqual(page_cache.get(key), 'html')
+
+        page_cache.bump(publisher_scope('core'))
+        new_key = page_cache.build_key('/core?', scopes)
+        self.assertNotEqual(key, new_key)
+        self.assertIsNone(page_cache.get(new_key))
+
+    def test_revisions_are_never_evicted(self):
+        page_cache = PageCache(maxsize=1)
+        scopes = [publisher_scope('core')]
+        page_cache.bump(publisher_scope('core'))
+        key = page_cache.build_key('/core?', scopes)
+        for i in range(10):
+            page_cache.bump(publisher_scope('other-%d' % i))
+        self.assertEqual(key, page_cache.build_key('/core?', scopes))
+        self.assertEqual(1, page_cache.revision(publisher_scope('core')))
+
+    def test_disabled_without_store_when_jobs_run_in_workers(self):
+        with patch.object(BaseConfig, 'OUTBOX_INLINE', False):
+            self.assertIsNone(create_app().config['PAGE_CACHE'])
+            with patch.object(BaseConfig, 'PAGE_CACHE_STORE',
+                              'app.cache.LRUCache'):
+                self.assertIsNotNone(create_app().config['PAGE_CACHE'])
+        self.assertIsNotNone(create_app().config['PAGE_CACHE'])
+
+    def test_disabled_without_store_when_several_processes_serve(self):
+        with patch.object(BaseConfig, 'PAGE_CACHE_SINGLE_PROCESS', False):
+            self.assertIsNone(create_app().config['PAGE_CACHE'])
+            with patch.object(BaseConfig, 'PAGE_CACHE_STORE',
+                              'app.cache.LRUCache'):
+                self.assertIsNotNone(create_app().config['PAGE_CACHE'])
+
+    def test_reads_through_shared_store(self):
+        store = LRUCache()
+        page_cache = PageCache(store=store)
+        page_cache.set('page:/?', 'html')
+        other_worker = PageCache(store=store)
+        self.assertEqual(other_worker.get('page:/?'), 'html')
+
+    def test_page_scopes(self):
+        self.assertEqual(page_scopes({}), [GLOBAL_SCOPE])
+        self.assertEqual(page_scopes({'publisher': 'core'}),
+                         [publisher_scope('core')])
+        self.assertEqual(page_scopes({'publisher': 'core', 'package': 'gold'}),
+                         [publisher_scope('core'), package_scope('core', 'gold')])
+
+
+class RefreshAheadCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.calls = []
+
+    def loader(self):
+        self.calls.append(1)
+        return len(self.calls)
+
+    def test_loads_value_once_within_ttl(self):
+        cache = RefreshAheadCache(ttl=60)
+        self.assertEqual(cache.get('key', self.loader), 1)
+        self.assertEqual(cache.get('key', self.loader), 1)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_serves_stale_value_while_refreshing(self):
+        cache = RefreshAheadCache(ttl=0)
+        with self.app.app_context():
+            self.assertEqual(cache.get('key', self.loader), 1)
+            self.assertEqual(cache.get('key', self.loader), 1)
+        for _ in range(100):
+            if len(self.calls) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.calls), 2)
@@ -7,6 +7,8 @@ from __future__ import unicode_literals
 import unittest
 import json
 
+from sqlalchemy import event
+
 from app import create_app
 from app.bitstore import BitStore
 from app.database import db
@@ -325,6 +327,81 @@ class PackageTestCase(unittest.TestCase):
         self.assertEqual(metadata['id'], 1)
 
 
+    def test_get_many_keeps_order_and_missing_packages(self):
+        packages = logic.Package.get_many([
+            (self.publisher, 'unknown'),
+            (self.publisher, self.package),
+            (self.publisher_one, self.package)])
+        self.assertEqual(3, len(packages))
+        self.assertIsNone(packages[0])
+        self.assertEqual(packages[1]['publisher'], self.publisher)
+        self.assertEqual(packages[1]['name'], self.package)
+        self.assertEqual(packages[1]['readme'], '<p>README</p>')
+        self.assertIsNone(packages[2])
+
+    def test_get_many_returns_empty_list_for_no_names(self):
+        self.assertEqual([], logic.Package.get_many([]))
+
+    def test_get_versions_returns_latest_and_tags(self):
+        logic.Package.create_or_update_tag(self.publisher, self.package, '1.0')
+        self.assertEqual(['1.0', 'latest'],
+                         logic.Package.get_versions(self.publisher, self.package))
+        self.assertEqual(['latest'],
+                         logic.Package.get_versions(self.publisher, 'unknown'))
+
+    def test_publish_context_loads_everything_in_one_query(self):
+        user_id = User.query.filter_by(name=self.publisher_one).one().id
+        db.session.expire_all()
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            for package in (self.package_one, 'new-package'):
+                context = logic.PublishContext.load(
+                    user_id, self.publisher_one, package)
+                context.check_authorized()
+                self.assertTrue(context.is_authorized())
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+        # one query per load, the publisher, package, role and user are
+        # joined instead of being looked up one by one
+        self.assertEqual(2, len(statements))
+        for statement in statements:
+            self.assertIn('FROM publisher', statement)
+            self.assertEqual(3, statement.count('JOIN'))
+            for table in ('package', 'publisher_user', '"user"'):
+                self.assertIn('JOIN %s ' % table, statement)
+        self.assertEqual('Package::Create', context.action)
+        context = logic.PublishContext.load(
+            user_id, self.publisher_one, self.package_one)
+        self.assertEqual('Package::Update', context.action)
+        self.assertEqual(self.package_one, context.package.name)
+
+    def test_publish_context_denies_other_publisher_and_anonymous(self):
+        user_id = User.query.filter_by(name=self.publisher_one).one().id
+        context = logic.PublishContext.load(
+            user_id, self.publisher_two, self.package_one)
+        self.assertFalse(context.is_authorized())
+        context = logic.PublishContext.load(
+            user_id, self.publisher_one, 'new-package')
+        self.assertEqual('Package::Create', context.action)
+        self.assertTrue(context.is_authorized())
+        self.assertFalse(logic.PublishContext.load(
+            None, self.publisher_one, self.package_one).is_authorized())
+
+    def test_publish_context_raises_404_if_publisher_not_found(self):
+        user = User.query.filter_by(name=self.publisher_one).one()
+        user.sysadmin = True
+        db.session.commit()
+        context = logic.PublishContext.load(user.id, 'unknown', 'unknown')
+        with self.assertRaises(InvalidUsage) as cm:
+            context.check_authorized()
+        self.assertEqual(404, cm.exception.status_code)
+
+
     def test_returns_none_if_package_not_found(self):
         package = logic.Package.get(self.publisher, 'unknown')
         self.assertIsNone(package)
@@ -1,12 +1,20 @@
-import unittest
+import base64
+import datetime
+import hashlib
 import json
+import time
+import unittest
 
+import boto3
+from botocore.exceptions import ClientError
 from mock import patch
+from moto import mock_s3
 from app import create_app
 from app.database import db
 from app.package.models import *
 from app.profile.models import *
 import app.logic as logic
+from app.bitstore import BitStore
 from app.utils import InvalidUsage
 
 import pytest
@@ -71,20 +79,23 @@ class PackageTest(unittest.TestCase):
 
     @patch('app.logic.Package.create_or_update')
     @patch('app.bitstore.BitStore.get_metadata_body')
-    @patch('app.bitstore.BitStore.get_readme_object_key')
+    @patch('app.bitstore.BitStore.save_manifest')
     @patch('app.bitstore.BitStore.get_s3_object')
     @patch('app.bitstore.BitStore.change_acl')
     def test_finalize_package_publish_returns_queued_if_fine(
                                     self, change_acl, get_s3_object,
-                                    get_readme_object_key,
+                                    save_manifest,
                                     get_metadata_body, create_or_update):
         get_metadata_body.return_value = json.dumps(dict(name='package'))
         create_or_update.return_value = None
-        get_readme_object_key.return_value = ''
+        save_manifest.return_value = dict(files=[], readme='README.md')
         get_s3_object.return_value = ''
         change_acl.return_value = None
         status = logic.Package.finalize_publish(1, self.datapackage_url)
         self.assertEqual(status, 'queued')
+        change_acl.assert_called_once_with('public-read', versions=['latest'])
+        get_s3_object.assert_called_once_with(
+            'README.md', max_size=self.app.config['BITSTORE_MAX_README_SIZE'])
 
 
     @patch('app.logic.Package.create_or_update')
@@ -105,6 +116,254 @@ class PackageTest(unittest.TestCase):
             logic.Package.finalize_publish(2, self.datapackage_url)
         self.assertEqual(context.exception.status_code, 400)
 
+    @patch('app.bitstore.BitStore.get_metadata_body')
+    @patch('app.bitstore.BitStore.save_manifest')
+    @patch('app.bitstore.BitStore.change_acl')
+    def test_finalize_package_publish_skips_unchanged_package(
+                                    self, change_acl, save_manifest,
+                                    get_metadata_body):
+        manifest = dict(readme=None, files=[dict(
+            key='metadata/demo/demo-package/_v/latest/datapackage.json',
+            md5='8d777f385d3dfec8815d20f7496026dc', size=4)])
+        save_manifest.return_value = manifest
+        package = Package.get_by_publisher(self.publisher, self.package)
+        package.content_hash = BitStore(self.publisher, self.package)\
+            .get_content_hash(manifest)
+        db.session.commit()
+
+        status = logic.Package.finalize_publish(1, self.datapackage_url)
+        self.assertEqual(status, 'queued')
+        self.assertFalse(get_metadata_body.called)
+        self.assertFalse(change_acl.called)
+
+        package = Package.get_by_publisher(self.publisher, self.package)
+        package.status = PackageStateEnum.deleted
+        db.session.commit()
+        get_metadata_body.return_value = json.dumps(dict(name='package'))
+        logic.Package.finalize_publish(1, self.datapackage_url)
+        self.assertTrue(change_acl.called)
+        package = Package.get_by_publisher(self.publisher, self.package)
+        self.assertEqual({'name': 'package'}, package.descriptor)
+
+    @patch('app.logic.Package.finalize_publish')
+    def test_worker_processes_queued_publish_jobs(self, finalize_publish):
+        finalize_publish.side_effect = [None, InvalidUsage('boom', 500)]
+        self.app.config['PUBLISH_JOBS_INLINE'] = False
+        first = logic.PublishJob.enqueue(1, self.datapackage_url)
+        second = logic.PublishJob.enqueue(1, self.datapackage_url)
+        self.assertEqual('QUEUED', logic.PublishJob.get(first, 1)['status'])
+        self.assertFalse(finalize_publish.called)
+
+        self.assertEqual(2, logic.PublishJob.work(once=True))
+        finalize_publish.assert_called_with(1, self.datapackage_url)
+        self.assertEqual('DONE', logic.PublishJob.get(first, 1)['status'])
+        failed = logic.PublishJob.get(second, 1)
+        self.assertEqual('FAILED', failed['status'])
+        self.assertEqual('boom', failed['error'])
+        self.assertIsNone(logic.PublishJob.get(first, 2))
+
+    def test_enqueue_rejects_user_not_allowed_to_publish(self):
+        self.app.config['PUBLISH_JOBS_INLINE'] = False
+        with self.assertRaises(InvalidUsage) as context:
+            logic.PublishJob.enqueue(2, self.datapackage_url)
+        self.assertEqual(context.exception.status_code, 400)
+        self.assertEqual(0, PublishJob.query.count())
+
+    def test_claim_next_skips_jobs_locked_by_another_worker(self):
+        self.app.config['PUBLISH_JOBS_INLINE'] = False
+        job_id = logic.PublishJob.enqueue(1, self.datapackage_url)
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        connection.execute('SELECT id FROM publish_job WHERE id = %s FOR UPDATE',
+                           job_id)
+        try:
+            self.assertIsNone(PublishJob.claim_next(600))
+        finally:
+            transaction.rollback()
+            connection.close()
+
+        job = PublishJob.claim_next(600)
+        self.assertEqual(job_id, job.id)
+        self.assertEqual(PublishJobStatusEnum.running, job.status)
+        self.assertEqual(1, job.attempts)
+        self.assertIsNone(PublishJob.claim_next(600))
+
+    def test_claim_next_picks_up_abandoned_jobs(self):
+        self.app.config['PUBLISH_JOBS_INLINE'] = False
+        job_id = logic.PublishJob.enqueue(1, self.datapackage_url)
+        job = PublishJob.claim_next(600)
+        job.updated_at = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        db.session.commit()
+
+        job = PublishJob.claim_next(600)
+        self.assertEqual(job_id, job.id)
+        self.assertEqual(2, job.attempts)
+
+    @patch('app.logic.Package.finalize_publish')
+    def test_running_jobs_are_kept_alive(self, finalize_publish):
+        self.app.config['PUBLISH_JOBS_INLINE'] = False
+        self.app.config['PUBLISH_JOB_TIMEOUT'] = 0.3
+        job_id = logic.PublishJob.enqueue(1, self.datapackage_url)
+        table = PublishJob.__table__
+        touched = []
+
+        def publish(user_id, datapackage_url):
+            claimed_at = db.engine.execute(
+                db.select([table.c.updated_at]).where(table.c.id == job_id))\
+                .scalar()
+            time.sleep(0.5)
+            touched.append(db.engine.execute(
+                db.select([table.c.updated_at]).where(table.c.id == job_id))
+                .scalar() > claimed_at)
+        finalize_publish.side_effect = publish
+
+        self.assertEqual(1, logic.PublishJob.work(once=True))
+        self.assertEqual([True], touched)
+        self.assertEqual('DONE', logic.PublishJob.get(job_id, 1)['status'])
+
+    def test_claim_next_fails_jobs_abandoned_too_many_times(self):
+        self.app.config['PUBLISH_JOBS_INLINE'] = False
+        job_id = logic.PublishJob.enqueue(1, self.datapackage_url)
+        for attempt in range(2):
+            job = PublishJob.claim_next(600, max_attempts=2)
+            self.assertEqual(job_id, job.id)
+            job.updated_at = datetime.datetime.utcnow() - \
+                datetime.timedelta(hours=1)
+            db.session.commit()
+
+        self.assertIsNone(PublishJob.claim_next(600, max_attempts=2))
+        failed = logic.PublishJob.get(job_id, 1)
+        self.assertEqual('FAILED', failed['status'])
+        self.assertEqual('Abandoned after 2 attempts', failed['error'])
+
+    @patch('app.bitstore.BitStore.change_acl')
+    def test_outbox_worker_applies_committed_entries(self, change_acl):
+        self.app.config['OUTBOX_INLINE'] = False
+        entry = logic.Outbox.add('change_acl', self.publisher, self.package,
+                                 acl='private')
+        logic.Outbox.dispatch(entry)
+        self.assertFalse(change_acl.called)
+        self.assertEqual(OutboxStatusEnum.pending, entry.status)
+
+        self.assertEqual(1, logic.Outbox.work(once=True))
+        change_acl.assert_called_once_with('private', versions=None)
+        entry = OutboxEntry.query.get(entry.id)
+        self.assertEqual(OutboxStatusEnum.done, entry.status)
+
+    @patch('app.bitstore.BitStore.delete_data_package')
+    def test_outbox_entries_being_applied_are_not_claimed_again(self, delete):
+        self.app.config['OUTBOX_INLINE'] = False
+        self.app.config['OUTBOX_TIMEOUT'] = 0.3
+        entry = logic.Outbox.add('delete_package', self.publisher,
+                                 self.package)
+        logic.Outbox.dispatch(entry)
+        claimed = []
+
+        def slow_delete():
+            time.sleep(0.5)
+            # claimed from another session, as another worker would
+            session = db.create_scoped_session()
+            try:
+                claimed.append(session.query(OutboxEntry).filter(
+                    OutboxEntry.status == OutboxStatusEnum.running,
+                    OutboxEntry.updated_at < datetime.datetime.utcnow() -
+                    datetime.timedelta(seconds=0.3)).count())
+            finally:
+                session.remove()
+        delete.side_effect = slow_delete
+
+        self.assertEqual(1, logic.Outbox.work(once=True))
+        self.assertEqual([0], claimed)
+
+    @patch('app.bitstore.BitStore.copy_to_new_version')
+    def test_outbox_copies_versions_with_acl_of_package(self, copy):
+        entry = logic.Outbox.add('copy_version', self.publisher, self.package,
+                                 version='1.0')
+        logic.Outbox.dispatch(entry)
+        self.assertEqual('public-read', copy.call_args[1]['acl'])
+
+        logic.Package.change_status(self.publisher, self.package,
+                                    PackageStateEnum.deleted)
+        entry = logic.Outbox.add('copy_version', self.publisher, self.package,
+                                 version='1.1')
+        logic.Outbox.dispatch(entry)
+        self.assertEqual('private', copy.call_args[1]['acl'])
+
+    @patch('app.bitstore.BitStore.delete_data_package')
+    def test_outbox_retries_failed_entries_with_backoff(self, delete):
+        delete.side_effect = ClientError({'Error': {'Code': '500'}},
+                                         'DeleteObjects')
+        self.app.config['OUTBOX_INLINE'] = False
+        self.app.config['OUTBOX_MAX_ATTEMPTS'] = 2
+        entry = logic.Outbox.add('delete_package', self.publisher,
+                                 self.package)
+        logic.Outbox.dispatch(entry)
+
+        self.assertEqual(1, logic.Outbox.work(once=True))
+        entry = OutboxEntry.query.get(entry.id)
+        self.assertEqual(OutboxStatusEnum.pending, entry.status)
+        self.assertGreater(entry.available_at, datetime.datetime.utcnow())
+        self.assertEqual(0, logic.Outbox.work(once=True))
+
+        entry.available_at = datetime.datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(1, logic.Outbox.work(once=True))
+        entry = OutboxEntry.query.get(entry.id)
+        self.assertEqual(OutboxStatusEnum.failed, entry.status)
+        self.assertEqual(2, entry.attempts)
+        self.assertIsNotNone(entry.error)
+
+    def test_outbox_entries_of_a_package_are_claimed_in_order(self):
+        self.app.config['OUTBOX_INLINE'] = False
+        first = logic.Outbox.add('change_acl', self.publisher, self.package,
+                                 acl='private')
+        second = logic.Outbox.add('delete_package', self.publisher,
+                                  self.package)
+        other = logic.Outbox.add('delete_package', self.publisher, 'other')
+        db.session.commit()
+        first.available_at = datetime.datetime.utcnow() + \
+            datetime.timedelta(hours=1)
+        db.session.commit()
+
+        self.assertEqual(other.id, OutboxEntry.claim_next(600).id)
+        self.assertIsNone(OutboxEntry.claim_next(600))
+        first.available_at = datetime.datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(first.id, OutboxEntry.claim_next(600).id)
+        self.assertIsNone(OutboxEntry.claim_next(600))
+        first.status = OutboxStatusEnum.done
+        db.session.commit()
+        self.assertEqual(second.id, OutboxEntry.claim_next(600).id)
+
+    def test_publish_jobs_and_outbox_entries_are_claimed_in_order(self):
+        self.app.config['OUTBOX_INLINE'] = False
+        self.app.config['PUBLISH_JOBS_INLINE'] = False
+        job_id = logic.PublishJob.enqueue(1, self.datapackage_url)
+        entry = logic.Outbox.add('copy_version', self.publisher, self.package,
+                                 version='1.0')
+        db.session.commit()
+
+        self.assertIsNone(OutboxEntry.claim_next(600))
+        job = PublishJob.claim_next(600)
+        self.assertEqual(job_id, job.id)
+        self.assertIsNone(OutboxEntry.claim_next(600))
+        job.status = PublishJobStatusEnum.done
+        db.session.commit()
+        self.assertEqual(entry.id, OutboxEntry.claim_next(600).id)
+
+        logic.PublishJob.enqueue(1, self.datapackage_url)
+        self.assertIsNone(PublishJob.claim_next(600))
+
+    def test_uploads_wait_for_pending_outbox_entries(self):
+        self.app.config['OUTBOX_INLINE'] = False
+        entry = logic.Outbox.add('delete_package', self.publisher,
+                                 self.package)
+        logic.Outbox.dispatch(entry)
+        data = dict(metadata=dict(owner=self.publisher, name=self.package),
+                    filedata={})
+        with self.assertRaises(InvalidUsage) as context:
+            logic.generate_signed_url(1, data)
+        self.assertEqual(context.exception.status_code, 409)
 
     def tearDown(self):
         with self.app.app_context():
@@ -170,6 +429,165 @@ class TestGetSignedUrl(unittest.TestCase):
         self.assertEqual(upload_query.get('Content-Type'), 'text/plain')
         self.assertEqual(upload_query.get('acl'), 'public-read')
 
+    @patch('app.bitstore.BitStore.get_manifest')
+    def test_generate_signed_url_skips_unchanged_files(self, get_manifest):
+        get_manifest.return_value = dict(readme=None, files=[dict(
+            key='metadata/test_publisher/test_package/_v/latest/data.csv',
+            md5='8d777f385d3dfec8815d20f7496026dc', size=4)])
+        package = Package.get_by_publisher(self.publisher, self.package)
+        package.content_hash = 'hash'
+        db.session.commit()
+        data = {
+            'metadata': {
+                "owner": self.publisher,
+                "name": self.package
+            },
+            "filedata": {
+                "data.csv": {
+                    "name": "data.csv",
+                    "md5": "jXd/OF09/siBXSD3SWAm3A=="
+                },
+                "datapackage.json": {
+                    "name": "datapackage.json",
+                    "md5": "12345y65uyhgfed23243y6"
+                }
+            }
+        }
+        try:
+            file_data = logic.generate_signed_url(1, data)['filedata']
+        finally:
+            package.content_hash = None
+            db.session.commit()
+
+        self.assertTrue(file_data['data.csv']['exists'])
+        self.assertNotIn('upload_url', file_data['data.csv'])
+        self.assertNotIn('exists', file_data['datapackage.json'])
+        self.assertIn('upload_url', file_data['datapackage.json'])
+
+    def test_generate_signed_url_rejects_paths_outside_package(self):
+        for path in ('../../../../other/package/_v/latest/datapackage.json',
+                     'data/../../other/data.csv', './data.csv', '/data.csv',
+                     'data\\data.csv', 'data//data.csv', '.meta/data.csv'):
+            data = {
+                'metadata': {
+                    "owner": self.publisher,
+                    "name": self.package
+                },
+                "filedata": {
+                    path: {"name": "datapackage.json", "md5": ""}
+                }
+            }
+            with self.assertRaises(InvalidUsage) as context:
+                logic.generate_signed_url(1, data)
+            self.assertEqual(400, context.exception.status_code)
+
+    @patch('app.bitstore.BitStore.save_upload')
+    @patch('app.bitstore.BitStore.create_multipart_upload')
+    def test_generate_signed_url_for_multipart_upload(self, create, save_upload):
+        create.return_value = 'upload'
+        data = {
+            'metadata': {
+                "owner": self.publisher,
+                "name": self.package
+            },
+            "filedata": {
+                "data.csv": {
+                    "name": "data.csv",
+                    "md5": "jXd/OF09/siBXSD3SWAm3A==",
+                    "size": 200 * 1024 ** 2
+                }
+            }
+        }
+        file_info = logic.generate_signed_url(1, data)['filedata']['data.csv']
+
+        key = 'metadata/test_publisher/test_package/_v/latest/data.csv'
+        self.assertNotIn('upload_url', file_info)
+        multipart = file_info['multipart']
+        self.assertEqual(key, multipart['key'])
+        self.assertEqual('upload', multipart['upload_id'])
+        self.assertEqual(64 * 1024 ** 2, multipart['part_size'])
+        self.assertEqual([1, 2, 3, 4],
+                         [part['part_number'] for part in multipart['parts']])
+        create.assert_called_once_with(key, acl='public-read')
+        save_upload.assert_called_once_with(
+            [dict(key=key, md5='8d777f385d3dfec8815d20f7496026dc')])
+
+    @patch('app.bitstore.BitStore.get_uploaded_parts')
+    @patch('app.bitstore.BitStore.create_multipart_upload')
+    def test_generate_signed_url_resumes_multipart_upload(self, create,
+                                                          get_uploaded_parts):
+        get_uploaded_parts.return_value = [
+            dict(part_number=2, etag='"etag"', size=64 * 1024 ** 2)]
+        data = {
+            'metadata': {
+                "owner": self.publisher,
+                "name": self.package
+            },
+            "filedata": {
+                "data.csv": {
+                    "name": "data.csv",
+                    "md5": "",
+                    "size": 150 * 1024 ** 2,
+                    "upload_id": "upload"
+                }
+            }
+        }
+        multipart = logic.generate_signed_url(1, data)['filedata']['data.csv']['multipart']
+        self.assertFalse(create.called)
+        self.assertEqual([1, 3],
+                         [part['part_number'] for part in multipart['parts']])
+        self.assertEqual(get_uploaded_parts.return_value,
+                         multipart['uploaded_parts'])
+
+    @patch('app.bitstore.BitStore.complete_multipart_upload')
+    def test_complete_multipart_upload(self, complete):
+        complete.return_value = '"etag-2"'
+        data = {
+            'metadata': {'owner': self.publisher, 'name': self.package},
+            'key': 'metadata/test_publisher/test_package/_v/latest/data.csv',
+            'upload_id': 'upload',
+            'parts': [dict(part_number=1, etag='"etag"')]
+        }
+        self.assertEqual(dict(key=data['key'], etag='"etag-2"'),
+                         logic.complete_multipart_upload(1, data))
+        complete.assert_called_once_with(data['key'], 'upload', data['parts'])
+
+        complete.side_effect = ClientError(
+            {'Error': {'Code': 'InvalidPart', 'Message': 'Invalid part'}},
+            'CompleteMultipartUpload')
+        with pytest.raises(InvalidUsage):
+            logic.complete_multipart_upload(1, data)
+
+        complete.reset_mock()
+        for key in ('metadata/other_publisher/test_package/_v/latest/data.csv',
+                    'metadata/test_publisher/test_package/../../other/'
+                    'package/_v/latest/data.csv',
+                    'metadata/test_publisher/test_package/_v/./data.csv'):
+            data['key'] = key
+            with pytest.raises(InvalidUsage):
+                logic.complete_multipart_upload(1, data)
+        self.assertFalse(complete.called)
+
+    @patch('app.bitstore.BitStore.complete_multipart_upload')
+    def test_complete_multipart_upload_rejects_incomplete_body(self, complete):
+        data = {
+            'metadata': {'owner': self.publisher, 'name': self.package},
+            'key': 'metadata/test_publisher/test_package/_v/latest/data.csv',
+            'upload_id': 'upload',
+            'parts': [dict(part_number=1, etag='"etag"')]
+        }
+        bodies = [[], dict(data, metadata=None), dict(data, key=None),
+                  dict(data, upload_id=['upload']), dict(data, parts=[]),
+                  dict(data, parts={}), dict(data, parts=[dict(etag='"a"')]),
+                  dict(data, parts=[dict(part_number='1', etag='"a"')])]
+        bodies += [dict((k, v) for k, v in data.items() if k != field)
+                   for field in data]
+        for body in bodies:
+            with pytest.raises(InvalidUsage) as e:
+                logic.complete_multipart_upload(1, body)
+            self.assertEqual(400, e.value.status_code)
+        self.assertFalse(complete.called)
+
     def test_generate_signed_url_fails_if_not_an_owner(self):
         data = {
             'metadata': {
@@ -192,6 +610,129 @@ class TestGetSignedUrl(unittest.TestCase):
         db.drop_all()
         db.engine.dispose()
 
+class ContentAddressedPublishTest(unittest.TestCase):
+
+    publisher = 'test_publisher'
+    package = 'test_package'
+    user_id = 1
+    datapackage_url = 'https://bits.datapackaged.com/metadata/' \
+                      'test_publisher/test_package/_v/latest/datapackage.json'
+
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['BITSTORE_CONTENT_ADDRESSED'] = True
+        self.app.app_context().push()
+        db.drop_all()
+        db.create_all()
+        base.make_fixtures(self.app, self.package, self.publisher, self.user_id)
+
+    def authorize(self, descriptor_md5='jXd/OF09/siBXSD3SWAm3A=='):
+        return logic.generate_signed_url(self.user_id, {
+            'metadata': {'owner': self.publisher, 'name': self.package},
+            'filedata': {
+                'datapackage.json': {'name': 'datapackage.json',
+                                     'md5': descriptor_md5},
+                'data/data.csv': {'name': 'data.csv',
+                                  'md5': 'jXd/OF09/siBXSD3SWAm3A=='}
+            }})['filedata']
+
+    def assertResourcesExist(self, bit_store, descriptor):
+        base_url = self.app.config['BITSTORE_URL'] + '/'
+        self.assertTrue(descriptor['resources'])
+        for resource in descriptor['resources']:
+            self.assertTrue(resource['path'].startswith(base_url))
+            self.assertIsNotNone(bit_store.get_s3_object(
+                resource['path'][len(base_url):]))
+
+    @mock_s3
+    def test_publish_and_tag_with_content_addressed_resources(self):
+        s3 = boto3.client('s3')
+        bucket_name = self.app.config['S3_BUCKET_NAME']
+        s3.create_bucket(Bucket=bucket_name)
+        bit_store = BitStore(self.publisher, self.package)
+        blob_key = bit_store.build_s3_blob_key('8d777f385d3dfec8815d20f7496026dc')
+
+        file_data = self.authorize()
+        self.assertEqual(blob_key,
+                         file_data['data/data.csv']['upload_query']['key'])
+        self.assertEqual(bit_store.build_s3_key('datapackage.json'),
+                         file_data['datapackage.json']['upload_query']['key'])
+
+        descriptor = json.dumps(dict(
+            name=self.package,
+            resources=[dict(name='data', path='data/data.csv')]))
+        s3.put_object(Bucket=bucket_name, Key=blob_key, Body='data')
+        s3.put_object(Bucket=bucket_name,
+                      Key=bit_store.build_s3_key('datapackage.json'),
+                      Body=descriptor)
+        logic.Package.finalize_publish(self.user_id, self.datapackage_url)
+
+        package = Package.get_by_publisher(self.publisher, self.package)
+        self.assertEqual('%s/%s' % (self.app.config['BITSTORE_URL'], blob_key),
+                         package.descriptor['resources'][0]['path'])
+        self.assertResourcesExist(bit_store, package.descriptor)
+        # the stored descriptor is kept as uploaded
+        self.assertEqual(descriptor, bit_store.get_metadata_body())
+
+        # nothing is uploaded or read again for an unchanged package
+        descriptor_md5 = base64.b64encode(
+            hashlib.md5(descriptor.encode('utf-8')).digest()).decode('ascii')
+        file_data = self.authorize(descriptor_md5)
+        self.assertTrue(file_data['datapackage.json']['exists'])
+        self.assertTrue(file_data['data/data.csv']['exists'])
+        self.assertNotIn('upload_url', file_data['data/data.csv'])
+        with patch('app.bitstore.BitStore.get_metadata_body') as get_body:
+            logic.Package.finalize_publish(self.user_id, self.datapackage_url)
+            self.assertFalse(get_body.called)
+
+        bit_store.copy_to_new_version('1.0')
+        tagged = BitStore(self.publisher, self.package, '1.0')
+        self.assertEqual(
+            sorted([tagged.build_s3_key('datapackage.json'),
+                    tagged.build_s3_key(tagged.manifest_name)]),
+            sorted(BitStore.iter_keys(tagged.build_s3_key(''))))
+        self.assertIn(blob_key,
+                      [f['key'] for f in tagged.get_manifest()['files']])
+
+    @mock_s3
+    def test_publish_keeps_content_addressed_readme(self):
+        s3 = boto3.client('s3')
+        bucket_name = self.app.config['S3_BUCKET_NAME']
+        s3.create_bucket(Bucket=bucket_name)
+        bit_store = BitStore(self.publisher, self.package)
+        readme_key = bit_store.build_s3_blob_key(
+            '17820a67b6713318ce7ea518ae110778')
+
+        file_data = logic.generate_signed_url(self.user_id, {
+            'metadata': {'owner': self.publisher, 'name': self.package},
+            'filedata': {
+                'datapackage.json': {'name': 'datapackage.json',
+                                     'md5': 'jXd/OF09/siBXSD3SWAm3A=='},
+                'README.md': {'name': 'README.md',
+                              'md5': 'F4IKZ7ZxMxjOfqUYrhEHeA=='}
+            }})['filedata']
+        self.assertEqual(readme_key,
+                         file_data['README.md']['upload_query']['key'])
+        s3.put_object(Bucket=bucket_name, Key=readme_key, Body='# readme')
+        s3.put_object(Bucket=bucket_name,
+                      Key=bit_store.build_s3_key('datapackage.json'),
+                      Body=json.dumps(dict(name=self.package)))
+        logic.Package.finalize_publish(self.user_id, self.datapackage_url)
+
+        self.assertEqual(readme_key, bit_store.get_manifest()['readme'])
+        package = Package.get_by_publisher(self.publisher, self.package)
+        self.assertEqual('# readme', package.readme)
+
+        bit_store.copy_to_new_version('1.0')
+        tagged = BitStore(self.publisher, self.package, '1.0')
+        self.assertEqual(readme_key, tagged.get_readme_object_key())
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
 class HelpersTest(unittest.TestCase):
 
     @classmethod
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app
+from app.bitstore import BitStore, LocalStore
+from app.database import db
+from app.logic.reconcile import Reconciler, merge_join
+from app.package.models import Package, PackageStateEnum, PackageTag
+from app.profile.models import Publisher
+
+
+class ReconcileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.root = tempfile.mkdtemp()
+        self.app.config['BITSTORE_LOCAL_ROOT'] = self.root
+        self.app.config['S3'] = LocalStore(self.app.config)
+        self.app.config['RECONCILE_ORPHAN_GRACE'] = -1
+        self.store = self.app.config['S3']
+        self.app.app_context().push()
+        db.drop_all()
+        db.create_all()
+
+        publisher = Publisher(name='pub')
+        package = Package(name='a')
+        package.tags.append(PackageTag(tag='latest'))
+        package.tags.append(PackageTag(tag='1.0'))
+        publisher.packages.append(package)
+        publisher.packages.append(Package(name='a-b',
+                                          status=PackageStateEnum.deleted))
+        publisher.packages.append(Package(name='c'))
+        db.session.add(publisher)
+        db.session.commit()
+
+        self.put('a', 'latest', 'public-read')
+        self.put('a', 'old', 'public-read')
+        self.put('a-b', 'latest', 'public-read')
+        self.put('zz', 'latest', 'private')
+
+    def put(self, package, version, acl):
+        key = BitStore('pub', package, version).build_s3_key('datapackage.json')
+        self.store.put_object(Bucket='test', Key=key, Body='{}', ACL=acl)
+        return key
+
+    def issues(self, reconciler):
+        return sorted((issue['type'], issue['package'], issue.get('version'),
+                       issue['fixed'])
+                      for issue in reconciler.run())
+
+    def test_reports_drift(self):
+        self.assertEqual([
+            ('acl_mismatch', 'a-b', 'latest', False),
+            ('missing_objects', 'c', None, False),
+            ('missing_version', 'a', '1.0', False),
+            ('orphaned_prefix', 'zz', None, False),
+            ('orphaned_version', 'a', 'old', False)],
+            self.issues(Reconciler(page_size=1)))
+
+    def test_recent_orphans_are_not_reported(self):
+        self.app.config['RECONCILE_ORPHAN_GRACE'] = 3600
+        types = [issue['type'] for issue in Reconciler().run()]
+        self.assertNotIn('orphaned_prefix', types)
+
+    def test_fixes_acl_and_orphans(self):
+        issues = self.issues(Reconciler(fix=True))
+        self.assertIn(('acl_mismatch', 'a-b', 'latest', True), issues)
+        self.assertIn(('orphaned_prefix', 'zz', None, True), issues)
+        self.assertIn(('missing_objects', 'c', None, False), issues)
+
+        key = BitStore('pub', 'a-b').build_s3_key('datapackage.json')
+        self.assertEqual('private', self.store.get_meta(key)['acl'])
+        self.assertEqual(['pub/a-b/', 'pub/a/'], sorted(
+            set('/'.join(key.split('/')[1:3]) + '/'
+                for key in BitStore.iter_keys('metadata/'))))
+        self.assertEqual([], [issue for issue in Reconciler().run()
+                              if issue['type'] in ('acl_mismatch',
+                                                   'orphaned_prefix')])
+
+    def test_resumes_from_checkpoint(self):
+        checkpoint = os.path.join(self.root, 'checkpoint.json')
+        reconciler = Reconciler(checkpoint=checkpoint, checkpoint_every=1)
+        # prefixes are compared as bytes: 'a-b/' sorts before 'a/'
+        reconciler.save_checkpoint('pub/a-b/')
+
+        self.assertEqual(['a', 'c', 'zz'], sorted(set(
+            issue['package'] for issue in reconciler.run())))
+        self.assertFalse(os.path.exists(checkpoint))
+
+        runs = Reconciler(checkpoint=checkpoint, checkpoint_every=1).run()
+        self.assertEqual('a-b', next(runs)['package'])
+        self.assertEqual('a', next(runs)['package'])
+        with open(checkpoint) as f:
+            self.assertEqual({'after': 'pub/a-b/'}, json.load(f))
+
+    def test_merge_join(self):
+        left = iter([('a', 1), ('c', 3)])
+        right = iter([('b', 2), ('c', 4), ('d', 5)])
+        self.assertEqual([('a', 1, None), ('b', None, 2), ('c', 3, 4),
+                          ('d', None, 5)], list(merge_join(left, right)))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.root)
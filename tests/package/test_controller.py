@@ -105,6 +105,85 @@ class GetMetaDataTestCase(unittest.TestCase):
             db.engine.dispose()
 
 
+class GetBulkMetaDataTestCase(unittest.TestCase):
+    url = '/api/package/_bulk'
+
+    def setUp(self):
+        self.publisher = 'test_publisher'
+        self.app = create_app()
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+            publisher = Publisher(name=self.publisher)
+            for name in ['test_package1', 'test_package2']:
+                publisher.packages.append(Package(name=name,
+                                                  descriptor={'name': name}))
+            db.session.add(publisher)
+            db.session.commit()
+
+    def test_returns_status_for_each_package(self):
+        response = self.client.post(self.url, data=json.dumps({
+            'packages': [
+                {'publisher': self.publisher, 'package': 'test_package1'},
+                {'publisher': self.publisher, 'package': 'test_package2'},
+                {'publisher': self.publisher, 'package': 'unknown'}]}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)['data']
+        self.assertEqual(len(data), 3)
+        package = data['test_publisher/test_package1']
+        self.assertEqual(package['status'], 200)
+        self.assertEqual(package['package']['name'], 'test_package1')
+        self.assertEqual(package['package']['publisher'], self.publisher)
+        self.assertEqual(data['test_publisher/test_package2']['status'], 200)
+        self.assertEqual(data['test_publisher/unknown']['status'], 404)
+
+    def test_accepts_ids_query_parameter(self):
+        response = self.client.get(
+            self.url + '?ids=test_publisher/test_package1,unknown/test_package2')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)['data']
+        self.assertEqual(data['test_publisher/test_package1']['status'], 200)
+        self.assertEqual(data['unknown/test_package2']['status'], 404)
+
+    def test_throw_400_if_batch_too_large(self):
+        self.app.config['BULK_PACKAGE_MAX_BATCH_SIZE'] = 1
+        response = self.client.get(
+            self.url + '?ids=test_publisher/test_package1,test_publisher/test_package2')
+        self.assertEqual(response.status_code, 400)
+
+    def test_throw_400_if_no_packages_or_invalid_ids(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.url + '?ids=test_publisher')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url,
+                                    data=json.dumps({'packages': [{}]}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_throw_400_if_body_is_not_a_package_list(self):
+        package = {'publisher': self.publisher, 'package': 'test_package1'}
+        for body in ([package], {'packages': package}, 'packages', None,
+                     {'packages': [dict(package, publisher=['a'])]},
+                     {'packages': [dict(package, package={'a': 1})]},
+                     {'packages': [dict(package, package=1)]},
+                     {'packages': [dict(package, package='')]}):
+            response = self.client.post(self.url, data=json.dumps(body),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, data='{',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.engine.dispose()
+
+
 class GetAllMetaDataTestCase(unittest.TestCase):
     def setUp(self):
         self.publisher = 'test_publisher'
@@ -133,6 +212,53 @@ class GetAllMetaDataTestCase(unittest.TestCase):
         self.assertEqual(len(data['data']), 2)
         self.assertEqual(response.status_code, 200)
 
+    def test_returns_name_status_and_updated_at(self):
+        response = self.client.get('/api/package/%s' % (self.publisher,))
+        data = json.loads(response.data)
+        self.assertEqual(data['data'], [self.package1, self.package2])
+        package = data['packages'][0]
+        self.assertEqual(package['name'], self.package1)
+        self.assertEqual(package['status'], 'ACTIVE')
+        self.assertIsNotNone(package['updated_at'])
+        self.assertIsNone(data['next'])
+
+    def test_paginates_with_after(self):
+        response = self.client.get('/api/package/%s?limit=1' % (self.publisher,))
+        data = json.loads(response.data)
+        self.assertEqual(data['data'], [self.package1])
+        self.assertEqual(data['next'], self.package1)
+        response = self.client.get('/api/package/%s?limit=1&after=%s'
+                                   % (self.publisher, data['next']))
+        data = json.loads(response.data)
+        self.assertEqual(data['data'], [self.package2])
+
+    def test_filters_by_status(self):
+        with self.app.app_context():
+            logic.Package.change_status(self.publisher, self.package2,
+                                        PackageStateEnum.deleted)
+        response = self.client.get('/api/package/%s?status=active'
+                                   % (self.publisher,))
+        data = json.loads(response.data)
+        self.assertEqual(data['data'], [self.package1])
+        response = self.client.get('/api/package/%s?status=deleted'
+                                   % (self.publisher,))
+        data = json.loads(response.data)
+        self.assertEqual(data['data'], [self.package2])
+
+    def test_throw_400_if_status_is_invalid(self):
+        response = self.client.get('/api/package/%s?status=unknown'
+                                   % (self.publisher,))
+        self.assertEqual(response.status_code, 400)
+
+    def test_throw_400_if_limit_is_not_positive(self):
+        for limit in ('0', '-1'):
+            response = self.client.get('/api/package/%s?limit=%s'
+                                       % (self.publisher, limit))
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/package/%s?limit=5000'
+                                   % (self.publisher,))
+        self.assertEqual(response.status_code, 200)
+
     def test_throw_500_if_db_not_set_up(self):
         with self.app.app_context():
             db.drop_all()
@@ -206,15 +332,15 @@ class FinalizeMetaDataTestCase(unittest.TestCase):
 
     @patch('app.logic.Package.create_or_update')
     @patch('app.bitstore.BitStore.get_metadata_body')
-    @patch('app.bitstore.BitStore.get_readme_object_key')
+    @patch('app.bitstore.BitStore.save_manifest')
     @patch('app.bitstore.BitStore.get_s3_object')
     @patch('app.bitstore.BitStore.change_acl')
     def test_return_200_if_all_right(self, change_acl, get_s3_object,
-                                     get_readme_object_key,
+                                     save_manifest,
                                      get_metadata_body, create_or_update):
         get_metadata_body.return_value = json.dumps(dict(name='package'))
         create_or_update.return_value = None
-        get_readme_object_key.return_value = ''
+        save_manifest.return_value = dict(files=[], readme='README.md')
         get_s3_object.return_value = ''
         change_acl.return_value = None
         auth = "%s" % self.jwt
@@ -224,11 +350,14 @@ class FinalizeMetaDataTestCase(unittest.TestCase):
                                     content_type='application/json')
         self.assertEqual(200, response.status_code)
         data = json.loads(response.data)
-        self.assertEqual({'status': 'queued'}, data)
+        self.assertEqual({'status': 'queued', 'job_id': 1}, data)
 
+    @patch('app.bitstore.BitStore.save_manifest')
     @patch('app.bitstore.BitStore.get_metadata_body')
-    def test_throw_500_if_failed_to_get_data_from_s3(self, body_mock):
+    def test_throw_500_if_failed_to_get_data_from_s3(self, body_mock,
+                                                     save_manifest):
         body_mock.return_value = None
+        save_manifest.return_value = dict(files=[], readme=None)
         auth = "%s" % self.jwt
         response = self.client.post(self.url,
                                     data=json.dumps(dict(datapackage=self.datapackage_url)),
@@ -248,6 +377,41 @@ class FinalizeMetaDataTestCase(unittest.TestCase):
                                     content_type='application/json')
         self.assertEqual(400, response.status_code)
 
+    def test_queued_job_status_is_visible_to_its_owner_only(self):
+        self.app.config['PUBLISH_JOBS_INLINE'] = False
+        response = self.client.post(self.url,
+                                    data=json.dumps(dict(datapackage=self.datapackage_url)),
+                                    headers={'Auth-Token': self.jwt},
+                                    content_type='application/json')
+        self.assertEqual(200, response.status_code)
+        job_id = json.loads(response.data)['job_id']
+
+        response = self.client.get('%s/%d' % (self.url, job_id),
+                                   headers={'Auth-Token': self.jwt})
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.data)
+        self.assertEqual('QUEUED', data['status'])
+        self.assertEqual(self.datapackage_url, data['datapackage'])
+
+        response = self.client.get('%s/%d' % (self.url, job_id),
+                                   headers={'Auth-Token': self.jwt1})
+        self.assertEqual(404, response.status_code)
+
+    @patch('app.bitstore.BitStore.save_manifest')
+    @patch('app.bitstore.BitStore.get_metadata_body')
+    def test_failed_job_status_is_reported(self, body_mock, save_manifest):
+        body_mock.return_value = None
+        save_manifest.return_value = dict(files=[], readme=None)
+        response = self.client.post(self.url,
+                                    data=json.dumps(dict(datapackage=self.datapackage_url)),
+                                    headers={'Auth-Token': self.jwt},
+                                    content_type='application/json')
+        self.assertEqual(500, response.status_code)
+
+        response = self.client.get('%s/1' % self.url,
+                                   headers={'Auth-Token': self.jwt})
+        self.assertEqual('FAILED', json.loads(response.data)['status'])
+
     def tearDown(self):
         with self.app.app_context():
             db.session.remove()
@@ -297,12 +461,12 @@ class EndToEndTestCase(unittest.TestCase):
     @patch('app.logic.Package.create_or_update_tag')
     @patch('app.logic.Package.create_or_update')
     @patch('app.bitstore.BitStore.get_metadata_body')
-    @patch('app.bitstore.BitStore.get_readme_object_key')
+    @patch('app.bitstore.BitStore.save_manifest')
     @patch('app.bitstore.BitStore.get_s3_object')
     @patch('app.bitstore.BitStore.change_acl')
-    @patch('app.bitstore.BitStore.generate_pre_signed_post_object')
-    def test_publish_end_to_end(self, generate_pre_signed_post_object,
-                                change_acl, get_s3_object,get_readme_object_key,
+    @patch('app.bitstore.BitStore.generate_pre_signed_posts')
+    def test_publish_end_to_end(self, generate_pre_signed_posts,
+                                change_acl, get_s3_object, save_manifest,
                                 get_metadata_body, create_or_update,
                                 create_or_update_tag,copy_to_new_version):
 
@@ -340,8 +504,8 @@ class EndToEndTestCase(unittest.TestCase):
         self.assertEqual(rv.status_code, 200)
 
         # Get S3 link for uploading Data file
-        generate_pre_signed_post_object.return_value = {'url': 'https://trial_url',
-                                                        'fields': {}}
+        generate_pre_signed_posts.return_value = [{'url': 'https://trial_url',
+                                                   'fields': {}}]
         rv = self.client.post(self.bitstore_url,
                               data=json.dumps({
                                   'metadata': {'owner': self.publisher_name, 'name': self.package},
@@ -362,7 +526,7 @@ class EndToEndTestCase(unittest.TestCase):
         # Finalize
         get_metadata_body.return_value = json.dumps(dict(name='package'))
         create_or_update.return_value = None
-        get_readme_object_key.return_value = ''
+        save_manifest.return_value = dict(files=[], readme='README.md')
         get_s3_object.return_value = ''
         change_acl.return_value = None
         rv = self.client.post(self.finalize_url,
@@ -372,7 +536,7 @@ class EndToEndTestCase(unittest.TestCase):
         # Test Data
         self.assertEqual(200, rv.status_code)
         data = json.loads(rv.data)
-        self.assertEqual({'status': 'queued'}, data)
+        self.assertEqual({'status': 'queued', 'job_id': 1}, data)
 
     def tearDown(self):
         with self.app.app_context():
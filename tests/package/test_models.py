@@ -81,6 +81,15 @@ class PackageTestCase(unittest.TestCase):
         pkg = Package.get_by_publisher(self.publisher_one, 'not_a_package')
         self.assertIsNone(pkg)
 
+    def test_get_many_by_publisher(self):
+        pkgs = Package.get_many_by_publisher([
+            (self.publisher_one, self.package_one),
+            (self.publisher_two, self.package_one)])
+        self.assertEqual(1, len(pkgs))
+        pkg = pkgs[(self.publisher_one, self.package_one)]
+        self.assertEqual(pkg.name, self.package_one)
+        self.assertEqual(pkg.publisher.name, self.publisher_one)
+
     @classmethod
     def teardown_class(self):
         with self.app.app_context():
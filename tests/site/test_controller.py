@@ -15,7 +15,8 @@ import os
 from flask_testing import TestCase
 from app.database import db
 from app.package.models import Package, PackageTag
-from app.profile.models import User, Publisher, UserRoleEnum
+from app.profile.models import User, Publisher, UserRoleEnum, PublisherUser
+from app.auth.jwt import JWT
 
 
 class WebsiteTestCase(unittest.TestCase):
@@ -44,6 +45,13 @@ class WebsiteTestCase(unittest.TestCase):
         self.assertEqual(rv.status_code, 200)
         self.assertTrue('DEMO - CBOE Volatility Index' in rv.data)
 
+    @patch('app.logic.Package.get_many')
+    def test_home_loads_showcase_packages_once(self, get_many):
+        get_many.return_value = [None] * 6
+        self.client.get('/')
+        self.client.get('/?page=2')
+        self.assertEqual(get_many.call_count, 1)
+
     def test_logout_page(self):
         rv = self.client.get('/logout')
         self.assertNotEqual(404, rv.status_code)
@@ -56,6 +64,25 @@ class WebsiteTestCase(unittest.TestCase):
         rv = self.client.get('/%s' % self.publisher)
         self.assertEqual(200, rv.status_code)
 
+    def test_publisher_page_shows_edit_badge_for_owner(self):
+        descriptor = json.loads(open('fixtures/datapackage.json').read())
+        with self.app.app_context():
+            user = User(id=1, name=self.publisher, secret='super_secret')
+            publisher = Publisher(name=self.publisher)
+            publisher.packages.append(Package(name=self.package,
+                                              descriptor=descriptor))
+            association = PublisherUser(role=UserRoleEnum.owner)
+            association.publisher = publisher
+            user.publishers.append(association)
+            db.session.add(user)
+            db.session.commit()
+        rv = self.client.get('/%s' % self.publisher)
+        self.assertNotIn('can edit', rv.data)
+        self.client.set_cookie('localhost', 'jwt',
+                               JWT(self.app.config['JWT_SEED'], 1).encode())
+        rv = self.client.get('/%s' % self.publisher)
+        self.assertIn('can edit', rv.data)
+
     def test_publisher_page_results_404_for_non_existing_publisher(self):
         with self.app.app_context():
             publisher = Publisher(name=self.publisher)
@@ -124,6 +151,66 @@ class WebsiteTestCase(unittest.TestCase):
             db.engine.dispose()
 
 
+class PageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.publisher = 'demo'
+        self.package = 'demo-package'
+        self.app = create_app()
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+            descriptor = json.loads(open('fixtures/datapackage.json').read())
+            publisher = Publisher(name=self.publisher)
+            package = Package(name=self.package, descriptor=descriptor)
+            publisher.packages.append(package)
+            db.session.add(publisher)
+            db.session.commit()
+
+    @patch('app.logic.Package.get')
+    def test_anonymous_page_is_rendered_once(self, get):
+        descriptor = json.loads(open('fixtures/datapackage.json').read())
+        get.return_value = dict(descriptor=descriptor,
+                                bitstore_url='https://bits',
+                                short_readme='', readme='')
+        first = self.client.get('/demo/demo-package')
+        second = self.client.get('/demo/demo-package')
+        self.assertEqual(200, second.status_code)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(get.call_count, 1)
+
+    def test_page_is_invalidated_when_package_changes(self):
+        rv = self.client.get('/demo/demo-package')
+        self.assertIn('DEMO - CBOE Volatility Index', rv.data)
+        with self.app.app_context():
+            package = Package.query.filter_by(name=self.package).one()
+            descriptor = dict(package.descriptor)
+            descriptor['title'] = 'Changed Title'
+            package.descriptor = descriptor
+            db.session.add(package)
+            db.session.commit()
+        rv = self.client.get('/demo/demo-package')
+        self.assertIn('Changed Title', rv.data)
+
+    def test_not_found_pages_are_not_cached(self):
+        rv = self.client.get('/demo/other-package')
+        self.assertEqual(404, rv.status_code)
+        with self.app.app_context():
+            publisher = Publisher.query.filter_by(name=self.publisher).one()
+            publisher.packages.append(Package(name='other-package',
+                                              descriptor={}))
+            db.session.add(publisher)
+            db.session.commit()
+        rv = self.client.get('/demo/other-package')
+        self.assertEqual(200, rv.status_code)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.engine.dispose()
+
+
 class SignupEndToEndTestCase(unittest.TestCase):
     def setUp(self):
         self.app = create_app()
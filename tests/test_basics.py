@@ -7,8 +7,13 @@ from __future__ import unicode_literals
 import sys
 import os
 import unittest
+from mock import patch
 from app import create_app, get_config_class_name
+from app.auth.jwt import JWT
 from app.config import BaseConfig
+from app.database import db
+from app.profile.models import User
+import app.logic as logic
 
 
 class BasicTestCase(unittest.TestCase):
@@ -34,3 +39,48 @@ class BasicTestCase(unittest.TestCase):
         setattr(base_config, 'TEST_CONF', None)
 
         self.assertRaises(Exception, base_config.check_required_config)
+
+
+class UserFromCookieTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+            user = User(id=1, name='test_user', secret='super_secret',
+                        email='test@test.com')
+            db.session.add(user)
+            db.session.commit()
+        self.client.set_cookie('localhost', 'jwt',
+                               JWT(self.app.config['JWT_SEED'], 1).encode())
+
+    def test_user_is_loaded_once_for_many_requests(self):
+        with patch('app.logic.User.get_session_user',
+                   wraps=logic.User.get_session_user) as get_session_user:
+            rv = self.client.get('/')
+            self.assertIn('Welcome test_user!', rv.data)
+            rv = self.client.get('/')
+            self.assertIn('Welcome test_user!', rv.data)
+            self.assertEqual(get_session_user.call_count, 1)
+
+    def test_user_is_not_loaded_for_static_files(self):
+        with patch('app.logic.User.get_session_user') as get_session_user:
+            self.client.get('/static/css/style.css')
+            self.assertEqual(get_session_user.call_count, 0)
+
+    def test_cached_user_is_dropped_when_user_changes(self):
+        self.client.get('/')
+        with self.app.app_context():
+            user = User.query.get(1)
+            user.name = 'renamed_user'
+            db.session.add(user)
+            db.session.commit()
+        rv = self.client.get('/')
+        self.assertIn('Welcome renamed_user!', rv.data)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.engine.dispose()